@@ -45,6 +45,16 @@ config_default = {
     # time string format
     'time_str_format': '%Y-%m-%d %H:%M:%S.%f',
 
+    # layout of raw data in new data file
+    # 'chunked': one dataset of all queues for each harmonic (fast for long tests)
+    # 'queue': one group for each queue (old versions)
+    'raw_layout': 'chunked',
+    # compression of raw data in 'chunked' layout: None, 'lzf' or 'gzip'
+    'raw_compression': None,
+    # write data file in SWMR mode while recording, so other processes can read it
+    # (DataSaver.load_file(path, swmr=True) and DataSaver.poll). needs HDF5 >= 1.10
+    'swmr_mode': False,
+
     # if marked data shown when showing all data
     'show_marked_when_all': False,
 
@@ -234,6 +244,9 @@ config_default = {
     'export_datafiletype': ';;'.join([
         # 'csv file (*.csv)',
         'excel file (*.xlsx)',
+        # parquet and feather need pyarrow. one file is saved for each sheet
+        'parquet file (*.parquet)',
+        'feather file (*.feather)',
         # 'json file (*.json)',
         # 'hdf5 file (*.h5)',
         # 'Matlab file (*.mat)',
@@ -385,6 +398,7 @@ config_default = {
         ('fixspan',   'Fix span'),
         ('fixcenter', 'Fix center'),
         ('fixcntspn',  'Fix center&span'),
+        ('predictive', 'Predictive'),
         # ('usrdef',    'User-defined...'),
     ]),
 
@@ -732,6 +746,33 @@ config_default = {
     #     current_span * (1 - change_thresh[0/1]) # 
     # )
 
+    # fast path fitting: if the previous fitting of the same chn & harm is good and the peak is still well inside the span, use the previous result as initial values and skip the peak finding
+    'fastfit': True,
+    'fastfit_chisqr_thresh': 0.01, # max normalized chisqr (chisqr / sum of squares of G & B) of a good fitting. The full guess is used if the fitting is worse than this value
+    'fastfit_cen_range': 0.3, # cen_trk in (cen of span +/- fastfit_cen_range*span) is considered as well inside the span
+
+    # predictive tracking: a Kalman filter on (cen, wid, dcen/dt, dwid/dt) of each chn & harm predicts the peak at next scan
+    # span = predicted wid * 2 * wid_ratio_range[0] + 2 * predictive_nsigma * (std of predicted cen)
+    'predictive_q': 0.01, # process noise (white noise of acceleration) of cen & wid in HWHM^2/s^3
+    'predictive_r': 0.05, # measurement noise (std) of cen & wid in HWHM
+    'predictive_nsigma': 3, # number of std of predicted cen added to each side of span
+    'predictive_gate': 5, # the filter is reset if the peak is found out of predicted cen +/- predictive_gate * std
+
+    # adaptive steps: use the minimum number of points of sweep which gives adaptive_steps_pts_per_hwhm points in a HWHM of the tracked peak
+    # the steps set in harmonic settings (lineEdit_scan_harmsteps) is used as the max value
+    'adaptive_steps': False,
+    'adaptive_steps_pts_per_hwhm': 10, # number of points in a HWHM
+    'adaptive_steps_min': 50, # min number of points of sweep
+
+    # coarse-to-fine fitting: for data with many points, fit the decimated data first (stage 1) and use the result as the initial values of fitting the full data (stage 2)
+    'coarsefit': True,
+    'coarsefit_min_pts': 1000, # use coarse-to-fine fitting if the number of points for fitting >= this value
+    'coarsefit_method': 'peak', # 'step': use every coarsefit_step-th point; 'peak': more points around the peaks (guessed values)
+    'coarsefit_step': 5, # for 'step' method
+    'coarsefit_pts': 200, # number of points for 'peak' method
+    'coarsefit_xtol': 1e-6, # xtol of stage 1
+    'coarsefit_ftol': 1e-6, # ftol of stage 1
+
     ########### logging settings ##############
 
     'logger_config': {
@@ -803,6 +844,8 @@ settings_default = {
     # copies of same keys in config_default
     'max_harmonic': config_default['max_harmonic'],
     'time_str_format': config_default['time_str_format'],
+    'raw_layout': config_default['raw_layout'],
+    'raw_compression': config_default['raw_compression'],
     'vna_path': config_default['vna_path'],
 
     # add na_path on your computer if it is not in the 
@@ -0,0 +1,361 @@
+'''
+array based store of a data table (samp, ref, samp_ref, ref_ref) of DataSaver
+The values of each harmonic (marks, fs, gs, ps) are saved in preallocated 2D float64 arrays
+(capacity x harmonics) instead of lists in the cells of a DataFrame.
+The arrays grow geometrically when rows are appended.
+Time (t) is saved as int64 of ns since epoch. Time strings (time_str_format) are only
+made for the DataFrame (display and export).
+The DataFrame of the table (lists in cells, as used by the rest of the program) is made lazily
+and cached until the data in the store is changed.
+Rows are found by queue_id with a dict {queue_id: position}, which is kept with appended rows
+and rebuilt when the queue_id column is changed otherwise.
+'''
+
+import itertools
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# columns with a single value
+single_cols = ['queue_id', 't', 'temp']
+# columns with a value for each harmonic
+harm_cols = ['marks', 'fs', 'gs', 'ps']
+
+# int64 of NaT for empty time
+nat_int = np.iinfo(np.int64).min
+
+# counter of data versions (unique across stores)
+_ver_counter = itertools.count(1)
+
+# number of rows preallocated for a new store
+init_capacity = 64
+# factor of capacity growing
+growth_factor = 2
+
+
+def t_str_to_ns(t, time_str_format):
+    '''
+    convert time strings to int of ns since epoch
+    t: list, array or pd.series of str
+    empty or wrong strings are converted to nat_int
+    return ndarray of int64
+    '''
+    t = pd.to_datetime(pd.Series(t, dtype=object), format=time_str_format, errors='coerce')
+    return t.values.astype('datetime64[ns]').astype('int64')
+
+
+def t_ns_to_str(t, time_str_format):
+    '''
+    convert int of ns since epoch to time strings
+    nat_int is converted to ''
+    return list of str
+    '''
+    t = pd.DatetimeIndex(np.asarray(t, dtype='int64').astype('datetime64[ns]'))
+    return [x if isinstance(x, str) else '' for x in t.strftime(time_str_format)]
+
+
+def t_to_ns(t, time_str_format):
+    '''
+    convert a single time (str, datetime or int of ns) to int of ns since epoch
+    empty or wrong strings are converted to nat_int
+    '''
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    if isinstance(t, str):
+        return int(t_str_to_ns([t], time_str_format)[0])
+    if pd.isnull(t):
+        return nat_int
+    return pd.Timestamp(t).value
+
+
+def lists_to_array(values, n_harm):
+    '''
+    convert a sequence of lists (one list for each row) to 2D float64 array (rows x n_harm)
+    None in lists or rows are converted to nan
+    lists longer than n_harm are cut and shorter ones are filled with nan
+    '''
+    values = list(values)
+    try:
+        arr = np.array(values, dtype=float)
+        if arr.shape == (len(values), n_harm):
+            return arr
+    except (ValueError, TypeError): # rows with different length or None rows
+        pass
+
+    arr = np.full((len(values), n_harm), np.nan)
+    for i, row in enumerate(values):
+        if row is None or np.isscalar(row):
+            continue
+        row = np.array(row, dtype=float)[:n_harm]
+        arr[i, :len(row)] = row
+    return arr
+
+
+class ChannelStore:
+    def __init__(self, n_harm, time_str_format, capacity=init_capacity):
+        '''
+        n_harm: number of harmonics (columns of the harmonic arrays)
+        time_str_format: format of time strings 
+        capacity: number of rows preallocated
+        '''
+        self.n_harm = n_harm
+        self.time_str_format = time_str_format
+        self.nrows = 0 # number of rows stored
+        self._df = None # cached DataFrame
+        self._arrs = self._empty_arrs(capacity)
+        self._col_ver = {} # version of each column
+        self._qid_pos = {} # {queue_id: position} (see self.position)
+        self._qid_ver = None # version of queue_id column of self._qid_pos
+        self._range_ver = None # version of index known to be 0, 1, ... (see self._append_index)
+        self.changed()
+
+
+    def _empty_arrs(self, capacity):
+        '''
+        dict of empty arrays with capacity rows
+        '''
+        arrs = {
+            'index': np.arange(capacity, dtype='int64'), # row labels of DataFrame
+            'queue_id': np.zeros(capacity, dtype='int64'),
+            't': np.full(capacity, nat_int, dtype='int64'), # ns since epoch
+            'temp': np.full(capacity, np.nan),
+        }
+        for col in harm_cols:
+            arrs[col] = np.full((capacity, self.n_harm), np.nan)
+        return arrs
+
+
+    def __len__(self):
+        return self.nrows
+
+
+    @property
+    def capacity(self):
+        return self._arrs['queue_id'].shape[0]
+
+
+    @property
+    def index(self):
+        return self.col('index')
+
+
+    def col(self, col):
+        '''
+        view of col of the stored rows
+        1D array for single value columns and index
+        2D array (rows x harmonics) for harmonic columns
+        call self.changed() after changing the values in it
+        '''
+        return self._arrs[col][:self.nrows]
+
+
+    def changed(self, cols=None):
+        '''
+        clear the cached DataFrame and change the version of data
+        cols: list of changed columns. None for all columns and index
+        '''
+        self._df = None
+        self.ver = next(_ver_counter) # version of data, changed when any data is changed
+        for col in (self._arrs.keys() if cols is None else cols):
+            self._col_ver[col] = self.ver
+
+
+    def col_version(self, *cols):
+        '''
+        tuple of versions of cols
+        it can be used as a key of values calculated from these columns
+        '''
+        return tuple(self._col_ver[col] for col in cols)
+
+
+    def reserve(self, nrows):
+        '''
+        make sure the capacity is >= nrows
+        the capacity grows by growth_factor
+        '''
+        if nrows <= self.capacity:
+            return
+        capacity = max(nrows, int(self.capacity * growth_factor), init_capacity)
+        logger.info('grow capacity to %s', capacity)
+        arrs = self._empty_arrs(capacity)
+        for key, arr in self._arrs.items():
+            arrs[key][:self.nrows] = arr[:self.nrows]
+        self._arrs = arrs
+
+
+    def append(self, queue_id, t=nat_int, temp=np.nan, **harm_vals):
+        '''
+        append a row
+        t: time string or int of ns since epoch
+        harm_vals: values of harmonic columns (list or array). nan if not given
+        the index of rows are reset to 0, 1, ... (the same as DataFrame.append with ignore_index=True)
+        return the position of the new row
+        '''
+        self.reserve(self.nrows + 1)
+        pos = self.nrows
+        self.nrows += 1
+        # the queue_id index is kept if it is up to date
+        qid_current = self._qid_ver == self.col_version('queue_id')
+
+        self._arrs['queue_id'][pos] = queue_id
+        self._arrs['t'][pos] = t_to_ns(t, self.time_str_format)
+        self._arrs['temp'][pos] = temp
+        for col in harm_cols:
+            self._arrs[col][pos] = harm_vals.get(col, np.nan)
+        self._append_index(pos, self.nrows)
+
+        self.changed()
+        self._range_ver = self.col_version('index')
+        if qid_current:
+            self._qid_pos.setdefault(int(queue_id), pos)
+            self._qid_ver = self.col_version('queue_id')
+        return pos
+
+
+    def extend(self, queue_ids, t, temp, **harm_vals):
+        '''
+        append rows of arrays with the same length
+        t: ints of ns since epoch
+        harm_vals: 2D arrays (rows x harmonics) of harmonic columns. nan if not given
+        the index of rows are reset to 0, 1, ...
+        '''
+        n = len(queue_ids)
+        self.reserve(self.nrows + n)
+        pos = slice(self.nrows, self.nrows + n)
+        self.nrows += n
+
+        self._arrs['queue_id'][pos] = queue_ids
+        self._arrs['t'][pos] = t
+        self._arrs['temp'][pos] = temp
+        for col in harm_cols:
+            self._arrs[col][pos] = harm_vals.get(col, np.nan)
+        self._append_index(pos.start, pos.stop)
+        self.changed()
+        self._range_ver = self.col_version('index')
+
+
+    def _append_index(self, start, stop):
+        '''
+        set the index of appended rows (start to stop) to their positions
+        the index of existing rows is only reset if it is not 0, 1, ... already
+        '''
+        if self._range_ver != self.col_version('index'):
+            self._arrs['index'][:start] = np.arange(start)
+        self._arrs['index'][start:stop] = np.arange(start, stop)
+
+
+    def set_value(self, pos, col, val):
+        '''
+        set value of col at row pos
+        val of harmonic columns is a list or array of n_harm values (None is converted to nan)
+        val of t is time string or int of ns since epoch
+        '''
+        if col in harm_cols:
+            val = np.array(val, dtype=float)
+        elif col == 't':
+            val = t_to_ns(val, self.time_str_format)
+        self._arrs[col][pos] = val
+        self.changed([col])
+
+
+    def positions(self, queue_id):
+        '''
+        positions of rows with queue_id
+        '''
+        return np.flatnonzero(self.col('queue_id') == queue_id)
+
+
+    def position(self, queue_id):
+        '''
+        position of row with queue_id (the first one if queue_id is repeated)
+        None if queue_id doesn't exist
+        '''
+        if self._qid_ver != self.col_version('queue_id'): # rebuild the index
+            qids, first = np.unique(self.col('queue_id'), return_index=True)
+            self._qid_pos = dict(zip(qids.tolist(), first.tolist()))
+            self._qid_ver = self.col_version('queue_id')
+        return self._qid_pos.get(int(queue_id))
+
+
+    def take(self, positions):
+        '''
+        return a new store of rows at positions
+        the index of rows are kept
+        '''
+        positions = np.asarray(positions, dtype=int)
+        store = ChannelStore(self.n_harm, self.time_str_format, capacity=max(positions.size, init_capacity))
+        store.nrows = positions.size
+        for key, arr in self.col_items():
+            store._arrs[key][:store.nrows] = arr[positions]
+        return store
+
+
+    def col_items(self):
+        '''
+        iterate (col, view) of all columns and index
+        '''
+        for key in self._arrs:
+            yield key, self.col(key)
+
+
+    def reset_index(self):
+        '''
+        reset the index to 0, 1, ...
+        '''
+        self._arrs['index'][:self.nrows] = np.arange(self.nrows)
+        self.changed(['index'])
+        self._range_ver = self.col_version('index')
+
+
+    def to_dataframe(self):
+        '''
+        return the DataFrame of the table with lists in harmonic columns
+        and time strings in t
+        the DataFrame is cached until the data is changed.
+        Changing it doesn't change the store.
+        '''
+        if self._df is None:
+            data = {
+                'queue_id': self.col('queue_id').copy(),
+                't': t_ns_to_str(self.col('t'), self.time_str_format),
+                'temp': self.col('temp').copy(),
+            }
+            for col in harm_cols:
+                data[col] = self.col(col).tolist()
+            self._df = pd.DataFrame(data, index=self.index.copy(), columns=single_cols + harm_cols)
+        return self._df
+
+
+    @classmethod
+    def from_dataframe(cls, df, n_harm, time_str_format):
+        '''
+        make a store from DataFrame of the table (lists in harmonic columns)
+        t in df can be time strings or datetime
+        missed columns are filled with nan (NaT for t)
+        '''
+        nrows = df.shape[0]
+        store = cls(n_harm, time_str_format, capacity=max(nrows, init_capacity))
+        store.nrows = nrows
+        if nrows == 0:
+            return store
+
+        try:
+            store._arrs['index'][:nrows] = np.asarray(df.index, dtype='int64')
+        except (ValueError, TypeError): # not int index
+            store._arrs['index'][:nrows] = np.arange(nrows)
+        if 'queue_id' in df.columns:
+            store._arrs['queue_id'][:nrows] = df['queue_id'].values.astype('int64')
+        if 't' in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df['t']):
+                store._arrs['t'][:nrows] = df['t'].values.astype('datetime64[ns]').astype('int64')
+            else:
+                store._arrs['t'][:nrows] = t_str_to_ns(df['t'].values, time_str_format)
+        if 'temp' in df.columns:
+            store._arrs['temp'][:nrows] = pd.to_numeric(df['temp'], errors='coerce').values
+        for col in harm_cols:
+            if col in df.columns:
+                store._arrs[col][:nrows] = lists_to_array(df[col].values, n_harm)
+        return store
@@ -0,0 +1,264 @@
+'''
+streaming writers of exported data of DataSaver
+The sheets (S_channel, S_reference, R_channel, R_reference, S_<mech_key>, ...) are
+written by chunks of rows (DataFrames with the same columns), so the whole table is
+never copied in memory.
+Formats (by extension of file name):
+    .xlsx: one sheet for each table
+    .csv: all data tables in one file with column chn (the same as before)
+    .json: {key: df.to_dict()} of data tables (each table is collected before writing)
+    .parquet, .feather (.arrow): one file for each sheet (<name>_<sheet><ext>),
+            compressed (export_compression). time reference, sample description and
+            version are saved in the metadata of each file
+parquet and feather need pyarrow, which is only imported when they are used.
+'''
+
+import os
+import abc
+import csv
+import json
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# number of rows written at a time
+export_chunk_rows = 10000
+
+# compression of parquet and feather files: 'zstd', 'lz4' or None (feather), 'snappy', 'gzip' (parquet)
+export_compression = 'zstd'
+
+
+class SheetWriter(abc.ABC):
+    def __init__(self, path, meta):
+        '''
+        path: full path of the exported file
+        meta: dict of {'ver', 'exp_ref', 't_ref', 'sample_description'}
+        '''
+        self.path = path
+        self.meta = meta
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def start(self, sheet_columns):
+        '''
+        start exporting
+        sheet_columns: list of columns of all sheets to write
+        '''
+        pass
+
+
+    def start_sheet(self, name, key, columns):
+        '''
+        start a sheet
+        name: sheet name (e.g. 'S_channel')
+        key: name of the table (e.g. 'samp')
+        columns: list of columns of the chunks
+        '''
+        self.name = name
+        self.key = key
+        self.columns = columns
+
+
+    @abc.abstractmethod
+    def write(self, df):
+        '''
+        write a chunk (df) of rows of current sheet
+        '''
+
+
+    def end_sheet(self):
+        pass
+
+
+    def write_meta(self):
+        '''
+        write time reference and sample description
+        '''
+        pass
+
+
+    def close(self):
+        pass
+
+
+class ExcelSheetWriter(SheetWriter):
+    def __init__(self, path, meta):
+        super().__init__(path, meta)
+        self._writer = pd.ExcelWriter(path)
+
+
+    def start_sheet(self, name, key, columns):
+        super().start_sheet(name, key, columns)
+        self._row = 0
+
+
+    def write(self, df):
+        df.to_excel(self._writer, sheet_name=self.name, startrow=self._row, header=(self._row == 0))
+        self._row += df.shape[0] + (1 if self._row == 0 else 0)
+
+
+    def end_sheet(self):
+        if self._row == 0: # no rows
+            pd.DataFrame(columns=self.columns).to_excel(self._writer, sheet_name=self.name)
+
+
+    def write_meta(self):
+        pd.DataFrame.from_dict(self.meta['t_ref'], orient='index').to_excel(self._writer, sheet_name='time_reference', header=False)
+        pd.DataFrame.from_dict({'sample Description': self.meta['sample_description']}, orient='columns').to_excel(self._writer, sheet_name='sample_description', header=False, index=False)
+
+
+    def close(self):
+        self._writer.close()
+
+
+class CsvSheetWriter(SheetWriter):
+    def __init__(self, path, meta):
+        super().__init__(path, meta)
+        self._f = open(path, 'w', newline='')
+        csvwriter = csv.writer(self._f)
+        exp_ref = meta['exp_ref']
+        csvwriter.writerow(['Version'] + [meta['ver']] + [''] + ['t0'] + [exp_ref.get('t0')]+ [''] + ['shifted t0'] + [exp_ref.get('t0_shifted')])
+
+
+    def start(self, sheet_columns):
+        # union of columns of all sheets with column chn (the same order as pd.concat)
+        self._all_columns = list(dict.fromkeys(col for columns in sheet_columns for col in list(columns) + ['chn']))
+        pd.DataFrame(columns=self._all_columns).to_csv(self._f)
+
+
+    def write(self, df):
+        df.assign(chn=self.key).reindex(columns=self._all_columns).to_csv(self._f, header=False)
+
+
+    def close(self):
+        self._f.close()
+
+
+class JsonSheetWriter(SheetWriter):
+    def __init__(self, path, meta):
+        super().__init__(path, meta)
+        self._f = open(path, 'w')
+        self._f.write('{')
+
+
+    def start_sheet(self, name, key, columns):
+        super().start_sheet(name, key, columns)
+        self._chunks = []
+
+
+    def write(self, df):
+        self._chunks.append(df)
+
+
+    def end_sheet(self):
+        df = pd.concat(self._chunks) if self._chunks else pd.DataFrame(columns=self.columns)
+        self._chunks = []
+        self._f.write(json.dumps(self.key) + ': ' + json.dumps(df.to_dict()) + ', ')
+
+
+    def close(self):
+        self._f.write('"exp_ref": ' + json.dumps(self.meta['exp_ref']) + ', "ver": ' + json.dumps(self.meta['ver']) + '}')
+        self._f.close()
+
+
+class ArrowSheetWriter(SheetWriter):
+    def __init__(self, path, meta, compression=export_compression):
+        '''
+        write each sheet to <name>_<sheet><ext> by pyarrow
+        '''
+        import pyarrow # optional dependency
+        super().__init__(path, meta)
+        self._pa = pyarrow
+        self.compression = compression
+        self.paths = []
+        self._file_meta = {
+            'ver': json.dumps(meta['ver']),
+            'time_reference': json.dumps(meta['t_ref']),
+            'sample_description': json.dumps(meta['sample_description']),
+        }
+
+
+    def sheet_path(self, name):
+        base, ext = os.path.splitext(self.path)
+        return base + '_' + name + ext
+
+
+    def start_sheet(self, name, key, columns):
+        super().start_sheet(name, key, columns)
+        self._writer = None
+        self._schema = None
+
+
+    def _table(self, df):
+        table = self._pa.Table.from_pandas(df, schema=self._schema, preserve_index=True)
+        if self._schema is None:
+            self._schema = table.schema.with_metadata(dict(table.schema.metadata or {}, sheet=self.name, **self._file_meta))
+            table = table.replace_schema_metadata(self._schema.metadata)
+        return table
+
+
+    def write(self, df):
+        table = self._table(df)
+        if self._writer is None:
+            self._writer = self._open_writer(self.sheet_path(self.name), self._schema)
+            self.paths.append(self.sheet_path(self.name))
+        self._writer.write_table(table)
+
+
+    def end_sheet(self):
+        if self._writer is None: # no rows
+            self.write(pd.DataFrame({col: pd.Series(dtype='float64') for col in self.columns}))
+        self._writer.close()
+        self._writer = None
+
+
+class ParquetSheetWriter(ArrowSheetWriter):
+    def __init__(self, path, meta, compression=export_compression):
+        super().__init__(path, meta, compression=compression)
+        import pyarrow.parquet
+        self._pq = pyarrow.parquet
+
+
+    def _open_writer(self, path, schema):
+        return self._pq.ParquetWriter(path, schema, compression=self.compression)
+
+
+class FeatherSheetWriter(ArrowSheetWriter):
+    def __init__(self, path, meta, compression=export_compression):
+        super().__init__(path, meta, compression=compression)
+        import pyarrow.ipc
+        self._ipc = pyarrow.ipc
+
+
+    def _open_writer(self, path, schema):
+        # feather v2 is the arrow ipc file format
+        options = self._ipc.IpcWriteOptions(compression=self.compression)
+        return self._ipc.new_file(path, schema, options=options)
+
+
+# writers by extension
+sheet_writers = {
+    '.xlsx': ExcelSheetWriter,
+    '.csv': CsvSheetWriter,
+    '.json': JsonSheetWriter,
+    '.parquet': ParquetSheetWriter,
+    '.feather': FeatherSheetWriter,
+    '.arrow': FeatherSheetWriter,
+}
+
+
+def chunk_slices(nrows, chunk_rows=export_chunk_rows):
+    '''
+    split nrows rows into slices of chunk_rows rows
+    '''
+    for start in range(0, nrows, chunk_rows):
+        yield slice(start, min(start + chunk_rows, nrows))
@@ -12,40 +12,66 @@ You can browse the data with hdf5 UI software e.g. HDFCompass if you
 don't want to extract the data with code.
 dictionaries and dataframes are converted to json and are saved as text in the file
 
-.h5 -|- raw -|- samp -|-0-|-1(harmonic)-|-column 1: frequency   (f)
-     |       |        |   |             |-column 2: conductance (G)
-     |       |        |   |             --column 3: susceptance (B)
-     |       |        |   |-3
-     |       |        |   |-5
-     |       |        |   --...
-     |       |        |-1
-     |       |        |-2
+.h5 -|- raw -|- samp -|-harm_1(harmonic) (float, queues x 3 x points) 
+     |       |        |          row 0: frequency (f), 1: conductance (G), 2: susceptance (B)
+     |       |        |          padded with nan if the queue has less points
+     |       |        |-index_1 (table: queue_id, t (ns), temp, npts, offset (row in harm_1))
+     |       |        |-harm_3
+     |       |        |-index_3
      |       |        --...
      |       |
-     |       -- ref  ---0
-     |                |-1
-     |                |-2
-     |                --...
+     |       -- ref  ---... (same as samp)
      |
-     |- data-|-samp (json)
-     |       |-ref  (json)
-     |       --...
+     |       raw layout 'queue' (attrs['layout'] of chn group does not exist, 
+     |       saved by old version or raw_layout == 'queue' in settings)
+     |       one group for each queue and t, temp in attrs
+     |       raw -|- samp -|-0-|-1(harmonic)-|-column 1: frequency   (f)
+     |            |        |   |             |-column 2: conductance (G)
+     |            |        |   |             --column 3: susceptance (B)
+     |            |        |   |-3
+     |            |        |   --...
+     |            |        |-1
+     |            |        --...
+     |            -- ref  ---...
      |
-     |- prop-|-samp--<e.g. 353_3 (named by solving combination and reference harmonic)> (json)
-     |       |     |
-     |       |     --...
+     |- data-|-samp-|-queue_id (int, queues)
+     |       |      |-t        (int, queues) time in ns since epoch
+     |       |      |-temp     (float, queues)
+     |       |      |-marks    (float, queues x harmonics)
+     |       |      |-fs       (float, queues x harmonics)
+     |       |      |-gs       (float, queues x harmonics)
+     |       |      --ps       (float, queues x harmonics)
+     |       |-ref  (same as samp)
+     |       |-samp_ref
+     |       --ref_ref
+     |       (data_format_ver < 2: samp, ref, ... are saved as json)
+     |
+     |- prop-|-samp-|-<e.g. 353_3 (named by solving combination and reference harmonic)>-|-queue_id (int, queues)
+     |       |      |                                                                      |-drho  (float, queues x harmonics)
+     |       |      |                                                                      --... (one dataset for each column of mech_df)
+     |       |      --...
      |       |     
      |       --ref--...
+     |       (saved by old version: mech_key is saved as json)
      |
      |-exp_ref       (json) # reference setting information
      |
      |-settings      (json) # UI settings (it can be loaded to set the UI)
      |
      --config_default (json) # maximum harmonic and time string format for the collected data
+
+SWMR (single writer multiple readers) mode (HDF5 >= 1.10, see DataSaver.start_swmr):
+the collecting DataSaver keeps the file open as the only writer and appends rows of data
+tables and raw data ('chunked' layout) to the datasets created before. Other processes 
+open the file by DataSaver.load_file(path, swmr=True) and read the new data by DataSaver.poll.
 '''
 
 import os
+import io
 import re
+import collections
+import contextlib
+import threading
 import datetime
 import time # for test
 import pandas as pd
@@ -55,11 +81,81 @@ import h5py
 import json
 import openpyxl
 import csv
+import UISettings
+from modules import ChannelStore
+from modules import QCMFrame
+from modules import PropStore
+from modules import DataWriter
+from modules import ScanJournal
+from modules import DataExporter
+from modules import H5Compact
+from modules.ChannelStore import nat_int
 import logging
 logger = logging.getLogger(__name__)
 
 
+# version of the data format in file
+# 1: tables in data are saved as json
+# 2: tables in data are saved as numeric datasets (native)
+data_format_ver = 2
+
+# columns of data tables
+# single value columns
+data_single_cols = ['queue_id', 't', 'temp']
+# columns with a value for each harmonic
+data_harm_cols = ['marks', 'fs', 'gs', 'ps']
+
+# extension of the journal file of scans (see ScanJournal). saved as <path>.journal
+journal_ext = '.journal'
+
+# number of rows of each chunk for native datasets
+chunk_rows = 256
+
+# max number of raw spectra (f, G, B) cached in memory by get_raw
+raw_cache_size = 256
+
+# dtype of index table of raw data saved in 'chunked' layout
+raw_index_dtype = np.dtype([
+    ('queue_id', 'int64'),
+    ('t', 'int64'), # ns since epoch
+    ('temp', 'float64'),
+    ('npts', 'int64'), # number of points
+    ('offset', 'int64'), # row in harm_<harm> dataset
+])
+
+# kwargs of h5py.File reading a file written in SWMR mode
+swmr_read_kwargs = {'libver': 'latest', 'swmr': True}
+
+# number of points of raw datasets created by start_swmr if it is not in settings
+swmr_npts = 400
+
+
+def _table_property(key):
+    '''
+    property of data table (df) key
+    the data are saved in self._stores[key] (ChannelStore) and the df is made lazily
+    assigning a new df to the table replaces the store and 
+    flags the table to be rewritten in file by next save_data
+    '''
+    def getter(self):
+        return self._stores[key].to_dataframe()
+
+    def setter(self, df):
+        # time_str_format of config_default before settings are given (e.g. DataSaver() followed by load_file)
+        time_str_format = self.settings.get('time_str_format', UISettings.config_default['time_str_format'])
+        self._stores[key] = ChannelStore.ChannelStore.from_dataframe(df, self.n_harm(), time_str_format)
+        self._rewrite.add(key)
+
+    return property(getter, setter)
+
+
 class DataSaver:
+    # data tables
+    samp = _table_property('samp') # df for data form samp chn
+    ref = _table_property('ref') # df for data from ref chn
+    samp_ref = _table_property('samp_ref') # df for samp chn reference
+    ref_ref = _table_property('ref_ref') # df for ref chn reference
+
     def __init__(self, ver='', settings={}):
         '''
         initial values are for initialize the module outside of UI
@@ -69,6 +165,13 @@ class DataSaver:
         self._ref_keys = {'fs': 'f0', 'gs': 'g0'} # corresponding keys storing the reference
         self.ver  = ver # version information
         self.settings = settings
+        self._fh_read = None # handle of file kept open for reading (see self._read_session)
+        self._writer = None # background writer (see self.start_writer)
+        self._journal = None # journal of scans (see self.start_journal)
+        self._journal_raws = [] # raw data of scans in journal not written to file
+        self._journal_failed = False # True if a scan in journal failed to write. The journal is kept for replaying
+        self._swmr_fh = None # handle of file written in SWMR mode (see self.start_swmr)
+        self._failed_lock = threading.Lock() # self._failed_tables is changed by the writer thread
 
         self._init_attrs()
 
@@ -78,10 +181,23 @@ class DataSaver:
         attributes needs to be initiated with new file
         '''
         self.mode = ''  # mode of datasaver 'init': new file; 'load': append/load file
+        self.close_read() # handle of previous file
         self.path = ''
+        self._swmr_read = False # file is read in SWMR mode (see self.load_file)
+        self._swmr_started = False # SWMR mode was started for self.path (readers may keep the file open)
+        self._raw_cache = collections.OrderedDict() # LRU cache of raw {(chn_name, queue_id, harm): (raw, t, temp)}
+        self._raw_meta_cache = {} # layouts, harmonics and index tables of raw in file
+        self._raw_mm = None # memory map of file (see self._raw_views)
         self.saveflg = True # flag to show if modified data has been saved to file
         self.refflg = {chn_name: False for chn_name in self._chn_keys} # flag if the reference has been set
         self.queue_list = []
+        self._stores = {} # data tables by key (ChannelStore)
+        self._rewrite = set() # keys of tables need to be rewritten in file
+        self._dirty = {} # {key: set(queue_id)} of rows changed since last save_data
+        self._failed_tables = {} # {key: set(queue_id) or None (rewrite)} of tables failed to write by the background writer
+        self._t_s_cache = {} # {chn_name: (key, t_s)} cached relative time in s
+        self._ref_cache = {} # {chn_name: (key, {'fs': f0, 'gs': g0})} cached reference arrays (rows x harmonics)
+        self._ref_src_key = {} # {chn_name: key} of the data and settings the reference functions are calculated from
         # following attributes will be save in file
         # self.settings = {}
         self.samp = self._make_df() # df for data form samp chn
@@ -90,8 +206,8 @@ class DataSaver:
         self.ref_ref = self._make_df() # df for ref chn reference
         self.raw  = {} # raw data from last queue
         self.exp_ref  = self._make_exp_ref() # experiment reference setup in dict
-        self.samp_prop = {} # a dict for calculated mechanical results keys: '131'... values: pd.dataframe
-        self.ref_prop = {}
+        self.samp_prop = PropStore.PropStore() # a dict for calculated mechanical results keys: '131'... values: pd.dataframe
+        self.ref_prop = PropStore.PropStore()
         
 
     def _make_df(self):
@@ -159,7 +275,7 @@ class DataSaver:
         func_f_list = [] # func for all freq
         func_g_list = [] # func for all gamma
         nan_func = lambda temp: np.array([np.nan] * len(temp))
-        for _ in range(1, self.settings['max_harmonic']+2, 2): # calculate each harm
+        for _ in range(self.n_harm()): # calculate each harm
             func_f_list.append(nan_func) # add a func return nan
             func_g_list.append(nan_func) # add a func return nan
             # make function for each ind_list
@@ -181,7 +297,7 @@ class DataSaver:
         if (len(chn_ref) > 2) and chn_ref[2]: # exist chn_idx
             return chn_ref[2]
         else: # chn_idx does not exist
-            return getattr(self, chn_name).index.tolist()
+            return self._stores[chn_name].index.tolist()
 
 
     def update_mech_df_shape(self, chn_name, nhcalc):
@@ -303,6 +419,8 @@ class DataSaver:
         '''
         initiate hdf5 file for data saving
         '''
+        # write the queued data to the last file
+        self.close()
         # initiated attributes
         self._init_attrs()
 
@@ -322,7 +440,7 @@ class DataSaver:
 
         # create groups for raw data
         # dt = h5py.special_dtype(vlen=str)
-        with h5py.File(path, 'w') as fh:
+        with self._open_write('w') as fh:
             fh.create_group('data')
             fh.create_group('raw')
             fh.create_group('prop')
@@ -334,22 +452,34 @@ class DataSaver:
         self.save_data_settings(settings=self.settings)
 
 
-    def load_file(self, path):
+    def load_file(self, path, progress=None, swmr=False):
         '''
         load data information from exist hdf5 file
-        '''
+        the file is loaded by stages: settings, exp_ref, data tables, queue list and reference.
+        prop is loaded by mech_key when it is accessed (self._load_prop)
+        progress: function(val, text) called at each stage with val (0-100) and the name of the stage
+        swmr: if True, the file written by another process in SWMR mode (see self.start_swmr) is 
+              read while the data are collected. The data appended after loading are read by self.poll.
+              The file is kept open (closed by self.close_read) and it cannot be written by this DataSaver.
+        '''
+        # write the queued data to the last file
+        self.close()
         self._init_attrs()
 
         self.mode = 'load'
         self.path = path
+        self._swmr_read = swmr
 
         # check file and load settings
-        self.settings = self.load_settings(self.path)
+        self._load_progress(progress, 0, 'settings')
+        self.settings = self.load_settings(self.path, swmr=swmr)
         if not self.settings:
+            self._load_progress(progress, 0, '')
             return {}
 
         # get data information
-        with h5py.File(self.path, 'r') as fh:
+        with h5py.File(self.path, 'r', **(swmr_read_kwargs if swmr else {})) as fh:
+            self._load_progress(progress, 10, 'exp_ref')
             key_list = list(fh.keys())
             logger.info(key_list) 
            
@@ -375,43 +505,54 @@ class DataSaver:
             # self.queue_list = list(fh['raw/samp'].keys())
             # self.queue_list = [int(s) for s in fh['raw/samp'].keys()]
 
-            logger.info(fh['data/samp'][()]) 
-            for chn_name in self._chn_keys:
-                # df for data from samp/ref chn
-                setattr(self, chn_name, pd.read_json(fh['data/' + chn_name][()]).sort_values(by=['queue_id'])) 
-
-                setattr(self, chn_name, self.add_missed_cols_to_df(getattr(self, chn_name), ['ps']))
+            for i, chn_name in enumerate(self._chn_keys):
+                # data from samp/ref chn sorted by queue_id
+                self._load_progress(progress, 20 + 60 * i // len(self._chn_keys), 'data/' + chn_name)
+                store = self._read_store(fh, chn_name)
+                self._stores[chn_name] = store.take(np.argsort(store.col('queue_id'), kind='stable'))
                 
-                # df for data form samp_ref/ref_ref chn
+                # data form samp_ref/ref_ref chn
                 if chn_name + '_ref' in fh['data'].keys():
-                    setattr(self, chn_name + '_ref', pd.read_json(fh['data/' + chn_name + '_ref'][()]).sort_values(by=['queue_id'])) 
+                    store = self._read_store(fh, chn_name + '_ref')
+                    self._stores[chn_name + '_ref'] = store.take(np.argsort(store.col('queue_id'), kind='stable'))
                 else:
                     setattr(self, chn_name + '_ref', self._make_df())
 
-                # load prop
+                # prop is loaded by mech_key when it is accessed (self._load_prop)
                 if ('prop' in fh.keys()) and (chn_name in fh['prop'].keys()): # prop exists
-                    for mech_key in fh['prop/' + chn_name].keys():
-                        getattr(self, chn_name + '_prop')[mech_key] = pd.read_json(fh['prop/' + chn_name + '/' + mech_key][()]).sort_values(by=['queue_id']) 
+                    setattr(self, chn_name + '_prop', PropStore.PropStore(
+                        loader=lambda mech_key, chn_name=chn_name: self._load_prop(chn_name, mech_key),
+                        file_keys=list(fh['prop/' + chn_name].keys()),
+                    ))
                 
                 
             # replace None with nan in self.samp and self.ref
             self.replace_none_with_nan_after_loading() 
 
+            # tables in memory are the same as in file
+            # only the tables saved as json or in different order need to be rewritten
+            self._rewrite = set()
+            self._dirty = {}
+            for key in self._table_keys():
+                if not self._is_native_table(fh, key) or not np.array_equal(fh['data/' + key + '/queue_id'][()], self._stores[key].col('queue_id')):
+                    self._rewrite.add(key)
+
             # get queue_list for each channel
+            self._load_progress(progress, 80, 'queue list')
             # method 1: from raw. problem of this method is repeat queue_id may be created after deleting data points. 
-            queue_samp_raw = []
-            queue_ref_raw = []
-            if 'samp' in fh['raw'].keys():
-                queue_samp_raw = [int(s) for s in fh['raw/samp'].keys()]
-            if 'ref' in fh['raw'].keys():
-                queue_ref_raw = [int(s) for s in fh['raw/ref'].keys()]
+            queue_samp_raw = self._raw_queue_list(fh, 'samp')
+            queue_ref_raw = self._raw_queue_list(fh, 'ref')
             # method 2: from data
-            queue_samp_data = self.samp.queue_id.values # TODO add checking marker != -1
-            queue_ref_data = self.ref.queue_id.values
-            self.queue_list = sorted(list(set(queue_samp_data) | set(queue_ref_data) | set(queue_samp_raw) | set(queue_ref_raw)))
+            queue_samp_data = self._stores['samp'].col('queue_id') # TODO add checking marker != -1
+            queue_ref_data = self._stores['ref'].col('queue_id')
+            self.queue_list = np.union1d(
+                np.union1d(queue_samp_data, queue_ref_data), 
+                np.union1d(np.asarray(queue_samp_raw, dtype='int64'), np.asarray(queue_ref_raw, dtype='int64')),
+            ).tolist()
 
 
             # calculate func which cannot be saved in file
+            self._load_progress(progress, 90, 'reference')
             for chn_name in self._chn_keys:
                 self.calc_fg_ref(chn_name, mark=False) # False or True??
 
@@ -419,15 +560,32 @@ class DataSaver:
 
             self.saveflg = True
 
+        # recover scans not saved to file
+        self._load_progress(progress, 95, 'journal')
+        if not swmr: # the journal belongs to the writer
+            self._replay_journal()
+
+        self._load_progress(progress, 100, '')
+
+
+    def _load_progress(self, progress, val, text):
+        '''
+        report the stage of self.load_file to function progress(val, text) 
+        '''
+        logger.info('loading %s %s', val, text) 
+        if progress is not None:
+            progress(val, text)
+
             # logger.info(self.samp) 
 
     
-    def check_file_format(self, path):
+    def check_file_format(self, path, swmr=False):
         '''
         check if the file is generated by this program and 
         return boolean
+        swmr: if True, the file is opened for reading in SWMR mode
         '''
-        with h5py.File(path, 'r') as fh:
+        with h5py.File(path, 'r', **(swmr_read_kwargs if swmr else {})) as fh:
             key_list = list(fh.keys())
             attr_list = list(fh.attrs)
         
@@ -437,17 +595,18 @@ class DataSaver:
             return False
          
 
-    def load_settings(self, path):
+    def load_settings(self, path, swmr=False):
         '''
         load settings from h5 file
+        swmr: if True, the file is opened for reading in SWMR mode
         '''
         # check file
-        if not self.check_file_format(path):
+        if not self.check_file_format(path, swmr=swmr):
             logger.warning('File does not have the right format!\nPlease check data file.')
             return
 
         try: # try to load settings from file
-            with h5py.File(path, 'r') as fh:
+            with h5py.File(path, 'r', **(swmr_read_kwargs if swmr else {})) as fh:
                 settings = json.loads(fh['settings'][()])
                 if 'settings_init' in fh.keys(): # saved by version < 0.17.0
                     settings_init = json.loads(fh['settings_init'][()])
@@ -471,8 +630,7 @@ class DataSaver:
         gs: list of delta gamma with the same lenght to harm_list
         '''
 
-        logger.info('queue_list \n%s', self.get_queue_id(chn_name).values)
-        if queue_id in self.get_queue_id(chn_name).values: # is going to overwrite data
+        if self._stores[chn_name].position(queue_id) is not None: # is going to overwrite data
             logger.info('queue_id (%s) in list', queue_id)
             # get 
             fs_all = self.get_queue(chn_name, queue_id, col='fs').iloc[0]
@@ -528,11 +686,40 @@ class DataSaver:
         self._save_queue_data(chn_names, harm_list, queue_id=queue_id, t=t, temp=temp, fs=fs, gs=gs, ps=ps, marks=marks)
 
         # save raw data to file by chn_names
-        self._save_raw(chn_names, harm_list, t=t, temp=temp, f=f, G=G, B=B)
+        if self._journal is None:
+            self._save_raw(chn_names, harm_list, t=t, temp=temp, f=f, G=G, B=B)
+        else: # the scan is saved to journal and written to file by next compaction (self.save_data)
+            self._journal_scan(queue_id, chn_names, harm_list, t=t, temp=temp, f=f, G=G, B=B)
 
         self.saveflg = False
 
 
+    def _journal_scan(self, queue_id, chn_names, harm_list, t, temp, f, G, B):
+        '''
+        append the scan of queue_id (the last row of data and raw data) to journal
+        '''
+        raws = self._copy_raws(queue_id, chn_names, harm_list, f, G, B)
+        t = {chn_name: t[chn_name] for chn_name in chn_names}
+        temp = {chn_name: temp[chn_name] for chn_name in chn_names}
+
+        rows = {}
+        arrays = {}
+        for chn_name in chn_names:
+            store = self._stores[chn_name]
+            pos = store.nrows - 1
+            rows[chn_name] = {'t': int(store.col('t')[pos]), 'temp': float(store.col('temp')[pos])}
+            for col in data_harm_cols:
+                arrays['data/' + chn_name + '/' + col] = store.col(col)[pos]
+            for harm in harm_list:
+                arrays['raw/' + chn_name + '/' + harm] = raws[chn_name][harm]
+
+        self._journal.append(
+            {'queue_id': int(queue_id), 'chn_names': chn_names, 'harm_list': harm_list, 't': t, 'temp': temp, 'rows': rows},
+            arrays,
+        )
+        self._journal_raws.append((queue_id, chn_names, harm_list, t, temp, raws))
+
+
     def _append_new_queue(self, chn_names, queue_id=None):
         '''
         append a new row to self.chn_name for following add new data
@@ -561,17 +748,11 @@ class DataSaver:
         self.queue_list.append(queue_id)
 
         for chn_name in chn_names:
-            data_new = pd.DataFrame.from_dict({
-                'queue_id': [queue_id],  
-                't': [''], # str
-                'temp': [np.nan], # float
-                'marks': [self.nan_harm_list()], # list default [nan, nan, ...]
-                'fs': [self.nan_harm_list()],
-                'gs': [self.nan_harm_list()],
-                'ps': [self.nan_harm_list()],
-            })
             # append empty data to chn_name
-            setattr(self, chn_name, getattr(self, chn_name).append(data_new, ignore_index=True))
+            # t: '', temp, marks, fs, gs and ps: nan
+            # appended rows are saved incrementally by save_data
+            self._stores[chn_name].append(queue_id)
+            self._mark_dirty(chn_name, queue_id)
         
         return queue_id
 
@@ -593,53 +774,32 @@ class DataSaver:
         #     if str(i) not in harm_list: # tested harmonic
         #         marks.insert(int((i-1)/2), np.nan)
 
-        # append to the form by chn_name
+        # columns of harmonics in harm_list
+        harm_idx = [int((int(harm)-1)/2) for harm in harm_list]
+
+        # write to the last row (appended by self._append_new_queue) of the store by chn_name
         for chn_name in chn_names:
-            fs_all = self.get_queue(chn_name, queue_id, col='fs').iloc[0]
-            gs_all = self.get_queue(chn_name, queue_id, col='gs').iloc[0]
-            ps_all = self.get_queue(chn_name, queue_id, col='ps').iloc[0]
-            marks_all = self.get_queue(chn_name, queue_id, col='marks').iloc[0]
-            # prepare data: change list to the size of harm_list by inserting nan to the empty harm
-
-            logger.info('ps_all %s', ps_all)
-
-            for i, harm in enumerate(harm_list):
-                harm = int(harm)
-                # logger.info(i) 
-                # logger.info(harm) 
-                # logger.info(int((harm-1)/2)) 
-                # logger.info(fs[chn_name][i])
-                logger.info(ps)
-                if fs is not None:
-                    fs_all[int((harm-1)/2)] = fs[chn_name][i]
-                if gs is not None:
-                    gs_all[int((harm-1)/2)] = gs[chn_name][i]
-                if ps is not None:
-                    ps_all[int((harm-1)/2)] = ps[chn_name][i]
-                marks_all[int((harm-1)/2)] = marks[i]
-
-            # for i in range(1, self.settings['max_harmonic']+2, 2):
-            #     if str(i) not in harm_list: # tested harmonic
-            #         fs[chn_name].insert(int((i-1)/2), np.nan)
-            #         gs[chn_name].insert(int((i-1)/2), np.nan)
-
-            # up self.samp/ref first
-            # create a df to append
-            data_new = pd.DataFrame(
-                data={
-                    'queue_id': [queue_id],  
-                    't': [t[chn_name]],
-                    'temp': [temp[chn_name]],
-                    'marks': [marks_all], # list default [0, 0, 0, 0, 0]
-                    'fs': [fs_all],
-                    'gs': [gs_all],
-                    'ps': [ps_all],
-                },
-                index=[getattr(self, chn_name).iloc[[-1]].index.values.astype(int)[0]]
-            )
-            # logger.info(data_new) 
-            getattr(self, chn_name).update(data_new)
-            logger.info(getattr(self, chn_name).tail()) 
+            store = self._stores[chn_name]
+            pos = store.nrows - 1
+
+            if fs is not None:
+                store.col('fs')[pos, harm_idx] = fs[chn_name][:len(harm_idx)]
+            if gs is not None:
+                store.col('gs')[pos, harm_idx] = gs[chn_name][:len(harm_idx)]
+            if ps is not None:
+                store.col('ps')[pos, harm_idx] = ps[chn_name][:len(harm_idx)]
+            store.col('marks')[pos, harm_idx] = marks[:len(harm_idx)]
+
+            cols = ['t', 'temp'] + data_harm_cols # changed columns
+            if store.col('queue_id')[pos] != queue_id: # keep the queue_id index if it is not changed
+                store.col('queue_id')[pos] = queue_id
+                cols.append('queue_id')
+            store.col('t')[pos] = ChannelStore.t_to_ns(t[chn_name], self.settings['time_str_format'])
+            if not pd.isnull(temp[chn_name]): # nan doesn't overwrite (the same as DataFrame.update)
+                store.col('temp')[pos] = temp[chn_name]
+            store.changed(cols)
+            self._mark_dirty(chn_name, queue_id)
+            logger.info('%s row %s: queue_id %s', chn_name, pos, queue_id) 
 
 
     def _save_raw(self, chn_names, harm_list, t=np.nan, temp=np.nan, f=None, G=None, B=None):
@@ -655,10 +815,57 @@ class DataSaver:
         '''
 
         t0 = time.time()
-        with h5py.File(self.path, 'a') as fh:
+        queue_id = max(self.queue_list)
+        raws = self._copy_raws(queue_id, chn_names, harm_list, f, G, B)
+        t = {chn_name: t[chn_name] for chn_name in chn_names}
+        temp = {chn_name: temp[chn_name] for chn_name in chn_names}
+
+        self._write(self._raw_writing(queue_id, chn_names, harm_list, t, temp, raws))
+        t1 = time.time()
+        logger.info(t1 - t0) 
+
+
+    def _copy_raws(self, queue_id, chn_names, harm_list, f, G, B):
+        '''
+        copy of raw data (f, G, B) of ONE QUEUE to write
+        return dict of ndarray (3 x points) raws[chn_name][harm]
+        '''
+        raws = {}
+        for chn_name in chn_names:
+            raws[chn_name] = {}
+            for harm in harm_list:
+                self._raw_cache_pop(chn_name, queue_id, harm)
+                raws[chn_name][harm] = np.stack((f[chn_name][harm], G[chn_name][harm], B[chn_name][harm]), axis=0)
+        return raws
+
+
+    def _raw_writing(self, queue_id, chn_names, harm_list, t, temp, raws, skip_existing=False):
+        '''
+        return the function writing raw data of ONE QUEUE to file handle: write_raw(fh)
+        raws: dict of ndarray (3 x points) raws[chn_name][harm] (self._copy_raws)
+        skip_existing: if True, raw data exist in file are not written (replaying journal)
+        '''
+        def write_raw(fh):
             for chn_name in chn_names:
+                if skip_existing:
+                    harms = [harm for harm in harm_list if not self._raw_exists(fh, chn_name, queue_id, harm)]
+                    if not harms:
+                        continue
+                else:
+                    harms = harm_list
+
+                # new channel uses the layout in settings
+                layout = self._raw_layout(fh, chn_name) or self.settings.get('raw_layout', 'chunked')
+                if layout == 'chunked':
+                    g_chn = fh['raw'].require_group(chn_name)
+                    if g_chn.attrs.get('layout') != 'chunked': # attrs cannot be changed in SWMR mode
+                        g_chn.attrs['layout'] = 'chunked'
+                    for harm in harms:
+                        self._append_raw_chunked(g_chn, harm, queue_id, t[chn_name], temp[chn_name], raws[chn_name][harm])
+                    continue
+
                 # creat group for test
-                g_queue = fh.create_group('raw/' + chn_name + '/' + str(max(self.queue_list)))
+                g_queue = fh.require_group('raw/' + chn_name + '/' + str(queue_id))
                 # add t, temp to attrs
                 # store t as string
                 g_queue.attrs['t'] = t[chn_name]
@@ -666,35 +873,232 @@ class DataSaver:
                     logger.info(temp) 
                     g_queue.attrs['temp'] = temp[chn_name]
 
-                for harm in harm_list:
+                for harm in harms:
                     # create data_set for f, G, B of the harm
-                    g_queue.create_dataset(harm, data=np.stack((f[chn_name][harm], G[chn_name][harm], B[chn_name][harm]), axis=0))
-        t1 = time.time()
-        logger.info(t1 - t0) 
+                    g_queue.create_dataset(harm, data=raws[chn_name][harm])
+        return write_raw
 
 
-    def save_data(self):
+    def _raw_compression_opts(self):
         '''
-        save samp (df), ref (df) to h5 file serializing with json
+        compression kwargs of create_dataset for raw data by self.settings['raw_compression']
+        None: no compression; 'lzf': lzf + shuffle; 'gzip': gzip + shuffle
         '''
-        with h5py.File(self.path, 'a') as fh:
-            for key in self._chn_keys:
-                logger.info(key) 
-                # logger.info(fh['data/' + key]) 
-                if key in fh['data']:
-                    data = fh['data/' + key]
-                    # logger.info(data) 
-                    # logger.info(data[()]) 
-                    data[()] = getattr(self, key).to_json()
+        compression = self.settings.get('raw_compression', None)
+        if compression == 'lzf':
+            return {'compression': 'lzf', 'shuffle': True}
+        elif compression == 'gzip':
+            return {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+        else:
+            return {}
+
+
+    def _append_raw_chunked(self, g_chn, harm, queue_id, t, temp, raw):
+        '''
+        append raw data of a harmonic of ONE QUEUE to g_chn in 'chunked' layout
+        g_chn: group of chn_name in raw
+        t: str
+        temp: float
+        raw: ndarray (3 x npts) of f, G, B
+        '''
+        npts = raw.shape[1]
+        self._raw_meta_cache.clear()
+        ds_raw, ds_idx = self._require_raw_chunked(g_chn, harm, npts)
+
+        offset = ds_raw.shape[0]
+        ds_raw.resize((offset + 1, 3, max(ds_raw.shape[2], npts)))
+        ds_raw[offset, :, :npts] = raw
+
+        n = ds_idx.shape[0]
+        ds_idx.resize((n + 1,))
+        ds_idx[n] = (
+            queue_id, 
+            ChannelStore.t_to_ns(t, self.settings['time_str_format']), 
+            temp if temp is not None else np.nan, 
+            npts, 
+            offset,
+        )
+
+
+    def _require_raw_chunked(self, g_chn, harm, npts):
+        '''
+        datasets of raw data (harm_<harm>) and index table (index_<harm>) of harm in g_chn 
+        in 'chunked' layout. they are created if not exist
+        npts: number of points of each chunk of new dataset
+        return (harm_<harm>, index_<harm>)
+        '''
+        if 'harm_' + harm not in g_chn:
+            g_chn.create_dataset(
+                'harm_' + harm, 
+                shape=(0, 3, npts), 
+                maxshape=(None, 3, None), # resizable queues and points
+                chunks=(1, 3, npts), # one queue in a chunk
+                dtype='float64',
+                fillvalue=np.nan,
+                **self._raw_compression_opts(),
+            )
+            g_chn.create_dataset(
+                'index_' + harm, 
+                shape=(0,), 
+                maxshape=(None,), 
+                chunks=(chunk_rows,), 
+                dtype=raw_index_dtype,
+            )
+        return g_chn['harm_' + harm], g_chn['index_' + harm]
+
+
+    def save_data(self, full=False):
+        '''
+        save samp (df), ref (df), samp_ref (df), ref_ref (df) to h5 file as numeric datasets
+        full: True, rewrite all tables (e.g. explicit saving)
+              False, only write the rows changed or appended since last save_data.
+                     tables replaced in memory (e.g. deleting rows, changing reference) are rewritten
+        tables saved as json (data_format_ver < 2) are replaced
+        if the background writer is running (self.start_writer), the rows to write are copied 
+        and written by the writer thread
+        if the journal is running (self.start_journal), saving is skipped until compact_scans scans
+        are in the journal (or full). Then the raw data of the scans are written and the journal
+        is discarded after the tables are written (compaction)
+        in SWMR mode (self.start_swmr), the scans are written by every save_data, so the readers can see them
+        '''
+        if self._journal is not None and self._swmr_fh is None and not full and 0 < len(self._journal_raws) < self._journal.compact_scans:
+            return # scans are kept in journal
+        self._save_data(full=full)
+
+
+    def _save_data(self, full=False):
+        '''
+        save data tables to file (see self.save_data) 
+        and compact the journal if it is running
+        '''
+        self._merge_failed_tables()
+        if self._journal is not None:
+            seq = self._journal.seq
+            self._write_journal_raws()
+
+        if self._writer is None:
+            with self._open_write(swmr=True) as fh:
+                for key in self._table_keys():
+                    if full or (key in self._rewrite) or not self._write_table_rows(fh, key, self._dirty.get(key, set())):
+                        logger.info('rewrite table %s', key) 
+                        self._write_table(fh, key, self._stores[key])
+                if fh.attrs.get('data_format_ver') != data_format_ver: # attrs cannot be changed in SWMR mode
+                    fh.attrs['data_format_ver'] = data_format_ver
+            if self._journal is not None: # the scans are in file
+                self._discard_journal(self._journal, seq)
+        else:
+            # {key: (arrs, pos, nrows)}. pos is None for rewriting the table
+            tables = {}
+            for key in self._table_keys():
+                store = self._stores[key]
+                if full or (key in self._rewrite):
+                    tables[key] = (self._store_to_arrays(store, np.arange(store.nrows)), None, store.nrows)
                 else:
-                    fh.create_dataset('data/' + key, data=getattr(self, key).to_json(), dtype=h5py.special_dtype(vlen=str)) 
-                if key + '_ref' in fh['data']:
-                    data_ref = fh['data/' + key + '_ref']
-                    # logger.info(data_ref[()]) 
-                    data_ref[()] = getattr(self, key + '_ref').to_json()
+                    pos = np.flatnonzero(np.isin(store.col('queue_id'), list(self._dirty.get(key, set()))))
+                    if pos.size > 0:
+                        tables[key] = (self._store_to_arrays(store, pos), pos, store.nrows)
+            journal = self._journal
+            def write_tables(fh):
+                # the journal is discarded in the same job only if all the tables are written
+                if self._write_tables_arrays(fh, tables) and journal is not None:
+                    self._discard_journal(journal, seq)
+            self._write(write_tables)
+
+        self._rewrite = set()
+        self._dirty = {}
+
+
+    def _write_journal_raws(self):
+        '''
+        write the raw data of scans in journal to file
+        '''
+        raws, self._journal_raws = self._journal_raws, []
+        for scan in raws:
+            self._write(self._journal_writing(self._raw_writing(*scan)))
+
+
+    def _journal_writing(self, job):
+        '''
+        return job writing the data of scans in journal, which keeps the journal if it fails
+        '''
+        def write(fh):
+            try:
+                job(fh)
+            except Exception:
+                self._journal_failed = True
+                raise
+        return write
+
+
+    def _discard_journal(self, journal, seq):
+        '''
+        discard the records of journal to seq after the scans are written to file
+        the journal is kept if any scan in it failed to write (replayed by next load_file)
+        '''
+        if self._journal_failed:
+            logger.warning('journal %s is kept for the scans failed to write', journal.path)
+            return
+        journal.discard(seq)
+
+
+    def _write_tables_arrays(self, fh, tables):
+        '''
+        write copies of tables made by self.save_data to file (run by the background writer)
+        tables: {key: (arrs, pos, nrows)}. pos is None for rewriting the table
+        the table which cannot be written by rows and the tables not written because of 
+        an error are written by next save_data (see self._table_failed)
+        return True if all the tables are written
+        '''
+        done = set()
+        written = True
+        try:
+            for key, (arrs, pos, nrows) in tables.items():
+                if pos is None:
+                    logger.info('rewrite table %s', key) 
+                    self._write_table_arrays(fh, key, arrs)
+                elif self._table_rows_writable(fh, key, nrows):
+                    logger.info('write %s rows to table %s', pos.size, key) 
+                    self._write_group_rows(fh['data/' + key], arrs, pos, nrows)
                 else:
-                    fh.create_dataset('data/' + key + '_ref', data=getattr(self, key + '_ref').to_json(), dtype=h5py.special_dtype(vlen=str))
-        
+                    logger.warning('table %s cannot be written by rows. It will be rewritten by next saving.', key)
+                    self._table_failed(key)
+                    written = False
+                done.add(key)
+            if fh.attrs.get('data_format_ver') != data_format_ver: # attrs cannot be changed in SWMR mode
+                fh.attrs['data_format_ver'] = data_format_ver
+        except Exception:
+            for key, (arrs, pos, nrows) in tables.items():
+                if key not in done:
+                    self._table_failed(key, None if pos is None else arrs['queue_id'].tolist())
+            raise
+        return written
+
+
+    def _table_failed(self, key, queue_ids=None):
+        '''
+        record table key failed to write by the background writer
+        queue_ids: rows to write again. None for rewriting the table
+        the records are merged to self._rewrite and self._dirty by next save_data (self._merge_failed_tables)
+        '''
+        with self._failed_lock:
+            if queue_ids is None or self._failed_tables.get(key, ()) is None:
+                self._failed_tables[key] = None
+            else:
+                self._failed_tables.setdefault(key, set()).update(queue_ids)
+
+
+    def _merge_failed_tables(self):
+        '''
+        flag the tables failed to write by the background writer (self._table_failed) to be written
+        '''
+        with self._failed_lock:
+            failed, self._failed_tables = self._failed_tables, {}
+        for key, queue_ids in failed.items():
+            if queue_ids is None:
+                self._rewrite.add(key)
+            else:
+                self._dirty.setdefault(key, set()).update(queue_ids)
+
         # following is using delete/create protocal
         """ with h5py.File(self.path, 'a') as fh:
             for key in self._chn_keys:
@@ -716,6 +1120,186 @@ class DataSaver:
                 fh.create_dataset('data/' + key + '_ref', data=data_ref, dtype=h5py.special_dtype(vlen=str)) """ 
 
 
+    def _table_keys(self):
+        '''
+        keys of data tables: ['samp', 'samp_ref', 'ref', 'ref_ref']
+        '''
+        return [key + ext for key in self._chn_keys for ext in ['', '_ref']]
+
+
+    def _mark_dirty(self, key, queue_id):
+        '''
+        mark row of queue_id in data table key as changed
+        '''
+        self._dirty.setdefault(key, set()).add(queue_id)
+
+
+    def _mark_dirty_rows(self, key, pos):
+        '''
+        mark rows at positions pos in data table key as changed
+        '''
+        self._dirty.setdefault(key, set()).update(self._stores[key].col('queue_id')[pos].tolist())
+
+
+    def _is_native_table(self, fh, key):
+        '''
+        check if fh['data/' + key] exists and is saved as numeric datasets
+        '''
+        return (key in fh['data']) and isinstance(fh['data/' + key], h5py.Group)
+
+
+    def _store_to_arrays(self, store, pos=None):
+        '''
+        convert data table (ChannelStore) to a dict of ndarrays for saving
+        pos: positions of rows. None for all
+        single value columns: 1D array
+        harmonic columns: 2D array (rows x harmonics)
+        '''
+        if pos is None:
+            pos = slice(None)
+        arrs = {
+            'queue_id': store.col('queue_id')[pos],
+            't': store.col('t')[pos],
+            'temp': store.col('temp')[pos],
+        }
+        for col in data_harm_cols:
+            arrs[col] = store.col(col)[pos]
+        return arrs
+
+
+    def _arrays_to_store(self, arrs):
+        '''
+        convert a dict of ndarrays to data table (ChannelStore)
+        reverse of self._store_to_arrays
+        missed harmonic columns are filled with nan
+        '''
+        nrows = len(arrs['queue_id'])
+        store = ChannelStore.ChannelStore(self.n_harm(), self.settings['time_str_format'], capacity=max(nrows, ChannelStore.init_capacity))
+        store.nrows = nrows
+        store.col('queue_id')[:] = arrs['queue_id']
+        store.col('t')[:] = arrs['t']
+        store.col('temp')[:] = arrs['temp']
+        for col in data_harm_cols:
+            if col in arrs:
+                store.col(col)[:] = np.asarray(arrs[col], dtype='float64')[:, :self.n_harm()]
+        return store
+
+
+    def _write_table(self, fh, key, store):
+        '''
+        write data table (ChannelStore) to fh['data/' + key] as numeric datasets
+        fh: handle of h5 file in 'a' mode
+        '''
+        self._write_table_arrays(fh, key, self._store_to_arrays(store))
+
+
+    def _write_table_arrays(self, fh, key, arrs):
+        '''
+        write data table of a dict of ndarrays (self._store_to_arrays) to fh['data/' + key]
+        '''
+        if key in fh['data'] and not isinstance(fh['data/' + key], h5py.Group): # saved as json
+            del fh['data/' + key]
+        grp = fh['data'].require_group(key)
+
+        self._write_group(grp, arrs)
+
+
+    def _write_group(self, grp, arrs):
+        '''
+        write a dict of ndarrays (columns of a table) to datasets in grp
+        datasets are chunked by rows and resizable
+        '''
+        for col, arr in arrs.items():
+            if col in grp:
+                ds = grp[col]
+                ds.resize(arr.shape[0], axis=0)
+            else:
+                ds = grp.create_dataset(
+                    col, 
+                    shape=arr.shape,
+                    dtype=arr.dtype, 
+                    maxshape=(None,) + arr.shape[1:], # resizable rows
+                    chunks=(chunk_rows,) + arr.shape[1:],
+                )
+            if arr.shape[0] > 0:
+                ds[...] = arr
+
+
+    def _write_group_rows(self, grp, arrs, pos, nrows):
+        '''
+        write rows at positions pos (increasing) of a dict of ndarrays to datasets in grp
+        datasets are resized to nrows if they are shorter
+        '''
+        for col, arr in arrs.items():
+            ds = grp[col]
+            if ds.shape[0] < nrows:
+                ds.resize(nrows, axis=0)
+            if pos[-1] - pos[0] + 1 == pos.size: # continuous rows
+                ds[pos[0]:pos[-1]+1] = arr
+            else:
+                ds[pos] = arr
+
+
+    def _write_table_rows(self, fh, key, queue_ids):
+        '''
+        write rows of queue_ids in data table key to fh['data/' + key]
+        rows of df out of the table in file are appended.
+        rows in store and file are in the same order, since rows are only appended to the store
+        without replacing it (see self._append_new_queue)
+        return False if the table in file cannot be updated by rows
+        '''
+        store = self._stores[key]
+        if not self._table_rows_writable(fh, key, store.nrows):
+            return False
+        grp = fh['data/' + key]
+        nrows = grp['queue_id'].shape[0]
+
+        # positions of the rows to write (increasing)
+        pos = np.union1d(
+            np.flatnonzero(np.isin(store.col('queue_id'), list(queue_ids))), 
+            np.arange(nrows, store.nrows), # new rows
+        ).astype(int)
+        if pos.size == 0:
+            return True
+
+        logger.info('write %s rows to table %s', pos.size, key) 
+        self._write_group_rows(grp, self._store_to_arrays(store, pos), pos, store.nrows)
+        return True
+
+
+    def _table_rows_writable(self, fh, key, nrows):
+        '''
+        check if the table key in file can be updated by rows to a table with nrows
+        (saved as numeric datasets with all columns and not more rows)
+        '''
+        if not self._is_native_table(fh, key):
+            return False
+        grp = fh['data/' + key]
+        if not all(col in grp for col in data_single_cols + data_harm_cols):
+            return False
+        if grp['fs'].shape[1:] != (len(self.nan_harm_list()),):
+            return False
+        if grp['queue_id'].shape[0] > nrows: # rows deleted
+            return False
+        return True
+
+
+    def _read_store(self, fh, key):
+        '''
+        read data table from fh['data/' + key] 
+        saved as numeric datasets or json (data_format_ver < 2)
+        return ChannelStore
+        '''
+        obj = fh['data/' + key]
+        if isinstance(obj, h5py.Group): # native
+            return self._arrays_to_store({col: obj[col][()] for col in data_single_cols + data_harm_cols if col in obj})
+        else: # json
+            data = obj[()]
+            if isinstance(data, bytes): # h5py >= 3 returns bytes
+                data = data.decode()
+            return ChannelStore.ChannelStore.from_dataframe(pd.read_json(io.StringIO(data)), self.n_harm(), self.settings['time_str_format'])
+
+
     def save_settings(self, settings={}):
         '''
         save settings (dict) to file
@@ -723,7 +1307,7 @@ class DataSaver:
         if not settings:
             settings = self.settings
 
-        with h5py.File(self.path, 'a') as fh:
+        with self._open_write() as fh:
             if 'settings' in fh:
                 data_settings =  fh['settings']
                 data_settings[()] = json.dumps(settings)
@@ -741,8 +1325,9 @@ class DataSaver:
     def save_data_settings(self, settings={}):
         '''
         wrap up of save_data and save_settings and save_exp_ref
+        data tables are fully rewritten
         '''
-        self.save_data()
+        self.save_data(full=True)
         if not settings:
             settings = self.settings
         self.save_settings(settings=settings)
@@ -753,31 +1338,136 @@ class DataSaver:
 
     def save_prop(self):
         '''
-        save prop data to file
+        save prop data to file as numeric datasets
+        mech_dfs not loaded are not changed in file
+        only the rows changed (self.update_mech_queue) are written if possible 
+        mech_dfs replaced in memory or saved as json are rewritten
         '''
-        with h5py.File(self.path, 'a') as fh:
+        with self._open_write() as fh:
             for chn_name in self._chn_keys:
-                for mech_key, mech_df in getattr(self, chn_name + '_prop').items():
-                    if ('prop' not in fh.keys()) or (chn_name not in fh['prop'].keys()):
-                        fh.create_dataset('prop/' + chn_name + '/' + mech_key, data=mech_df.to_json(), dtype=h5py.special_dtype(vlen=str))
-                    else: 
-                        if mech_key in fh['prop/' + chn_name].keys():
-                            data_prop = fh['prop/' + chn_name + '/' + mech_key]
-                            data_prop[()] = mech_df.to_json()
-                        else:
-                            # create data_set for mech_df
-                            fh.create_dataset('prop/' + chn_name + '/' + mech_key, data=mech_df.to_json(), dtype=h5py.special_dtype(vlen=str))
+                props = getattr(self, chn_name + '_prop')
+                for mech_key, mech_df in props.loaded_items():
+                    path = 'prop/' + chn_name + '/' + mech_key
+                    if (mech_key in props.rewrite) or not self._write_prop_rows(fh, path, mech_df, props.dirty.get(mech_key, set())):
+                        logger.info('rewrite prop %s', path) 
+                        self._write_prop(fh, path, mech_df)
+                    props.saved(mech_key)
+
+
+    def _prop_to_arrays(self, mech_df, pos=None, cols=None):
+        '''
+        convert mech_df to a dict of ndarrays for saving
+        pos: positions of rows. None for all
+        cols: columns to convert. None for all
+        queue_id: 1D array
+        other columns (list in cells): 2D array (rows x harmonics). complex values are kept
+        '''
+        if pos is None:
+            pos = slice(None)
+        arrs = {}
+        for col in (mech_df.columns if cols is None else cols):
+            values = mech_df[col].values[pos]
+            if col == 'queue_id':
+                arrs[col] = values.astype('int64')
+                continue
+            try:
+                arr = np.array(values.tolist())
+            except ValueError: # lists with different length
+                arr = None
+            if arr is None or arr.ndim != 2 or arr.dtype.kind not in 'biufc': # with None or scalars
+                arr = ChannelStore.lists_to_array(values, self.n_harm())
+            arrs[col] = arr.astype('complex128' if arr.dtype.kind == 'c' else 'float64').reshape(len(values), -1)
+        return arrs
+
+
+    def _write_prop(self, fh, path, mech_df):
+        '''
+        write mech_df to fh[path] as numeric datasets
+        fh: handle of h5 file in 'a' mode
+        '''
+        if path in fh and not isinstance(fh[path], h5py.Group): # saved as json
+            del fh[path]
+        grp = fh.require_group(path)
+
+        arrs = self._prop_to_arrays(mech_df)
+        for col in list(grp.keys()): # delete the removed columns
+            if col not in arrs or grp[col].shape[1:] != arrs[col].shape[1:] or grp[col].dtype != arrs[col].dtype:
+                del grp[col]
+        self._write_group(grp, arrs)
+        grp.attrs['columns'] = json.dumps(list(mech_df.columns))
+
+
+    def _write_prop_rows(self, fh, path, mech_df, queue_ids):
+        '''
+        write rows of queue_ids in mech_df to fh[path]
+        return False if the mech_df in file cannot be updated by rows 
+        (not native, or different columns or rows)
+        '''
+        if path not in fh or not isinstance(fh[path], h5py.Group):
+            return False
+        grp = fh[path]
+        if json.loads(grp.attrs.get('columns', '[]')) != list(mech_df.columns):
+            return False
+        queue_id = mech_df['queue_id'].values.astype('int64')
+        if not np.array_equal(grp['queue_id'][()], queue_id): # rows changed
+            return False
 
-                        # delete/create protocal
-                        # if mech_key in fh['prop/' + chn_name].keys():
-                        #     del fh['prop/' + chn_name + '/' + mech_key]
-                        # else:
-                        # # create data_set for mech_df
-                        # fh.create_dataset('prop/' + chn_name + '/' + mech_key, data=mech_df.to_json(), dtype=h5py.special_dtype(vlen=str))
+        # positions of the rows to write (increasing)
+        pos = np.flatnonzero(np.isin(queue_id, list(queue_ids)))
+        if pos.size == 0:
+            return True
+
+        arrs = self._prop_to_arrays(mech_df, pos)
+        if any(grp[col].shape[1:] != arr.shape[1:] or grp[col].dtype != arr.dtype for col, arr in arrs.items()):
+            return False
+
+        logger.info('write %s rows to prop %s', pos.size, path) 
+        self._write_group_rows(grp, arrs, pos, len(queue_id))
+        return True
+
+
+    def _load_prop(self, chn_name, mech_key):
+        '''
+        load mech_df of mech_key from file
+        saved as numeric datasets or json (saved by old version)
+        return mech_df sorted by queue_id
+        '''
+        with self._read_session() as fh:
+            obj = fh['prop/' + chn_name + '/' + mech_key]
+            if isinstance(obj, h5py.Group): # native
+                cols = json.loads(obj.attrs['columns'])
+                data = {}
+                for col in cols:
+                    arr = obj[col][()]
+                    data[col] = arr if arr.ndim == 1 else arr.tolist()
+                mech_df = pd.DataFrame(data, columns=cols)
+            else: # json
+                data = obj[()]
+                if isinstance(data, bytes): # h5py >= 3 returns bytes
+                    data = data.decode()
+                mech_df = self._replace_none_with_nan_in_prop(pd.read_json(io.StringIO(data)))
+
+        # rest index df
+        return mech_df.sort_values(by=['queue_id']).reset_index(drop=True)
+
+
+    def _replace_none_with_nan_in_prop(self, df):
+        '''
+        replace the None with nan in list columns of mech_df loaded from json
+        '''
+        # get names of columns with list in it
+        cols = [col for col in df.columns if df.shape[0] > 0 and isinstance(df[col].iloc[0], list)]
+        logger.info(cols) 
+        
+        for col in cols:
+            # logger.info('%s \n %s', col, df[col])
+            df[col] = df[col].apply(lambda row: self.nan_harm_list() if row is None else [np.nan if x is None else x for x in row])
+            df[col] = df[col].apply(lambda row: [row[i]  for i in range(int((self.settings['max_harmonic']+1)/2))])
+        return df
 
 
     def save_exp_ref(self):
-        with h5py.File(self.path, 'a') as fh:
+        with self._open_write() as fh:
             # save reference
 
             # make a copy for saving
@@ -802,24 +1492,501 @@ class DataSaver:
         '''
         save ver (str) to file
         '''
-        with h5py.File(self.path, 'a') as fh:
+        with self._open_write() as fh:
             fh.attrs['ver'] = self.ver
 
 
     def get_chn_queue_list_from_raw(self, chn_name):
-        with h5py.File(self.path, 'r') as fh:
-            chn_queue_list = list(fh['raw/'+ chn_name].keys())
-            chn_queue_list = list(map(int, chn_queue_list)) # convert from str to int
+        with self._read_session() as fh:
+            chn_queue_list = self._raw_queue_list(fh, chn_name)
             logger.info(chn_queue_list)
         return chn_queue_list
 
 
     def get_queue_id_harms_from_raw(self, chn_name, queue_id):
-        with h5py.File(self.path, 'r') as fh:
-            harms = list(fh['raw/'+ chn_name + '/' + str(queue_id)].keys())
+        with self._read_session() as fh:
+            if self._raw_layout(fh, chn_name) == 'chunked':
+                harms = [harm for harm in self._raw_harms(fh, chn_name) if self._raw_record(fh, chn_name, queue_id, harm) is not None]
+            else:
+                harms = list(fh['raw/'+ chn_name + '/' + str(queue_id)].keys())
         return [str(harm) for harm in harms]
 
 
+    @contextlib.contextmanager
+    def _read_session(self):
+        '''
+        context of reading self.path with the handle kept open
+        the handle is reused by the following sessions until the file is written 
+        (self._open_write), another file is initiated/loaded or self.close_read is called
+        usage: 
+            with self._read_session() as fh:
+                ...
+        '''
+        if self._swmr_fh is not None: # read by the handle for writing
+            self._write_journal_raws()
+            self.flush()
+            yield self._swmr_fh
+            return
+        if self._fh_read is None or not self._fh_read.id.valid:
+            self._write_journal_raws() # raw data of scans in journal are read from file
+            self.flush() # the queued data are written before reading
+            self._fh_read = h5py.File(self.path, 'r', **(swmr_read_kwargs if self._swmr_read else {}))
+        yield self._fh_read
+
+
+    def close_read(self):
+        '''
+        close the handle for reading
+        '''
+        if self._fh_read is not None:
+            if self._fh_read.id.valid:
+                self._fh_read.close()
+            self._fh_read = None
+
+
+    def _open_write(self, mode='a', swmr=False):
+        '''
+        open self.path for writing
+        the handle for reading is closed and self._raw_meta_cache is cleared
+        swmr: if True and SWMR mode is running, the handle kept open is used (data written to
+              the existing datasets only). Otherwise, SWMR mode is stopped before opening the file
+        return the file handle
+        '''
+        if self._swmr_read:
+            raise RuntimeError('{} is opened for reading in SWMR mode'.format(self.path))
+        self.flush() # the queued data are written first
+        self.close_read()
+        self._raw_meta_cache = {}
+        self._raw_mm = None
+        if self._swmr_fh is not None:
+            if swmr:
+                return self._swmr_session()
+            logger.info('stop SWMR mode to write %s', self.path)
+            self.stop_swmr()
+        return self._open_file_write(mode)
+
+
+    def _open_file_write(self, mode='a', **kwargs):
+        '''
+        open self.path for writing
+        kwargs: other kwargs of h5py.File
+        after SWMR mode is started, the readers may keep the file open, 
+        so it is opened without file locking
+        '''
+        if self._swmr_started:
+            kwargs['locking'] = False
+        return h5py.File(self.path, mode, **kwargs)
+
+
+    def _writer_file(self):
+        '''
+        file handle of the background writer for a batch of jobs
+        the handle kept open in SWMR mode or self.path opened for writing
+        '''
+        if self._swmr_fh is not None:
+            return self._swmr_session()
+        return self._open_file_write()
+
+
+    @contextlib.contextmanager
+    def _swmr_session(self):
+        '''
+        context of writing by the handle in SWMR mode
+        the data are flushed to file at the end, so the readers can see them
+        '''
+        yield self._swmr_fh
+        self._swmr_fh.flush()
+
+
+    def _write(self, job):
+        '''
+        run job (function of file handle: job(fh)) to write the file
+        by the background writer if it is running, or else, directly
+        '''
+        if self._writer is None:
+            with self._open_write(swmr=True) as fh:
+                job(fh)
+        else:
+            # the handle for reading is closed before the writer opens the file
+            self.close_read()
+            self._raw_meta_cache = {}
+            self._raw_mm = None
+            self._writer.put(job) # wait if the queue is full
+
+
+    def start_writer(self, maxsize=DataWriter.queue_size):
+        '''
+        start the background writer
+        the raw data (dynamic_save) and data tables (save_data) are written by a dedicated thread 
+        until self.close is called
+        maxsize: max number of writing jobs waiting in the queue
+        '''
+        if self._writer is None:
+            self._writer = DataWriter.DataWriter(self._writer_file, maxsize=maxsize)
+
+
+    def flush(self):
+        '''
+        wait until the data queued in the background writer are written to file
+        '''
+        if self._writer is not None:
+            self._writer.flush()
+
+
+    def close(self):
+        '''
+        write the data queued in the background writer and stop it
+        the scans in journal are written to file and the journal is removed
+        '''
+        if self._journal is not None:
+            self._save_data()
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.close()
+        self.stop_swmr()
+        if self._journal is not None: # all data are in file
+            journal, self._journal = self._journal, None
+            journal.close(remove=not self._journal_failed)
+
+
+    def compact(self, path=None, compression=None, compression_opts=None, shuffle=None, chunks=None):
+        '''
+        repack the h5 file at path (self.path by default) to reclaim the space of deleted
+        or rewritten data. the live objects are copied into a fresh file, which replaces
+        the file atomically (see H5Compact.compact_file)
+        compression: None (keep the compression of each dataset), False (no compression), 'gzip' or 'lzf'
+        compression_opts: level of gzip (0-9)
+        shuffle: None (keep), True or False. only used with compression
+        chunks: None (keep), True (auto) or int (rows of each chunk along the first axis)
+                raw data in 'chunked' layout are grouped by chunks queues per chunk. They are still 
+                mapped by iter_raw if not compressed
+        return (file size before, file size after)
+        '''
+        if path is None:
+            path = self.path
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            # the queued data are written and the file is closed before copying
+            self.flush()
+            self.stop_swmr()
+            self.close_read()
+            self._raw_meta_cache = {}
+            self._raw_mm = None
+        return H5Compact.compact_file(path, compression=compression, compression_opts=compression_opts, shuffle=shuffle, chunks=chunks)
+
+
+    def start_journal(self, compact_scans=None):
+        '''
+        start the journal of scans (self.path + journal_ext)
+        scans saved by dynamic_save are appended to journal and written to file
+        by every compact_scans scans (self.save_data) and self.close
+        compact_scans: None for settings['journal_compact_scans'] or ScanJournal.compact_scans
+        '''
+        if self._journal is None:
+            if compact_scans is None:
+                compact_scans = self.settings.get('journal_compact_scans', ScanJournal.compact_scans)
+            self._journal = ScanJournal.ScanJournal(self.path + journal_ext, compact_scans=compact_scans)
+            self._journal_failed = False
+
+
+    def _replay_journal(self):
+        '''
+        recover scans from the journal (self.path + journal_ext) left by a stopped program
+        scans not in data tables are added and their raw data are written to file
+        the journal locked by a running program (recording to the file) is skipped
+        '''
+        path = self.path + journal_ext
+        if not os.path.exists(path):
+            return
+        if ScanJournal.is_locked(path):
+            logger.warning('journal %s is used by another program. It is not replayed.', path)
+            return
+        records, _ = ScanJournal.read_records(path)
+        logger.warning('replay %s scans in journal %s', len(records), path)
+
+        for meta, arrays in records:
+            queue_id = meta['queue_id']
+            chn_names = meta['chn_names']
+            harm_list = meta['harm_list']
+            if not any(np.isin(queue_id, self._stores[chn_name].col('queue_id')) for chn_name in chn_names): # not saved in data
+                for chn_name in chn_names:
+                    row = meta['rows'][chn_name]
+                    self._stores[chn_name].append(
+                        queue_id, 
+                        t=row['t'], 
+                        temp=row['temp'], 
+                        **{col: arrays['data/' + chn_name + '/' + col] for col in data_harm_cols},
+                    )
+                    self._mark_dirty(chn_name, queue_id)
+                if queue_id not in self.queue_list:
+                    self.queue_list = sorted(self.queue_list + [queue_id])
+
+            raws = {chn_name: {harm: arrays['raw/' + chn_name + '/' + harm] for harm in harm_list} for chn_name in chn_names}
+            self._write(self._raw_writing(queue_id, chn_names, harm_list, meta['t'], meta['temp'], raws, skip_existing=True))
+
+        self.save_data()
+        ScanJournal.remove(path)
+
+
+    def start_swmr(self):
+        '''
+        start SWMR (single writer multiple readers) mode of self.path
+        the file is kept open by this DataSaver as the only writer. The rows of data tables
+        and raw data are appended to the existing datasets and flushed after each writing, 
+        so other processes can read them while the data are collected 
+        (load_file(path, swmr=True) and poll).
+        No objects can be created in SWMR mode, so the datasets are created before:
+        data tables are saved as numeric datasets and the raw data of all harmonics in 'chunked' layout.
+        raw data saved in 'queue' layout (old versions) cannot be appended in SWMR mode.
+        The file is upgraded (repacked with libver='latest') if it is saved by HDF5 < 1.10 format.
+        Writing settings, exp_ref, prop or deleting data stops SWMR mode (self.stop_swmr).
+        '''
+        if self._swmr_fh is not None:
+            return
+        with self._read_session() as fh:
+            queue_chns = [chn_name for chn_name in self._chn_keys if self._raw_layout(fh, chn_name) == 'queue']
+        if queue_chns:
+            raise ValueError("raw data of {} in {} are saved in 'queue' layout, which cannot be appended in SWMR mode".format(queue_chns, self.path))
+
+        # tables are saved as numeric datasets
+        self._save_data(full=True)
+        with self._open_write() as fh:
+            for chn_name in self._chn_keys:
+                g_chn = fh['raw'].require_group(chn_name)
+                g_chn.attrs['layout'] = 'chunked'
+                for harm in range(1, self.settings['max_harmonic'] + 2, 2):
+                    harm = str(harm)
+                    npts = self.settings.get('harmdata', {}).get(chn_name, {}).get(harm, {}).get('lineEdit_scan_harmsteps', swmr_npts)
+                    self._require_raw_chunked(g_chn, harm, int(npts))
+            superblock_ver = fh.id.get_create_plist().get_version()[0]
+
+        if superblock_ver < 3: # SWMR needs the file format of HDF5 >= 1.10
+            logger.info('upgrade %s for SWMR mode', self.path)
+            H5Compact.compact_file(self.path, libver='latest')
+        self._swmr_fh = self._open_file_write('a', libver='latest')
+        self._swmr_fh.swmr_mode = True
+        self._swmr_started = True
+        logger.info('SWMR mode started: %s', self.path)
+
+
+    def stop_swmr(self):
+        '''
+        stop SWMR mode (self.start_swmr)
+        the queued data are written and the handle for writing is closed.
+        the readers should close the file, since the data written after SWMR mode
+        are not safe to read by them.
+        '''
+        if self._swmr_fh is not None:
+            self.flush()
+            fh, self._swmr_fh = self._swmr_fh, None
+            fh.close()
+            logger.info('SWMR mode stopped: %s', self.path)
+
+
+    def poll(self):
+        '''
+        read the data appended by the writer in SWMR mode since the file is loaded by
+        self.load_file(path, swmr=True) or last poll
+        the new rows are appended to the data tables and the index tables of raw data are updated.
+        the tables rewritten by the writer (e.g. rows deleted) are read again. 
+        rows changed in place (e.g. marks) are read by loading the file again
+        return {key of data table: list of queue_id of new rows}
+        '''
+        if not self._swmr_read:
+            raise RuntimeError('{} is not opened for reading in SWMR mode'.format(self.path))
+        vers = {key: self._stores[key].ver for key in self._table_keys()}
+        new = {}
+        queue_ids = []
+        with self._read_session() as fh:
+            for key in self._table_keys():
+                if self._is_native_table(fh, key):
+                    new[key] = self._poll_table(fh, key).tolist()
+                    queue_ids.extend(new[key])
+            for chn_name in self._chn_keys:
+                if self._raw_layout(fh, chn_name) == 'chunked':
+                    for harm in self._raw_harms(fh, chn_name):
+                        queue_ids.extend(self._poll_raw_index(fh, chn_name, harm).tolist())
+        self._raw_mm = None # the file may be extended
+
+        if queue_ids:
+            self.queue_list = np.union1d(self.queue_list, queue_ids).astype(int).tolist()
+        for chn_name in self._chn_keys:
+            if self._stores[chn_name + '_ref'].ver != vers[chn_name + '_ref']: # reference changed
+                self.calc_fg_ref(chn_name, mark=False)
+        return new
+
+
+    def _poll_table(self, fh, key):
+        '''
+        read the rows of data table key appended in file since last reading (SWMR mode)
+        the table is read again if it is rewritten in file
+        return ndarray of queue_id of the new rows
+        '''
+        grp = fh['data/' + key]
+        cols = [col for col in data_single_cols + data_harm_cols if col in grp]
+        for col in cols:
+            grp[col].refresh()
+        store = self._stores[key]
+        n = store.nrows
+        nrows = min(grp[col].shape[0] for col in cols) # columns are resized one by one
+        if nrows < n or (n > 0 and grp['queue_id'][n-1] != store.col('queue_id')[n-1]): # rewritten
+            logger.info('read table %s again', key)
+            queue_ids = store.col('queue_id').copy()
+            store = self._read_store(fh, key)
+            self._stores[key] = store.take(np.argsort(store.col('queue_id'), kind='stable'))
+            return np.setdiff1d(self._stores[key].col('queue_id'), queue_ids)
+        if nrows == n:
+            return np.empty(0, dtype='int64')
+
+        arrs = {col: grp[col][n:nrows] for col in cols}
+        # rows not flushed by the writer yet (t of fill value 0) are read by next poll
+        unwritten = np.flatnonzero(arrs['t'] == 0)
+        if unwritten.size:
+            arrs = {col: arr[:unwritten[0]] for col, arr in arrs.items()}
+        store.extend(
+            arrs['queue_id'], 
+            arrs['t'], 
+            arrs['temp'], 
+            **{col: np.asarray(arrs[col], dtype='float64')[:, :self.n_harm()] for col in data_harm_cols if col in arrs},
+        )
+        return arrs['queue_id']
+
+
+    def _poll_raw_index(self, fh, chn_name, harm):
+        '''
+        append the records of index table of harm in chn_name appended in file 
+        since last reading (SWMR mode) to the cached index table (self._raw_index)
+        the index table is read again if it is changed otherwise (e.g. records deleted)
+        return ndarray of queue_id of the new records
+        '''
+        g_chn = fh['raw/' + chn_name]
+        g_chn['harm_' + harm].refresh()
+        ds_idx = g_chn['index_' + harm]
+        ds_idx.refresh()
+        key = ('index', chn_name, harm)
+        if key not in self._raw_meta_cache: # read by self._raw_index
+            return np.empty(0, dtype='int64')
+        index = self._raw_meta_cache[key]
+        nrows = ds_idx.shape[0]
+        # the last cached record is compared by the fields locating the raw data (temp can be nan)
+        if nrows < index.size or (index.size > 0 and any(ds_idx[index.size-1][f] != index[-1][f] for f in ['queue_id', 'offset', 'npts'])): # changed
+            del self._raw_meta_cache[key]
+            return np.empty(0, dtype='int64')
+
+        records = ds_idx[index.size:nrows] if nrows > index.size else np.empty(0, dtype=raw_index_dtype)
+        # records not flushed by the writer yet (npts of fill value 0) are read by next poll
+        unwritten = np.flatnonzero(records['npts'] == 0)
+        if unwritten.size:
+            records = records[:unwritten[0]]
+        self._raw_meta_cache[key] = np.concatenate([index, records])
+        return records['queue_id']
+
+
+    def _raw_cache_pop(self, chn_name, queue_id, harm):
+        '''
+        remove the cached raw of (chn_name, queue_id, harm)
+        '''
+        self._raw_cache.pop((chn_name, int(queue_id), harm), None)
+
+
+    def _raw_layout(self, fh, chn_name):
+        '''
+        layout of raw data of chn_name in file
+        return 'chunked', 'queue' or None (no raw data of chn_name)
+        '''
+        if ('layout', chn_name) not in self._raw_meta_cache:
+            if chn_name not in fh['raw']:
+                self._raw_meta_cache[('layout', chn_name)] = None
+            else:
+                self._raw_meta_cache[('layout', chn_name)] = fh['raw/' + chn_name].attrs.get('layout', 'queue')
+        return self._raw_meta_cache[('layout', chn_name)]
+
+
+    def _raw_harms(self, fh, chn_name):
+        '''
+        harmonics (str) saved in chn_name in 'chunked' layout
+        '''
+        if ('harms', chn_name) not in self._raw_meta_cache:
+            self._raw_meta_cache[('harms', chn_name)] = [key[len('index_'):] for key in fh['raw/' + chn_name].keys() if key.startswith('index_')]
+        return self._raw_meta_cache[('harms', chn_name)]
+
+
+    def _raw_index(self, fh, chn_name, harm):
+        '''
+        index table of harm in chn_name in 'chunked' layout
+        return structured ndarray of raw_index_dtype
+        '''
+        if ('index', chn_name, harm) not in self._raw_meta_cache:
+            key = 'raw/' + chn_name + '/index_' + harm
+            if key in fh:
+                self._raw_meta_cache[('index', chn_name, harm)] = fh[key][()]
+            else:
+                self._raw_meta_cache[('index', chn_name, harm)] = np.empty(0, dtype=raw_index_dtype)
+        return self._raw_meta_cache[('index', chn_name, harm)]
+
+
+    def _raw_record(self, fh, chn_name, queue_id, harm):
+        '''
+        record of queue_id in the index table of harm in 'chunked' layout
+        return None if not exists
+        '''
+        index = self._raw_index(fh, chn_name, harm)
+        records = index[index['queue_id'] == int(queue_id)]
+        return records[-1] if records.size else None
+
+
+    def _raw_queue_list(self, fh, chn_name):
+        '''
+        list of queue_id (int) with raw data in chn_name
+        '''
+        layout = self._raw_layout(fh, chn_name)
+        if layout is None:
+            return []
+        elif layout == 'chunked':
+            queue_ids = [self._raw_index(fh, chn_name, harm)['queue_id'] for harm in self._raw_harms(fh, chn_name)]
+            return np.unique(np.concatenate(queue_ids)).tolist() if queue_ids else []
+        else:
+            return list(map(int, fh['raw/'+ chn_name].keys())) # convert from str to int
+
+
+    def _raw_t_temp(self, fh, chn_name, queue_id):
+        '''
+        t (str) and temp of queue_id in raw
+        '''
+        if self._raw_layout(fh, chn_name) == 'chunked':
+            for harm in self._raw_harms(fh, chn_name):
+                record = self._raw_record(fh, chn_name, queue_id, harm)
+                if record is not None:
+                    t = pd.Timestamp(record['t']).strftime(self.settings['time_str_format']) if record['t'] != nat_int else ''
+                    return t, float(record['temp'])
+            raise KeyError('No raw data found for {}, {}'.format(chn_name, queue_id))
+
+        g_queue = fh['raw/' + chn_name + '/' + str(int(queue_id))]
+        t = g_queue.attrs['t']
+        if 'temp' in g_queue.attrs.keys():
+            temp = g_queue.attrs['temp']
+        else:
+            temp = np.nan
+        return t, temp
+
+
+    def _del_raw(self, fh, chn_name, queue_id, harm):
+        '''
+        delete raw data of queue_id, harm in chn_name
+        in 'chunked' layout, the record is removed from the index table 
+        and the space of the data is left in the dataset
+        '''
+        self._raw_cache_pop(chn_name, queue_id, harm)
+        if self._raw_layout(fh, chn_name) == 'chunked':
+            self._raw_meta_cache.clear()
+            ds_idx = fh['raw/' + chn_name + '/index_' + harm]
+            index = ds_idx[()]
+            index = index[index['queue_id'] != int(queue_id)]
+            ds_idx.resize(index.shape)
+            ds_idx[...] = index
+        else:
+            del fh['raw/' + chn_name + '/' + str(int(queue_id)) + '/' + harm]
+
+
     def get_npts(self):
         '''
         get number of total points
@@ -828,26 +1995,54 @@ class DataSaver:
 
 
     def nan_harm_list(self):
-        return [np.nan] * int((self.settings['max_harmonic'] + 1) / 2)
+        return [np.nan] * self.n_harm()
+
+
+    def n_harm(self):
+        '''
+        number of harmonics saved in data
+        max_harmonic of config_default is used if it is not in settings
+        '''
+        return int((self.settings.get('max_harmonic', UISettings.config_default['max_harmonic']) + 1) / 2)
 
 
     def get_raw(self, chn_name, queue_id, harm, with_t_temp=False):
         '''
         return a set of raw data (f, G, B) or (f, G, B, t, temp)
-        '''
-        with h5py.File(self.path, 'r') as fh:
-            t = fh['raw/' + chn_name + '/' + str(int(queue_id))].attrs['t']
-            if 'temp' in fh['raw/' + chn_name + '/' + str(int(queue_id))].attrs.keys():
-                temp = fh['raw/' + chn_name + '/' + str(int(queue_id))].attrs['temp']
-            else:
-                temp = np.nan
+        raw data read from file are kept in an LRU cache (self._raw_cache)
+        and copies are returned
+        '''
+        key = (chn_name, int(queue_id), harm)
+        if key in self._raw_cache: # cached
+            self._raw_cache.move_to_end(key)
+            raw, t, temp = self._raw_cache[key]
+            self.raw = {
+                'f': raw[0, :].copy(),
+                'G': raw[1, :].copy(),
+                'B': raw[2, :].copy(),
+            }
+            if with_t_temp:
+                return [self.raw['f'], self.raw['G'], self.raw['B'], t, temp]
+            else: 
+                return [self.raw['f'], self.raw['G'], self.raw['B']]
+
+        with self._read_session() as fh:
+            t, temp = self._raw_t_temp(fh, chn_name, queue_id)
 
             if self._raw_exists(fh, chn_name, queue_id, harm): # raw data exist
-                raw = fh['raw/' + chn_name + '/' + str(int(queue_id)) + '/' + harm][()]
+                if self._raw_layout(fh, chn_name) == 'chunked':
+                    record = self._raw_record(fh, chn_name, queue_id, harm)
+                    raw = fh['raw/' + chn_name + '/harm_' + harm][record['offset'], :, :record['npts']]
+                else:
+                    raw = fh['raw/' + chn_name + '/' + str(int(queue_id)) + '/' + harm][()]
+                # save to cache
+                self._raw_cache[key] = (raw, t, temp)
+                if len(self._raw_cache) > raw_cache_size:
+                    self._raw_cache.popitem(last=False) # remove the least recently used
                 self.raw = {
-                    'f': raw[0, :],
-                    'G': raw[1, :],
-                    'B': raw[2, :],
+                    'f': raw[0, :].copy(),
+                    'G': raw[1, :].copy(),
+                    'B': raw[2, :].copy(),
                 }
         
             else: # raw data doesn't exist
@@ -869,18 +2064,110 @@ class DataSaver:
         check if corresponding raw data exists
         file_handle: handle to the file
         '''
-        logger.info('raw chn:%s id:%s harm:%s', chn_name, queue_id, harm)
-        logger.info('raw in fh: %s', 'raw' in file_handle.keys())
-        logger.info('chn_name in fh["raw"]: %s', chn_name in file_handle['raw'])
-        logger.info('queue_id in raw/chn_name: %s', str(int(queue_id)) in file_handle['raw/'+chn_name])
-        logger.info('harm in raw/chn_name/queue_id: %s', harm in file_handle['raw/' + chn_name + '/' + str(int(queue_id))])
+        if 'raw' not in file_handle:
+            exists = False
+        elif self._raw_layout(file_handle, chn_name) == 'chunked':
+            exists = self._raw_record(file_handle, chn_name, queue_id, harm) is not None
+        else:
+            # one lookup of the path (False if any group in the path doesn't exist)
+            exists = 'raw/' + chn_name + '/' + str(int(queue_id)) + '/' + harm in file_handle
+        logger.debug('raw chn:%s id:%s harm:%s exists: %s', chn_name, queue_id, harm, exists)
+        return exists
 
-        if 'raw' in file_handle.keys() and chn_name in file_handle['raw'] and str(int(queue_id)) in file_handle['raw/'+chn_name] and harm in file_handle['raw/' + chn_name + '/' + str(int(queue_id))]: 
-            logger.info('raw exists')
-            return True
+
+    def get_raw_view(self, chn_name, queue_id, harm):
+        '''
+        return a set of raw data (f, G, B) as read-only views mapped from file without copying
+        copies are returned if the data is compressed (see self.iter_raw)
+        return [None, None, None] if raw data doesn't exist
+        '''
+        for _, _, f, G, B in self.iter_raw(chn_name, harms=[harm], queue_ids=[queue_id]):
+            return [f, G, B]
+        logger.warning('No raw data found for %s, %s, %s', chn_name, queue_id, harm)
+        return [None, None, None]
+
+
+    def iter_raw(self, chn_name, harms=None, queue_ids=None):
+        '''
+        iterate over raw data of chn_name in the order saved in file
+        harms: list of str. None for all harmonics
+        queue_ids: list of int. None for all queues
+        yield queue_id, harm, f, G, B
+            f, G, B are read-only views of np.memmap of the file if the data is not compressed.
+            In 'chunked' layout, each queue is saved in one row of a chunk (one queue per chunk
+            unless the file is repacked with chunks, see self.compact). With raw_compression == None,
+            the chunk is contiguous in file and the row is mapped directly.
+            In 'queue' layout, the datasets are contiguous.
+            otherwise, the data is read (copied) from file.
+        NOTE: the views are mapped to the file when iterating. writing to the file (e.g. collecting data) 
+        during the iteration is not supported.
+        '''
+        with self._read_session() as fh:
+            locations = self._raw_locations(fh, chn_name, harms, queue_ids)
+            # sort by the position in file
+            locations.sort(key=lambda loc: loc[0])
+            for _, queue_id, harm, get_raw in locations:
+                raw = get_raw()
+                yield queue_id, harm, raw[0, :], raw[1, :], raw[2, :]
+
+
+    def _raw_locations(self, fh, chn_name, harms=None, queue_ids=None):
+        '''
+        locations of raw data of chn_name in file
+        harms: list of str. None for all harmonics
+        queue_ids: list of int. None for all queues
+        return list of (byte offset in file, queue_id, harm, function returns raw data (3 x npts))
+        '''
+        layout = self._raw_layout(fh, chn_name)
+        if layout is None:
+            return []
+
+        locations = []
+        if layout == 'chunked':
+            for harm in self._raw_harms(fh, chn_name):
+                if (harms is not None) and (harm not in harms):
+                    continue
+                index = self._raw_index(fh, chn_name, harm)
+                if queue_ids is not None:
+                    index = index[np.isin(index['queue_id'], queue_ids)]
+                ds = fh['raw/' + chn_name + '/harm_' + harm]
+                # not compressed and each row (f, G, B) is not split by chunks
+                mappable = ds.id.get_create_plist().get_nfilters() == 0 and ds.chunks[1] == 3
+                rows = ds.chunks[0] # queues in a chunk (more than 1 if repacked with chunks, see self.compact)
+                for record in index:
+                    offset = int(record['offset'])
+                    byte_offset = ds.id.get_chunk_info_by_coord((offset - offset % rows, 0, 0)).byte_offset
+                    # position of the queue in the chunk (stored in C order)
+                    byte_offset += (offset % rows) * 3 * ds.chunks[2] * ds.dtype.itemsize
+                    if mappable and record['npts'] <= ds.chunks[2]: # in one chunk
+                        get_raw = lambda ds=ds, byte_offset=byte_offset, npts=record['npts']: self._raw_views(byte_offset, (3, ds.chunks[2]), ds.dtype)[:, :npts]
+                    else:
+                        get_raw = lambda ds=ds, offset=record['offset'], npts=record['npts']: ds[offset, :, :npts]
+                    locations.append((byte_offset, int(record['queue_id']), harm, get_raw))
         else:
-            logger.info('raw does not exists')
-            return False
+            for queue_id in self._raw_queue_list(fh, chn_name):
+                if (queue_ids is not None) and (queue_id not in queue_ids):
+                    continue
+                for harm, ds in fh['raw/' + chn_name + '/' + str(queue_id)].items():
+                    if (harms is not None) and (harm not in harms):
+                        continue
+                    byte_offset = ds.id.get_offset() # None if not contiguous
+                    if byte_offset is not None:
+                        get_raw = lambda ds=ds, byte_offset=byte_offset: self._raw_views(byte_offset, ds.shape, ds.dtype)
+                    else:
+                        get_raw = lambda ds=ds: ds[()]
+                        byte_offset = np.inf
+                    locations.append((byte_offset, queue_id, harm, get_raw))
+        return locations
+
+
+    def _raw_views(self, byte_offset, shape, dtype):
+        '''
+        read-only ndarray of shape and dtype at byte_offset of the memory map of self.path
+        '''
+        if self._raw_mm is None:
+            self._raw_mm = np.memmap(self.path, dtype='uint8', mode='r')
+        return np.ndarray(shape, dtype=dtype, buffer=self._raw_mm, offset=byte_offset)
 
 
     def get_queue(self, chn_name, queue_id, col=''):
@@ -889,25 +2176,27 @@ class DataSaver:
         if col == '': return whole row
         if col == column name: return the column
         '''
-        df_chn = getattr(self, chn_name).copy()
+        store = self._stores[chn_name]
+        pos = store.position(queue_id)
+        # df of the row (empty if queue_id doesn't exist)
+        df_queue = store.take([] if pos is None else [pos]).to_dataframe()
         if col == '':
-            return df_chn.loc[df_chn.queue_id == queue_id, :]
-        elif col in df_chn.keys(): # col is a column name
-            return df_chn.loc[df_chn.queue_id == queue_id, col]
+            return df_queue
+        elif col in df_queue.keys(): # col is a column name
+            return df_queue[col]
 
 
     def update_queue_col(self, chn_name, queue_id, col, val):
         '''
         update col data of a queue_id
         '''
-        if queue_id in self.get_queue_id(chn_name).values: # overwrite
-            logger.info(getattr(self, chn_name).loc[getattr(self, chn_name).queue_id == queue_id, col]) 
+        pos = self._stores[chn_name].position(queue_id) # integer
+        if pos is not None: # overwrite
             logger.info('col %s', col) 
             logger.info('val %s', val) 
-
-            ind = getattr(self, chn_name)[getattr(self, chn_name).queue_id == queue_id].index[0] # integer
-            logger.info(ind)
-            getattr(self, chn_name).at[ind, col] = val
+            logger.info(pos)
+            self._stores[chn_name].set_value(pos, col, val)
+            self._mark_dirty(chn_name, queue_id)
 
             # # following .loc works the same as .at
             # ind = getattr(self, chn_name)[getattr(self, chn_name).queue_id == queue_id].index # index array
@@ -922,7 +2211,8 @@ class DataSaver:
     def update_mech_queue(self, chn_name, nhcalc, queue):
         '''
         this function update queue (df) the df of dmech_df
-        This function will check if the index of both dmech_df and queue with the same queue_id are the same. if not, the index of queue will be changed to it of dmech_df and use dataframe.update function to update
+        This function will find the row of dmech_df with the same queue_id and write the values of queue to the row in place
+        (the same as dataframe.update: nan in queue doesn't overwrite)
         
         df_name: 'samp', 'ref', 'samp_ref', 'ref_ref', 'samp_prop', 'ref_prop'
         queue: one row of the df
@@ -937,7 +2227,6 @@ class DataSaver:
         queue['queue_id'] = queue.queue_id.astype('int')
         # logger.info(queue) 
         queue_id = queue.queue_id.iloc[0]
-        queue_idx = queue.index[0]
         # logger.info(queue_id) 
         # logger.info(type(queue_id)) 
         # logger.info(queue_idx) 
@@ -945,12 +2234,20 @@ class DataSaver:
 
         df = getattr(self, chn_name + '_prop')[mech_key]
 
-        df_idx = df[df.queue_id == queue_id].index.astype(int)[0]
-
-        if queue_idx != df_idx: # index doesn't match
-            queue.index = [df_idx]
+        df_idx = getattr(self, chn_name + '_prop').row_label(mech_key, queue_id)
+        if df_idx is None:
+            logger.warning('queue_id {} is not in df of {} in {}'.format(queue_id, mech_key, chn_name))
+            return
 
-        getattr(self, chn_name + '_prop')[mech_key].update(queue)
+        # write to the row in place instead of aligning the whole df (dataframe.update)
+        for col in queue.columns:
+            if col not in df.columns:
+                continue
+            val = queue[col].iloc[0]
+            if np.isscalar(val) and pd.isnull(val): # nan doesn't overwrite
+                continue
+            df.at[df_idx, col] = val
+        getattr(self, chn_name + '_prop').mark_dirty(mech_key, queue_id)
 
         self.saveflg = False
 
@@ -962,41 +2259,11 @@ class DataSaver:
         '''
         for chn_name in self._chn_keys:
             for ext in ['', '_ref']: # samp/ref and samp_ref/ref_ref
-                df = getattr(self, chn_name + ext)
-                col_endswith_s = [col for col in df.columns if col.endswith('s')]
-                # logger.info(col_endswith_s) 
-                
-                for col in col_endswith_s:
-                    df[col] = df[col].apply(lambda row: self.nan_harm_list() if row is None else [np.nan if x is None else x for x in row])
-                    # df[col] = df[col].apply(lambda row: [np.nan if x is None else x for x in row])
-                    df[col] = df[col].apply(lambda row: [row[i]  for i in range(int((self.settings['max_harmonic']+1)/2))])
-
-                # rest index df
-                df = df.reset_index(drop=True)
-
-                # save back
-                setattr(self, chn_name + ext, df)
-
-            # prop
-            if getattr(self, chn_name + '_prop', {}): # prop exists
-                for mech_key, df in getattr(self, chn_name + '_prop').items():
-                    # get names of columns with list in it
-                    cols = [col for col in df.columns if isinstance(df[col][0], list)]
-                    logger.info(cols) 
-                    
-                    for col in cols:
-                        # logger.info('%s \n %s', col, df[col])
-                        df[col] = df[col].apply(lambda row: self.nan_harm_list() if row is None else [np.nan if x is None else x for x in row])
-                        df[col] = df[col].apply(lambda row: [row[i]  for i in range(int((self.settings['max_harmonic']+1)/2))])
+                # None is saved as nan in the store already
+                # rest index 
+                self._stores[chn_name + ext].reset_index()
 
-                    # logger.info(df['delf_exps'].values) 
-                    # logger.info(getattr(self, chn_name + '_prop')[mech_key]['delf_exps'].values) 
-
-                    # rest index df
-                    df = df.reset_index(drop=True)
-
-                    # save back
-                    getattr(self, chn_name + '_prop')[mech_key] = df
+            # prop is processed when it is loaded (self._load_prop)
 
 
     def update_mech_df_in_prop(self, chn_name, nhcalc, mech_df):
@@ -1062,105 +2329,203 @@ class DataSaver:
     ##  converting data.
     ####################################################
 
-    def data_exporter(self, fileName, mark=False, dropnanmarkrow=False, dropnancolumn=True, unit_t='s', unit_temp='C'):
+    def data_exporter(self, fileName, mark=False, dropnanmarkrow=False, dropnancolumn=True, unit_t='s', unit_temp='C', chunk_rows=DataExporter.export_chunk_rows):
         '''
         this function export the self.data.samp and ...ref 
         in the ext form
         fileName: string of full path with file name
+        ext: .xlsx, .csv, .json, .parquet or .feather (.arrow) (see DataExporter)
+        the sheets are made from the data arrays and written by chunks of chunk_rows rows
         '''
         # TODO add exp_ref
 
-        # get df of samp and ref channel
-        on_cols = ['queue_id', 't', 'temp']
-        df_samp = pd.merge(
-            # f
-            self.reshape_data_df('samp', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, unit_t=unit_t, unit_temp=unit_temp, keep_mark=False),
-            # delf
-            self.reshape_data_df('samp', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, deltaval=True, unit_t=unit_t, unit_temp=unit_temp, keep_mark=True), # keep only on marks
-            on=on_cols
-        )
-
-        df_samp_ref = self.reshape_data_df('samp_ref', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, unit_t=unit_t, unit_temp=unit_temp)
-
-        if self.ref.shape[0] > 0:
-            df_ref = pd.merge(
-                self.reshape_data_df('ref', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, unit_t=unit_t, unit_temp=unit_temp, keep_mark=False),
-                self.reshape_data_df('ref', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, deltaval=True, unit_t=unit_t, unit_temp=unit_temp, keep_mark=True), # keep only one marks
-                on=on_cols
-            )
-        if self.ref_ref.shape[0] > 0:
-            df_ref_ref = self.reshape_data_df('ref_ref', mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, unit_t=unit_t, unit_temp=unit_temp)
-
          # get ext
         name, ext = os.path.splitext(fileName)
+        ext = ext.lower()
+        if ext not in DataExporter.sheet_writers:
+            logger.warning('File type %s is not supported.', ext)
+            return
+
+        # data sheets of samp and ref channel: (sheet name, chn_name, deltaval)
+        data_sheets = [('S_channel', 'samp', True), ('S_reference', 'samp_ref', False)]
+        if self._stores['ref'].nrows > 0:
+            data_sheets += [('R_channel', 'ref', True), ('R_reference', 'ref_ref', False)]
+        if ext == '.csv': # channels first
+            data_sheets = data_sheets[0::2] + data_sheets[1::2]
+
+        # sheets: (sheet name, key, columns, chunks)
+        sheets = []
+        for sheet_name, chn_name, deltaval in data_sheets:
+            sheets.append((sheet_name, chn_name) + self._export_data_sheet(chn_name, deltaval, mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, unit_t=unit_t, unit_temp=unit_temp, chunk_rows=chunk_rows))
+
+        # property
+        mech_sheets = []
+        if ext not in ['.csv', '.json']: # TODO add prop
+            for chn_name in self._chn_keys:
+                for mech_key in getattr(self, chn_name + '_prop').keys(): 
+                    mech_sheets.append((chn_name[0].upper() + '_' + mech_key, chn_name + '_' + mech_key) + self._export_mech_sheet(chn_name, mech_key, mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn, chunk_rows=chunk_rows))
+
+        # set func = {} in exp_ref which cannot be saved as text
+        exp_ref = self.exp_ref.copy()
+        exp_ref['func'] = {}
+        meta = {
+            'ver': self.ver,
+            'exp_ref': exp_ref,
+            # time reference
+            't_ref': {key: self.exp_ref[key] for key in self.exp_ref.keys() if 't0' in key},
+            # sample description
+            'sample_description': self.settings.get('plainTextEdit_settings_sampledescription', '').split('\n'), # split convert string to list of strings
+        }
 
         # export by ext
         try:
-            if ext.lower() == '.xlsx':
-                with pd.ExcelWriter(fileName) as writer:
-                    df_samp.to_excel(writer, sheet_name='S_channel')
-                    df_samp_ref.to_excel(writer, sheet_name='S_reference')
-                    if self.ref.shape[0] > 0:
-                        df_ref.to_excel(writer, sheet_name='R_channel')
-                        df_ref_ref.to_excel(writer, sheet_name='R_reference')
-                    # time reference
-                    t_ref = {key: self.exp_ref[key] for key in self.exp_ref.keys() if 't0' in key}
-                    pd.DataFrame.from_dict(t_ref, orient='index').to_excel(writer, sheet_name='time_reference', header=False)
-                    # sample description
-                    sample_description = {'sample Description': self.settings.get('plainTextEdit_settings_sampledescription', '').split('\n')} # split convert string to list of strings
-                    pd.DataFrame.from_dict(sample_description, orient='columns').to_excel(writer, sheet_name='sample_description', header=False, index=False)
-
-                    # property
-                    for chn_name in self._chn_keys:
-                        if getattr(self, chn_name + '_prop'): 
-                            for mech_key in getattr(self, chn_name + '_prop').keys(): 
-                                mech_df = self.reshape_mech_df(chn_name, mech_key, mark=mark, dropnanmarkrow=dropnanmarkrow, dropnancolumn=dropnancolumn)
-                                mech_df.to_excel(writer, sheet_name=chn_name[0].upper() + '_' + mech_key)
-
-            elif ext.lower() == '.csv': # TODO add prop
-                # add chn_name to samp and ref df
-                # and append ref to samp
-                with open(fileName, 'w') as f:
-                    csvwriter = csv.writer(f)
-                    csvwriter.writerow(['Version'] + [self.ver] + [''] + ['t0'] + [self.exp_ref['t0']]+ [''] + ['shifted t0'] + [self.exp_ref['t0_shifted']])
-                
-                if self.ref.shape[0] > 0:
-                    df_samp.assign(chn='samp').append(df_ref.assign(chn='ref')).append(df_samp_ref.assign(chn='samp_ref')).append(df_ref_ref.assign(chn='ref_ref')).to_csv(fileName, mode='a')
-                else:
-                    df_samp.assign(chn='samp').append(df_samp_ref.assign(chn='samp_ref')).to_csv(fileName, mode='a')
-
-            elif ext.lower() == '.json': # TODO add prop
-                with open(fileName, 'w') as f:
-                    ## lines with indent (this will make the file larger)
-                    # lines = json.dumps({'samp': self.samp.to_dict(), 'ref': self.ref.to_dict()}, indent=4) + '\n'
-                    # f.write(lines)
-
-                    ## without separate by lines (smaller file size, but harder to)
-                    if self.ref.shape[0] > 0:
-                        json.dump({
-                            'samp': df_samp.to_dict(), 
-                            'samp_ref': df_samp_ref.to_dict(), 
-                            'ref': df_ref.to_dict(),
-                            'ref_ref': df_ref_ref.to_dict(),
-                            'exp_ref': self.exp_ref,
-                            'ver': self.ver,
-                            }, 
-                            f
-                        )
-                    else:
-                        json.dump({
-                            'samp': df_samp.to_dict(), 
-                            'samp_ref': df_samp_ref.to_dict(), 
-                            'exp_ref': self.exp_ref,
-                            'ver': self.ver,
-                            }, 
-                            f
-                        )
-
-                    # json.dump(data, f)
+            with DataExporter.sheet_writers[ext](fileName, meta) as writer:
+                writer.start([columns for _, _, columns, _ in sheets + mech_sheets])
+                for i, (sheet_name, key, columns, chunks) in enumerate(sheets + mech_sheets):
+                    if i == len(sheets):
+                        writer.write_meta()
+                    writer.start_sheet(sheet_name, key, columns)
+                    for df in chunks():
+                        writer.write(df)
+                    writer.end_sheet()
+                if not mech_sheets:
+                    writer.write_meta()
         except PermissionError as err:
             logger.warning('Permission denied.\nCheck if your file is open.')
 
+
+    def _export_data_sheet(self, chn_name, deltaval, mark=False, dropnanmarkrow=False, dropnancolumn=True, unit_t=None, unit_temp='C', chunk_rows=DataExporter.export_chunk_rows):
+        '''
+        sheet of data table chn_name for exporting, the same as reshape_data_df
+        deltaval: if True, delta values are added (f and delf of channel merged)
+        return (columns, chunks). chunks() yields DataFrames of chunk_rows rows
+        '''
+        store = self._stores[chn_name]
+        harms = [str(i * 2 + 1) for i in range(store.n_harm)]
+        marks = store.col('marks')
+        masked = mark and (marks == 1).any() # there are marks (1)
+
+        def mark_vals(arr, pos):
+            # leave values where only marks == 1 (the same as get_list_column_to_columns)
+            if masked:
+                arr = arr * marks[pos]
+                arr[arr == 0] = np.nan
+            return arr
+
+        t = self.get_t_by_unit(chn_name, unit=unit_t).values
+        # (columns, function returns the values (rows x columns) of rows at positions)
+        groups = [
+            (['queue_id'], lambda pos: store.col('queue_id')[pos, None]),
+            (['t'], lambda pos: t[pos, None]),
+            (['temp'], lambda pos: self.temp_C_to_unit(store.col('temp')[pos], unit=unit_temp)[:, None]),
+        ]
+        for col in ['fs', 'gs']:
+            groups.append(([col[:-1] + harm for harm in harms], lambda pos, col=col: mark_vals(store.col(col)[pos], pos)))
+        n_abs = len(groups) # groups of abs values
+        if deltaval:
+            for col in ['fs', 'gs']:
+                groups.append((['del' + col[:-1] + harm for harm in harms], lambda pos, col=col: mark_vals(self._delta_array(chn_name, col, rows=pos), pos)))
+
+        if dropnanmarkrow == True: # keep rows with marks only
+            pos = np.flatnonzero(self.rows_with_marks(chn_name).values)
+        else:
+            pos = np.arange(store.nrows)
+
+        groups_cols = self._export_group_columns(groups, pos, dropnancolumn, chunk_rows)
+        columns = [c for cols in groups_cols[:n_abs] for c in cols]
+        if 'temp' not in columns: # no temperature data
+            columns.append('temp') # add temp column back
+        columns += [c for cols in groups_cols[n_abs:] for c in cols]
+
+        if dropnanmarkrow == False: # split marks column (not dropped by dropnancolumn)
+            groups.append((['mark' + harm for harm in harms], lambda pos: mark_vals(marks[pos], pos)))
+            columns += groups[-1][0]
+
+        # merged sheets are reindexed
+        index = np.arange(len(pos)) if deltaval else store.index[pos]
+        return columns, lambda: self._export_chunks(groups, columns, pos, index, chunk_rows)
+
+
+    def _export_mech_sheet(self, chn_name, mech_key, mark=False, dropnanmarkrow=False, dropnancolumn=True, chunk_rows=DataExporter.export_chunk_rows):
+        '''
+        sheet of mech_df (mech_key in samp_prop and ref_prop) for exporting, the same as reshape_mech_df
+        marks are from the data rows with the same queue_id
+        return (columns, chunks). chunks() yields DataFrames of chunk_rows rows
+        '''
+        mech_df = getattr(self, chn_name + '_prop')[mech_key]
+        store = self._stores[chn_name]
+        harms = [str(i * 2 + 1) for i in range(store.n_harm)]
+
+        # marks of data rows with the same queue_id (nan if not found)
+        mech_queue_id = mech_df['queue_id'].values.astype('int64')
+        marks = np.full((mech_df.shape[0], store.n_harm), np.nan)
+        if store.nrows > 0:
+            queue_id = store.col('queue_id')
+            order = np.argsort(queue_id, kind='stable')
+            i = np.minimum(np.searchsorted(queue_id[order], mech_queue_id), store.nrows - 1)
+            found = queue_id[order][i] == mech_queue_id
+            marks[found] = store.col('marks')[order[i[found]]]
+        with_marks = (store.col('marks') == 1).any() # there are marks (1)
+
+        def harm_vals(col, pos):
+            arr = self._prop_to_arrays(mech_df, pos, cols=[col])[col]
+            vals = np.full((len(pos), store.n_harm), np.nan, dtype=arr.dtype)
+            vals[:, :arr.shape[1]] = arr[:, :store.n_harm]
+            if mark and with_marks: # leave values where only marks == 1
+                vals = vals * marks[pos]
+                vals[vals == 0] = np.nan
+            return vals
+
+        # (columns, function returns the values (rows x columns) of rows at positions)
+        groups = []
+        harm_groups = [] # values vary with harmonic are at the end
+        for col in mech_df.columns:
+            if col == 'queue_id':
+                groups.append(([col], lambda pos: mech_queue_id[pos, None]))
+            elif col.endswith(('s', 's_err')): # value varies with harmonic 
+                harm_groups.append(([col + harm for harm in harms], lambda pos, col=col: harm_vals(col, pos)))
+            else: # single value
+                groups.append(([col], lambda pos, col=col: self._prop_to_arrays(mech_df, pos, cols=[col])[col][:, :1]))
+        groups += harm_groups
+
+        if dropnanmarkrow == True and with_marks: # rows with marks only
+            pos = np.flatnonzero((marks == 1).any(axis=1))
+        else:
+            pos = np.arange(mech_df.shape[0])
+
+        columns = [c for cols in self._export_group_columns(groups, pos, dropnancolumn, chunk_rows) for c in cols]
+        index = mech_df.index.values[pos]
+        return columns, lambda: self._export_chunks(groups, columns, pos, index, chunk_rows)
+
+
+    def _export_group_columns(self, groups, pos, dropnancolumn, chunk_rows):
+        '''
+        columns of each group (columns, func) of exported sheet
+        dropnancolumn: if True, columns with all nan in rows at pos are dropped
+        '''
+        if not dropnancolumn or len(pos) == 0:
+            return [cols for cols, _ in groups]
+        has_data = [np.zeros(len(cols), dtype=bool) for cols, _ in groups]
+        for sl in DataExporter.chunk_slices(len(pos), chunk_rows):
+            for flags, (_, func) in zip(has_data, groups):
+                flags |= ~np.isnan(func(pos[sl])).all(axis=0)
+        return [[c for c, flag in zip(cols, flags) if flag] for flags, (cols, _) in zip(has_data, groups)]
+
+
+    def _export_chunks(self, groups, columns, pos, index, chunk_rows):
+        '''
+        yield DataFrames of columns of rows at pos by chunks of chunk_rows rows
+        index: labels of rows (the same length as pos)
+        '''
+        col_set = set(columns)
+        for sl in DataExporter.chunk_slices(len(pos), chunk_rows):
+            data = {}
+            for cols, func in groups:
+                if col_set.intersection(cols):
+                    vals = func(pos[sl])
+                    data.update({c: vals[:, j] for j, c in enumerate(cols)})
+            yield pd.DataFrame(data, index=index[sl], columns=columns)
+
     
     def reshape_data_df(self, chn_name, mark=False, dropnanmarkrow=True, dropnancolumn=True, deltaval=False, norm=False, unit_t=None, unit_temp=None, keep_mark=True):
         '''
@@ -1393,31 +2758,35 @@ class DataSaver:
     def get_t_s(self, chn_name):
         '''
         get time (t) in sec as pd.series
-        t: pd.series of str
+        time relative to reference (t0) is calculated from t in ns and 
+        cached until the data or t0/t0_shifted is changed
         '''
-        t = getattr(self, chn_name)['t'].copy()
-        # convert t column to datetime object
-        t = pd.to_datetime(t)
-        # convert t to delta t in seconds
-        if t.shape[0] == 0:
+        store = self._stores[chn_name]
+        if store.nrows == 0:
             logger.warning('no data saved!')
-            return t
-        else:
-            logger.info(self.get_t_ref()) 
-            # logger.info(t) 
-            t = t -  self.get_t_ref() # delta t to reference (t0)
-            t = t.dt.total_seconds() # convert to second
-            return t
+            return pd.Series([], dtype='float64', name='t')
+
+        t0 = self.get_t_ref()
+        logger.info(t0) 
+        key = (store.col_version('index', 't'), t0)
+        cached = self._t_s_cache.get(chn_name)
+        if cached is None or cached[0] != key:
+            t_ns = store.col('t')
+            # delta t to reference (t0) in seconds
+            t0_ns = pd.Timestamp(t0).value if t0 is not None else t_ns[0] # no t0, use the first queue
+            t = (t_ns - t0_ns) / 1e9
+            t[t_ns == nat_int] = np.nan
+            cached = (key, pd.Series(t, index=store.index.copy(), name='t'))
+            self._t_s_cache[chn_name] = cached
+        return cached[1].copy()
 
 
     def get_t_str_from_raw(self, chn_name, queue_id):
         '''
         get t from raw as str
         '''
-        with h5py.File(self.path, 'r') as fh:
-            # creat group for test
-            g_queue = fh['raw/' + chn_name + '/' + str(queue_id)]
-            t_str = g_queue.attrs['t']
+        with self._read_session() as fh:
+            t_str, _ = self._raw_t_temp(fh, chn_name, queue_id)
             logger.info('t_str %s', t_str)
             return t_str
         
@@ -1426,15 +2795,9 @@ class DataSaver:
         '''
         get t from raw as str
         '''
-        with h5py.File(self.path, 'r') as fh:
-            # creat group for test
-            g_queue = fh['raw/' + chn_name + '/' + str(queue_id)]
-            # add t, temp to attrs
-            # store t as string
-            if 'temp' in g_queue.attrs: # there is temp data
-                return g_queue.attrs['temp']
-            else: # no temp data
-                return np.nan
+        with self._read_session() as fh:
+            _, temp = self._raw_t_temp(fh, chn_name, queue_id)
+            return temp
 
 
     def get_queue_id_marked_rows(self, chn_name, dropnanmarkrow=False):
@@ -1451,7 +2814,7 @@ class DataSaver:
         '''
         get queue indices as pd.series
         '''
-        return getattr(self, chn_name)['queue_id'].copy()
+        return self._store_series(chn_name, 'queue_id')
 
 
     def get_mech_queue_id(self, chn_name, nhcalc):
@@ -1486,8 +2849,7 @@ class DataSaver:
         '''
         get indices as pd.series
         '''
-        idx = getattr(self, chn_name).index
-        return pd.Series(idx)
+        return pd.Series(self._stores[chn_name].index.copy())
 
 
     def get_temp_by_uint_marked_rows(self, chn_name, dropnanmarkrow=False, unit='C'):
@@ -1512,7 +2874,15 @@ class DataSaver:
         get temperature (temp) in sec as pd.series
         t: pd.series of str
         '''
-        return getattr(self, chn_name)['temp'].copy()
+        return self._store_series(chn_name, 'temp')
+
+
+    def _store_series(self, chn_name, col):
+        '''
+        return a copy of single value column (queue_id, t, temp) of chn_name as pd.series
+        '''
+        store = self._stores[chn_name]
+        return pd.Series(store.col(col).copy(), index=store.index.copy(), name=col)
 
 
     def get_t_ref(self):
@@ -1530,8 +2900,8 @@ class DataSaver:
             t0 = self.settings.get('t0', self.settings.get('dateTimeEdit_reftime', None))
             logger.info('t0 %s', t0) 
             if not t0:
-                if self.samp.shape[0]> 0: # use the first queque time
-                    t0 = datetime.datetime.strptime(self.samp['t'][0], self.settings['time_str_format'])
+                if self._stores['samp'].nrows > 0: # use the first queque time
+                    t0 = pd.Timestamp(self._stores['samp'].col('t')[0]).to_pydatetime()
                 else:
                     t0 = None
             else:
@@ -1584,38 +2954,27 @@ class DataSaver:
         return: df with columns = ['x1', 'x3', 'x5', 'x7', 'x9]
         '''
 
+        store = self._stores[chn_name]
         if deltaval == True:
             s = self.convert_col_to_delta_val(chn_name, col, norm=norm)
             # logger.info(s) 
+            arr_s = ChannelStore.lists_to_array(s.values, store.n_harm)
             col = 'del' + col # change column names to 'delfs' or 'delgs' 
             if norm:
                 col = col[:-1] + 'n' + col[-1:] # change columns to 'delfns' or 'delgns'
         else:
-            s = getattr(self, chn_name)[col].copy()
+            arr_s = store.col(col).copy()
 
-
-        if mark == False:
-            return pd.DataFrame(s.values.tolist(), s.index).rename(columns=lambda x: col[:-1] + str(x * 2 + 1))
-        else:
-            m = getattr(self, chn_name)['marks'].copy()
-            # logger.info('mmmmm', m) 
-            idx = s.index
-            # convert s and m to ndarray
-            arr_s = np.array(s.values.tolist(), dtype=np.float) # the dtype=np.float replace None with np.nan
-            # logger.info(arr_s) 
-            arr_m = np.array(m.values.tolist(), dtype=np.float) # the dtype=np.float replace None with np.nan
-            # logger.info(arr_m) 
+        if mark == True:
+            arr_m = store.col('marks')
             # logger.info(np.any(arr_m == 1)) 
             if np.any(arr_m == 1): # there are marks (1)
                 logger.info('there are marks (1) in df') 
-                # replace None with np.nan
                 arr_s = arr_s * arr_m # leave values where only marks == 1
                 # replace unmarked (marks == 0) with np.nan
                 arr_s[arr_s == 0] = np.nan
 
-                return pd.DataFrame(data=arr_s, index=idx).rename(columns=lambda x: col[:-1] + str(x * 2 + 1))
-            else: # there is no marks(1)
-                return pd.DataFrame(s.values.tolist(), s.index).rename(columns=lambda x: col[:-1] + str(x * 2 + 1))
+        return pd.DataFrame(data=arr_s, index=store.index.copy()).rename(columns=lambda x: col[:-1] + str(x * 2 + 1))
             
 
     def get_mech_column_to_columns_marked_rows(self, chn_name, mech_key, col, mark=False, dropnanmarkrow=False):
@@ -1688,13 +3047,27 @@ class DataSaver:
         and return the series 
         norm: if True, nomalize value by harmonic
         '''
-        # check if the reference is set
-        if not self.refflg[chn_name]:
+        col_arr = self._delta_array(chn_name, col, norm=norm)
+        if col_arr is None:
+            return None
+        store = self._stores[chn_name]
+        return pd.Series(col_arr.tolist(), index=store.index.copy(), name=col)
+
+
+    def _delta_array(self, chn_name, col, norm=False, rows=slice(None)):
+        '''
+        return delta value (col - reference) of fs or gs column as array (rows x harmonics)
+        norm: if True, nomalize value by harmonic
+        rows: positions of rows (all rows by default)
+        None if the mode is not supported
+        '''
+        # check if the reference is set and the data/settings it is calculated from are not changed
+        if not self.refflg[chn_name] and self._ref_src_key.get(chn_name) != self._ref_source_key(chn_name):
             # logger.info(self.exp_ref[chn_name + '_ref']) 
             self.set_ref_set(chn_name, *self.exp_ref[chn_name + '_ref'])
+            self._ref_src_key[chn_name] = self._ref_source_key(chn_name)
 
-        # get a copy
-        col_s = getattr(self, chn_name)[col].copy()
+        store = self._stores[chn_name]
         # logger.info(self.exp_ref[chn_name]) 
 
         mode = self.exp_ref.get('mode')
@@ -1702,23 +3075,14 @@ class DataSaver:
         if mode['cryst'] == 'single': # single crystal
             logger.info('single') 
 
-            ref_s = self.interp_film_ref(chn_name, col=col) # get reference for col (fs or gs)
-
-            # logger.info('ref_s\n%s', ref_s) 
-            
-            # convert series value to ndarray
-            col_arr = np.array(col_s.values.tolist())
-            ref_arr = np.array(ref_s.values.tolist())
+            ref_arr = self._ref_arrays(chn_name)[col] # get reference for col (fs or gs)
 
             # subtract ref from col elemental wise
-            col_arr = col_arr - ref_arr
-
-            # save it back to col_s
-            col_s.values[:] = col_arr.tolist()
+            col_arr = store.col(col)[rows] - ref_arr[rows]
             
             if norm: # normalize the data by harmonics
-                col_s = self._norm_by_harm(col_s)
-            return col_s
+                col_arr = col_arr / np.arange(1, store.n_harm*2+1, 2)
+            return col_arr
 
             # if mode['temp'] == 'const': # single crystal and constant temperature
 
@@ -1910,7 +3274,7 @@ class DataSaver:
         mode = self.exp_ref.get('mode')
         logger.info('chn_name:  %s', chn_name)
 
-        if getattr(self, chn_name).empty: # no data
+        if self._stores[chn_name].nrows == 0: # no data
             logger.info('%s has no data', chn_name)
             return
 
@@ -2044,7 +3408,7 @@ class DataSaver:
 
                         # calc freq
                         if np.isnan(fharmind).all(): # no data in harm and ind_list
-                            pass # already initiated
+                            func_f_list.append(lambda temp: np.full(len(temp), np.nan)) # keep the position of harm
                         else: # there is data
                             logger.info('tempind %s', tempind) 
                             logger.info('fharmind %s', fharmind) 
@@ -2052,7 +3416,7 @@ class DataSaver:
                         
                         # calc gamma
                         if np.isnan(gharmind).all(): # no data in harm and ind_list
-                            pass # already initiated
+                            func_g_list.append(lambda temp: np.full(len(temp), np.nan)) # keep the position of harm
                         else: # there is data
                             func_g_list.append(interp1d(tempind, gharmind, kind=self.exp_ref['mode']['fit'], fill_value=np.nan, bounds_error=False))
 
@@ -2113,82 +3477,67 @@ class DataSaver:
         set all rows with the same value from self.exp_ref[chn_name]['f0'] and ['g0']
         returned df have the same size of chn_name df
         '''
-        # check if the reference is set
-        # if not self.refflg[chn_name]:
-        #     # logger.info(self.exp_ref[chn_name + '_ref']) 
-        #     self.set_ref_set(chn_name, *self.exp_ref[chn_name + '_ref'])
+        store = self._stores[chn_name]
+        ref_arrs = self._ref_arrays(chn_name)
 
-        # samp_source = self.exp_ref['samp_ref'][0]
-        chn_temp = self.get_temp_by_uint_marked_rows(chn_name, dropnanmarkrow=False, unit='C') # in C. If marked only, set dropnanmarkrow=True
-        # logger.info(chn_temp) 
-        
         # prepare series fro return
-        cols = getattr(self, chn_name)[['fs', 'gs', 'ps']].copy()
+        cols = pd.DataFrame(index=store.index.copy())
+        cols['fs'] = ref_arrs['fs'].tolist()
+        cols['gs'] = ref_arrs['gs'].tolist()
+        cols['ps'] = np.full((store.nrows, store.n_harm), np.nan).tolist()
 
-        # set all fs, gs to [np.nan, np.nan, ...]
-        cols['fs'] = cols['fs'].apply(lambda x: self.nan_harm_list())
-        cols['gs'] = cols['gs'].apply(lambda x: self.nan_harm_list())
-        cols['ps'] = cols['ps'].apply(lambda x: self.nan_harm_list())
+        if col is None:
+            return cols
+        elif self.exp_ref['mode']['temp'] == 'var' and col not in self._ref_keys: # col is not fs or gs
+            return cols
+        else:
+            return cols[col]
+
+
+    def _ref_source_key(self, chn_name):
+        '''
+        key of the data and settings the reference funcions of chn_name are calculated from
+        (by self.set_ref_set)
+        '''
+        source = self.exp_ref[chn_name + '_ref'][0]
+        return (
+            repr(self.exp_ref[chn_name + '_ref']),
+            repr(self.exp_ref.get('mode')),
+            self._stores[chn_name].nrows > 0,
+            self._stores[source].col_version('index', 'temp', 'fs', 'gs') if source in self._stores else None,
+        )
 
-        mode = self.exp_ref.get('mode')
-        if mode['cryst'] == 'single':
-            if mode['temp'] == 'const': # single crystal and constant temperature
-                '''
-                # set all value the same
-                # set all fs, gs to self.exp_ref[chn_name]['f0'] and ['g0']
-                cols['fs'] = cols['fs'].apply(lambda x: self.exp_ref[chn_name]['f0'])
-                cols['gs'] = cols['gs'].apply(lambda x: self.exp_ref[chn_name]['g0'])
-                '''
-                
-                # check if all elements in self.exp_ref.samp_ref[1] is list
-                chn_idx = self.get_chn_idx_in_exp_ref(chn_name)
-                if all([isinstance(l, list) for l in chn_idx]): # all list
-                    film_idx = chn_idx
-                elif all([isinstance(l, int) for l in chn_idx]): # all int
-                    film_idx = [chn_idx] # put into a list
-                else:
-                    logger.warning('Check sample reference index!')
-                    film_idx = []
-                
-                # get interpolated f and g by chn_temp
-                for seg, ind_list in enumerate(film_idx): # iterate each list
-                    logger.info(self.exp_ref['func']) 
-                    chn_func = self.exp_ref['func'][chn_name]
-                    logger.info('len(ind_list) %s', len(ind_list)) 
-                    logger.info('len(fun) %s', len(chn_func)) 
-                    # get interpolated f, g of temp in ind_list (tempind) 
-                    # len(ind_list) can be longer than len(chn_func) 
-                    # use modulus 
-                    f_list, g_list = chn_func[seg % len(chn_func)](ind_list) # dummy values with the same size of data
-                    # logger.info('f_list %s', f_list)
-                    # transpose 
-                    fs_list = np.transpose(np.array(f_list)).tolist()
-                    logger.info('len(fs_list) %s', len(fs_list)) 
-
-                    gs_list = np.transpose(np.array(g_list)).tolist()
-
-                    # save to df
-                    # logger.info('cols.fs[ind_list] %s', cols.fs[ind_list])
-                    # logger.info('fs_list %s', fs_list)
-                    cols.fs[ind_list] = fs_list
-                    cols.gs[ind_list] = gs_list
-
-                # logger.info('cols[ind_list]\n%s', cols.iloc[ind_list]) 
-                logger.info(cols[col].head())
-
-            elif mode['temp'] == 'var': # single crystal and variable temperature
-                if np.isnan(chn_temp).all(): # no temp data
-                    logger.warning('no temperature data in film!')
-                    if col is None:
-                        return cols
-                    else:
-                        return cols[col]
 
-                if col not in self._ref_keys: # col is not fs or gs
-                    return cols
+    def _ref_arrays(self, chn_name):
+        '''
+        return reference of chn_name as arrays (rows x harmonics) in dict {'fs': f0, 'gs': g0}
+        by uing the interpolation funcions in self.exp_ref['func']
+        The arrays are cached until the funcions, mode, indices of chn_name in self.exp_ref
+        or the temp/rows of chn_name are changed.
+        The cached arrays are returned. Don't change them.
+        '''
+        store = self._stores[chn_name]
+        chn_ref = self.exp_ref[chn_name + '_ref']
+        key = (
+            self.exp_ref['func'].get(chn_name), # list of funcs
+            repr(self.exp_ref.get('mode')),
+            repr(chn_ref[2]) if len(chn_ref) > 2 else None,
+            store.col_version('index', 'temp'),
+        )
+        cached = self._ref_cache.get(chn_name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
 
-                # calculate ref for each film (samp) temp and save to self.samp_ref
+        ref_arrs = {col: np.full((store.nrows, store.n_harm), np.nan) for col in self._ref_keys}
 
+        mode = self.exp_ref.get('mode')
+        if mode['cryst'] == 'single' and mode['temp'] in ['const', 'var']:
+            # samp_source = self.exp_ref['samp_ref'][0]
+            chn_temp = store.col('temp') # in C
+
+            if mode['temp'] == 'var' and np.isnan(chn_temp).all(): # no temp data
+                logger.warning('no temperature data in film!')
+            else:
                 # check if all elements in self.exp_ref.samp_ref[1] is list
                 chn_idx = self.get_chn_idx_in_exp_ref(chn_name)
                 if all([isinstance(l, list) for l in chn_idx]): # all list
@@ -2198,42 +3547,37 @@ class DataSaver:
                 else:
                     logger.warning('Check sample reference index!')
                     film_idx = []
-                
+
+                # positions of rows by index
+                row_index = pd.Index(store.index)
+                chn_func = self.exp_ref['func'][chn_name]
+
                 # get interpolated f and g by chn_temp
                 for seg, ind_list in enumerate(film_idx): # iterate each list
-                    tempind = chn_temp[ind_list]
-                    logger.info(self.exp_ref['func']) 
-                    chn_func = self.exp_ref['func'][chn_name]
+                    pos = row_index.get_indexer(ind_list)
+                    if (pos < 0).any():
+                        logger.warning('index %s not in %s', np.array(ind_list)[pos < 0], chn_name)
+                        pos = pos[pos >= 0]
+                    if pos.size == 0:
+                        continue
                     logger.info('len(ind_list) %s', len(ind_list)) 
                     logger.info('len(fun) %s', len(chn_func)) 
                     # get interpolated f, g of temp in ind_list (tempind) 
                     # len(ind_list) can be longer than len(chn_func) 
                     # use modulus 
-                    f_list, g_list = chn_func[seg % len(chn_func)](tempind)
-                    # transpose 
-                    fs_list = np.transpose(np.array(f_list)).tolist()
-                    logger.info('len(fs_list) %s', len(fs_list)) 
+                    if mode['temp'] == 'const':
+                        x = store.index[pos] # dummy values with the same size of data
+                    else:
+                        x = chn_temp[pos] # tempind
+                    f_list, g_list = chn_func[seg % len(chn_func)](x)
 
-                    gs_list = np.transpose(np.array(g_list)).tolist()
+                    # save to arrays (rows x harmonics) 
+                    for col, vals in zip(['fs', 'gs'], [f_list, g_list]):
+                        arr = np.array(vals, dtype=float).reshape(-1, pos.size).T # transpose
+                        ref_arrs[col][pos, :arr.shape[1]] = arr[:, :store.n_harm]
 
-                    # save to df
-                    cols.fs[ind_list] = fs_list
-                    cols.gs[ind_list] = gs_list
-
-                logger.info('cols[ind_list]\n%s', cols.iloc[ind_list]) 
-                logger.info(cols[col].head())
-        elif mode['cryst'] == 'dual': #TODO
-            if mode['temp'] == 'const': # dual crystal and constant temperature
-                pass
-            elif mode['temp'] == 'var': # dual crystal and constant temperature
-                pass
-            else:
-                pass
- 
-        if col is None:
-            return cols
-        else:
-            return cols[col]
+        self._ref_cache[chn_name] = (key, ref_arrs)
+        return ref_arrs
 
 
     def set_t0(self, t0=None, t0_shifted=None):
@@ -2294,11 +3638,9 @@ class DataSaver:
         '''
         return a series with the same rows as self.<chn_name> df
         '''
-        # get f0
-        f0s = self.interp_film_ref(chn_name, col='fs')
-        # get the 1st harmonic
-        f0s = f0s.apply(lambda x: x[0])
-        return f0s
+        # get the 1st harmonic of f0
+        store = self._stores[chn_name]
+        return pd.Series(self._ref_arrays(chn_name)['fs'][:, 0], index=store.index.copy())
 
 
     def get_marks(self, chn_name, tocolumns=False):
@@ -2346,7 +3688,8 @@ class DataSaver:
         return a series of booleans of rows with marked (1) harmonics
         if no marked rows, return all
         '''
-        marked_rows = getattr(self, chn_name).marks.apply(lambda x: True if 1 in x else False)
+        store = self._stores[chn_name]
+        marked_rows = pd.Series((store.col('marks') == 1).any(axis=1), index=store.index.copy())
         if marked_rows.any(): # there are marked rows
             logger.info('There are marked rows')
             return marked_rows
@@ -2359,8 +3702,7 @@ class DataSaver:
         '''
         return if there are marks in data (True/False)
         '''
-        marked_rows = getattr(self, chn_name).marks.apply(lambda x: True if 1 in x else False)
-        if marked_rows.any(): # there are marked rows
+        if (self._stores[chn_name].col('marks') == 1).any(): # there are marked rows
             return True
         else: # no amrked rows
             return False
@@ -2371,7 +3713,8 @@ class DataSaver:
         return list of booleans of rows with nan in all harmonics of marks
         This function can be used as ~self.rows_all_nan_marks() to return the rows with data
         '''
-        return getattr(self, chn_name).marks.apply(lambda x: True if np.isnan(np.array(x)).all() else False)
+        store = self._stores[chn_name]
+        return pd.Series(np.isnan(store.col('marks')).all(axis=1), index=store.index.copy())
 
 
     def reset_match_marks(self, df, mark_pair=(0, 1)):
@@ -2382,10 +3725,11 @@ class DataSaver:
         new_mark, old_mark = mark_pair
         df_new = df.copy()
         logger.info(type(df_new)) 
-        logger.info(df_new.tail()) 
         # logger.info(df_new.fs) 
         # logger.info(df_new.marks) 
-        df_new.marks = df_new.marks.apply(lambda x: [new_mark if mark == old_mark else mark for mark in x])
+        marks = ChannelStore.lists_to_array(df_new['marks'].values, self.n_harm())
+        marks[marks == old_mark] = new_mark
+        df_new['marks'] = marks.tolist()
         return df_new
 
 
@@ -2397,32 +3741,52 @@ class DataSaver:
         harm: str of a single harmonic to mark
         mark_val: int 
         return: new df
+        marks of harmonics without data (nan) are not changed
         '''
         df_new = df.copy()
-        def mark_func(row_marks):
-            # logger.info(row_marks) 
-            new_marks = []
-            for i, mark in enumerate(row_marks):
-                if str(i*2+1) == harm and mark != np.nan and mark is not None:
-                    new_marks.append(mark_val)
-                else:
-                    new_marks.append(mark)
-                return new_marks
-
-        # logger.info(df_new.marks) 
-        # df_new.marks.loc[idx].apply(mark_func)
-        df_new.marks.loc[idx] = df_new.marks.loc[idx].apply(lambda x: [mark_val if (str(i*2+1) == harm) and (mark != np.nan) and (mark is not None) else mark for i, mark in enumerate(x)])
-        logger.info(df_new.marks) 
+        marks = ChannelStore.lists_to_array(df_new['marks'].values, self.n_harm())
+        pos = df_new.index.get_indexer(np.asarray(idx, dtype='int64'))
+        self._set_marks(marks, pos[pos >= 0], self._harm_col(harm), mark_val)
+        df_new['marks'] = marks.tolist()
 
         return df_new
 
 
+    def _harm_col(self, harm):
+        '''
+        column of harm (str) in the arrays of harmonics (rows x harmonics)
+        '''
+        return int((int(harm) - 1) / 2)
+
+
+    def _set_marks(self, marks, pos, col, mark_val):
+        '''
+        set marks (array of rows x harmonics) at rows pos and column col (int or slice) to mark_val in place
+        marks of harmonics without data (nan) are not changed
+        '''
+        sel = marks[pos, col]
+        marks[pos, col] = np.where(np.isnan(sel), np.nan, mark_val)
+
+
+    def _index_positions(self, store, idx):
+        '''
+        positions of rows with labels idx (index of df) in store
+        labels not in store are ignored
+        return sorted ndarray of int
+        '''
+        pos = pd.Index(store.index).get_indexer(np.asarray(idx, dtype='int64'))
+        return np.sort(pos[pos >= 0])
+
+
     def mark_all_to(self, df, mark_val=1):
         ''' 
         mark all to given mark_val e.g.: 0, 1
+        marks of harmonics without data (nan) are not changed
         '''
         df_new = df.copy()
-        df_new.marks = df_new.marks.apply(lambda x: [mark_val if mark != np.nan and mark is not None else mark for mark in x])
+        marks = ChannelStore.lists_to_array(df_new['marks'].values, self.n_harm())
+        self._set_marks(marks, slice(None), slice(None), mark_val)
+        df_new['marks'] = marks.tolist()
         # logger.info(df_new.marks) 
         return df_new
 
@@ -2447,7 +3811,11 @@ class DataSaver:
         selector function
         mark all data in chn_name to mark_val
         '''
-        setattr(self, chn_name, self.mark_all_to(getattr(self, chn_name), mark_val=mark_val))
+        store = self._stores[chn_name]
+        self._set_marks(store.col('marks'), slice(None), slice(None), mark_val)
+        store.changed(['marks'])
+        self._mark_dirty_rows(chn_name, slice(None))
+        self.saveflg = False
 
 
     def selector_mark_sel(self, chn_name, sel_idx_dict, mark_val):
@@ -2458,11 +3826,17 @@ class DataSaver:
             'harm': [index]
         }
         '''
-        df_chn = getattr(self, chn_name)
+        store = self._stores[chn_name]
+        marks = store.col('marks')
+        pos_un = [] # positions of changed rows
         for harm, idx in sel_idx_dict.items():
-            df_chn = self.mark_data(df_chn, idx=idx, harm=harm, mark_val=mark_val)
-            # logger.info(df_chn.marks) 
-        setattr(self, chn_name, df_chn)
+            pos = self._index_positions(store, idx)
+            self._set_marks(marks, pos, self._harm_col(harm), mark_val)
+            pos_un.append(pos)
+        store.changed(['marks'])
+        if pos_un:
+            self._mark_dirty_rows(chn_name, np.concatenate(pos_un))
+        self.saveflg = False
 
 
     def selector_del_sel(self, chn_name, sel_idx_dict):
@@ -2474,36 +3848,38 @@ class DataSaver:
         }
         This function changes the date (fs, gs) to [nan, ...], marks to nan, and delete the raw data
         '''
-        df_chn = getattr(self, chn_name).copy()
+        store = self._stores[chn_name]
+        marks, fs, gs = store.col('marks'), store.col('fs'), store.col('gs')
 
+        del_queue_ids = {} # {harm: queue_ids} of raw data to delete
         for harm, idx in sel_idx_dict.items():
-            # set marks to -1
-            df_chn = self.mark_data(df_chn, idx=idx, harm=harm, mark_val=np.nan) # set the marks to nan
-            # set fs, gs to nan
-            df_chn.fs[idx] = df_chn.fs[idx].apply(lambda x: [np.nan if str(i*2+1) in harm else val for i, val in enumerate(x)]) # set all to nan. May not necessary
-            df_chn.gs[idx] = df_chn.gs[idx].apply(lambda x: [np.nan if str(i*2+1) in harm else val for i, val in enumerate(x)]) # set all to nan. May not necessary
+            pos = self._index_positions(store, idx)
+            if len(pos) < len(idx):
+                logger.warning('%s indices do not exist (%s, %s)', len(idx) - len(pos), chn_name, harm)
+            col = self._harm_col(harm)
+            # set marks, fs, gs to nan
+            marks[pos, col] = np.nan
+            fs[pos, col] = np.nan
+            gs[pos, col] = np.nan
+            del_queue_ids[harm] = store.col('queue_id')[pos].copy()
         
-        # delete rows marks are all nan
-        df_chn = df_chn[~self.rows_all_nan_marks(chn_name)]
-        # rest index df
-        df_chn = df_chn.reset_index(drop=True)
+        # delete rows marks are all nan and rest index
+        store = store.take(np.flatnonzero(~np.isnan(marks).all(axis=1)))
+        store.reset_index()
         # save back to class
-        setattr(self, chn_name, df_chn)
+        self._stores[chn_name] = store
+        self._rewrite.add(chn_name)
+        self.saveflg = False
 
-        with h5py.File(self.path, 'a') as fh:
-            for harm, idxs in sel_idx_dict.items():
+        with self._open_write() as fh:
+            for harm, queue_ids in del_queue_ids.items():
                 # delete from raw
-                for ind in idxs: 
-                    if ind in df_chn.queue_id.index: # index in queue_id
-                        if self._raw_exists(fh, chn_name, int(df_chn.queue_id[ind]), harm): # raw data exist
-                            logger.info(df_chn.queue_id[ind]) 
-                            logger.info(fh['raw/' + chn_name + '/' + str(int(df_chn.queue_id[ind])) + '/' + harm]) 
-                            del fh['raw/' + chn_name + '/' + str(int(df_chn.queue_id[ind])) + '/' + harm]
-                            logger.warning('raw data deleted (%s, %s, %s)', chn_name, df_chn.queue_id[ind], harm)
-                        else:
-                            logger.warning('raw data does not exist (%s, %s, %s)', chn_name, df_chn.queue_id[ind], harm)
+                for queue_id in queue_ids.tolist(): 
+                    if self._raw_exists(fh, chn_name, queue_id, harm): # raw data exist
+                        self._del_raw(fh, chn_name, queue_id, harm)
+                        logger.info('raw data deleted (%s, %s, %s)', chn_name, queue_id, harm)
                     else:
-                        logger.warning('index %s does not exist (%s, %s)', ind, chn_name, harm)
+                        logger.warning('raw data does not exist (%s, %s, %s)', chn_name, queue_id, harm)
 
 
 
@@ -2563,61 +3939,41 @@ class DataSaver:
     def df_qcm(self, chn_name):
         '''
         convert delfs and delgs in df to delfstar for calculation and 
-        return a df with ['queue_id', 'marks', 'fstars', 'fs', 'gs', 'delfstars', 'delfs', 'delgs', 'f0stars', 'f0s', 'g0s']
-        '''
-        df = self.get_queue_id(chn_name).astype('int64').to_frame()
-        df['t'] = self.get_t_marked_rows(chn_name, dropnanmarkrow=False, unit=None)
-        df['temp'] = self.get_temp_by_uint_marked_rows( chn_name, dropnanmarkrow=False, unit=
-        'C')
-        df['marks'] = self.get_marks(chn_name)
-
-        # get freqs and gamms in form of [n1, n3, n5, ...]
-        fs = self.get_cols(chn_name, cols=['fs']).squeeze(axis=1) # convert to series
-        gs = self.get_cols(chn_name, cols=['gs']).squeeze(axis=1) # convert to series
-        ps = self.get_cols(chn_name, cols=['ps']).squeeze(axis=1) # convert to series
-        # another way is to get the series directly as follow
-        # fs = getattr(self, chn_name)['fs'].copy()
-        # gs = getattr(self, chn_name)['gs'].copy()
-
-        # get delf and delg in form of [n1, n3, n5, ...]
-        delfs = self.convert_col_to_delta_val(chn_name, 'fs', norm=False)
-        delgs = self.convert_col_to_delta_val(chn_name, 'gs', norm=False)
+        return a df with ['queue_id', 't', 'temp', 'marks', 'fstars', 'delfstars', 'f0stars', 'fs', 'gs', 'ps', 'delfs', 'delgs', 'f0s', 'g0s']
+        use self.qcm_frame to get the data in arrays
+        '''
+        return self.qcm_frame(chn_name).to_dataframe()
+
+
+    def qcm_frame(self, chn_name):
+        '''
+        return the data of chn_name for calculation as QCMFrame
+        fstars, delfstars and f0stars in complex arrays (rows x harmonics)
+        t in s and temp in C
+        '''
+        store = self._stores[chn_name]
+        nan_arr = np.full((store.nrows, store.n_harm), np.nan)
+
+        # get delf and delg in form of [n1, n3, n5, ...] as array
+        delf_arr = self._delta_array(chn_name, 'fs', norm=False)
+        delg_arr = self._delta_array(chn_name, 'gs', norm=False)
         # get reference value as array
-        f0s = self.interp_film_ref(chn_name, col='fs')
-        g0s = self.interp_film_ref(chn_name, col='gs')
-
-        # convert to array
-        f_arr = np.array(fs.values.tolist())
-        g_arr = np.array(gs.values.tolist())
-
-        delf_arr = np.array(delfs.values.tolist())
-        delg_arr = np.array(delgs.values.tolist())
-
-        f0_arr = np.array(f0s.values.tolist())
-        g0_arr = np.array(g0s.values.tolist())
-
-        # get delfstar as array
-        fstar_arr = f_arr + 1j * g_arr
-        delfstar_arr = delf_arr + 1j * delg_arr
-        f0star_arr = f0_arr + 1j * g0_arr
-
-        df['fstars'] = fstar_arr.tolist()
-        df['delfstars'] = delfstar_arr.tolist()
-        df['f0stars'] = f0star_arr.tolist()
-        df['fs'] = fs
-        df['gs'] = gs
-        df['ps'] = ps
-        df['delfs'] = delfs
-        df['delgs'] = delgs
-        df['f0s'] = f0s
-        df['g0s'] = g0s
-
-        logger.info(f_arr.shape)
-        logger.info(g_arr.shape)
-        logger.info(fstar_arr.shape)
-        logger.info(df['fstars'].iloc[0])
+        ref_arrs = self._ref_arrays(chn_name)
+
+        frame = QCMFrame.QCMFrame(
+            store.index.copy(),
+            store.col('queue_id').copy(),
+            self.get_t_s(chn_name).values, # in s
+            store.col('temp').copy(), # in C
+            store.col('marks').copy(),
+            store.col('fs') + 1j * store.col('gs'), # fstars
+            (delf_arr if delf_arr is not None else nan_arr) + 1j * (delg_arr if delg_arr is not None else nan_arr), # delfstars
+            ref_arrs['fs'] + 1j * ref_arrs['gs'], # f0stars
+            ps=store.col('ps').copy(),
+        )
+        logger.info(frame.fstars.shape)
 
-        return df
+        return frame
 
 
     def shape_qcmdf_b_to_a(self, df_a, df_b, idx_a, idx_b):
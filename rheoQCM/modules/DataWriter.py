@@ -0,0 +1,123 @@
+'''
+background writer of the h5 file of DataSaver
+Writing jobs (functions of the file handle: job(fh)) are put in a bounded queue
+and run by a dedicated thread, which owns the handle for writing.
+The jobs queued while the thread is writing are run in the same opening of the
+file, so several scans are written by one flush.
+put() waits when the queue is full (back-pressure). Data are never dropped.
+flush() waits until all queued jobs are written. close() also stops the thread.
+Errors raised in the thread are raised by the next put(), flush() or close().
+'''
+
+import queue
+import threading
+import h5py
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# max number of jobs waiting in the queue
+queue_size = 16
+
+
+class DataWriter:
+    def __init__(self, open_file, maxsize=queue_size):
+        '''
+        open_file: function returns the file handle for writing. open_file() -> h5py.File
+                   it is called from the writer thread for each batch of jobs
+        maxsize: max number of jobs waiting in the queue
+        '''
+        self._open_file = open_file
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None # first error raised in the thread
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='DataWriter', daemon=True)
+        self._thread.start()
+
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+    def put(self, job):
+        '''
+        add job (function: job(fh)) to the queue
+        block until there is room in the queue
+        '''
+        self._raise_error()
+        if self._closed:
+            raise RuntimeError('DataWriter is closed')
+        self._queue.put(job)
+
+
+    def flush(self):
+        '''
+        wait until all jobs in the queue are written to the file
+        '''
+        self._queue.join()
+        self._raise_error()
+
+
+    def close(self):
+        '''
+        write all jobs in the queue and stop the thread
+        '''
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None) # stop signal
+            self._thread.join()
+        self._raise_error()
+
+
+    def _raise_error(self):
+        '''
+        raise the error from the thread (only once)
+        '''
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+    def _run(self):
+        '''
+        loop of the writer thread
+        '''
+        while True:
+            jobs = [self._queue.get()]
+            # batch the jobs waiting in the queue
+            while True:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                if any(job is not None for job in jobs):
+                    with self._open_file() as fh:
+                        for job in jobs:
+                            if job is not None:
+                                self._run_job(job, fh) # the following jobs are run if it fails
+                    logger.info('%s jobs written', len(jobs))
+            except Exception as e: # failed to open the file
+                self._set_error(e)
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+            if None in jobs: # stopped
+                return
+
+
+    def _run_job(self, job, fh):
+        try:
+            job(fh)
+        except Exception as e:
+            self._set_error(e)
+
+
+    def _set_error(self, e):
+        logger.exception('failed to write file')
+        if self._error is None:
+            self._error = e
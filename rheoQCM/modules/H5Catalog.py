@@ -0,0 +1,369 @@
+'''
+catalog (index) of rheoQCM h5 files in SQLite
+Only the cheap metadata of each file is read (without DataSaver.load_file):
+version, t0 of exp_ref, sample description and settings, number of queues and
+harmonics with raw data of each channel and mech_keys of prop.
+The catalog is refreshed incrementally: only the files added or changed (mtime, size)
+since the last scan are read, in parallel processes, and the files removed are dropped.
+
+tables:
+    files     (path, folder, mtime_ns, size, ver, data_format_ver, t0, t0_shifted,
+               sample_description, settings (json), error)
+    channels  (path, chn, n_queue, raw_layout)  chn: samp, ref, samp_ref, ref_ref
+    harmonics (path, chn, harm)                 harmonics with raw data
+    mech_keys (path, chn, mech_key)
+
+e.g. files of samp with harmonic 7, more than 1000 points and PMMA in sample description:
+    with H5Catalog.H5Catalog('catalog.sqlite') as catalog:
+        catalog.refresh(['data_folder'], subfolder=True)
+        paths = catalog.find(harms=[7], min_queues=1001, sample_description='PMMA')
+
+It can also be run from command line:
+    python -m modules.H5Catalog -d catalog.sqlite [-sf] [-j 4] [--harm 7] [--min-queues 1001] [--sample PMMA] [path ...]
+'''
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import concurrent.futures
+import h5py
+
+from modules import H5Compact
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# channels of data tables and raw data
+chn_keys = ['samp', 'ref']
+table_keys = ['samp', 'samp_ref', 'ref', 'ref_ref']
+
+# files read by each process at a time
+scan_chunk_files = 16
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    folder TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    ver TEXT,
+    data_format_ver INTEGER,
+    t0 TEXT,
+    t0_shifted TEXT,
+    sample_description TEXT,
+    settings TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS channels (
+    path TEXT,
+    chn TEXT,
+    n_queue INTEGER,
+    raw_layout TEXT,
+    PRIMARY KEY (path, chn)
+);
+CREATE TABLE IF NOT EXISTS harmonics (
+    path TEXT,
+    chn TEXT,
+    harm INTEGER,
+    PRIMARY KEY (path, chn, harm)
+);
+CREATE TABLE IF NOT EXISTS mech_keys (
+    path TEXT,
+    chn TEXT,
+    mech_key TEXT,
+    PRIMARY KEY (path, chn, mech_key)
+);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS channels_n_queue ON channels (chn, n_queue);
+CREATE INDEX IF NOT EXISTS harmonics_harm ON harmonics (chn, harm);
+CREATE INDEX IF NOT EXISTS mech_keys_mech_key ON mech_keys (mech_key);
+'''
+
+
+def _json(data):
+    if isinstance(data, bytes): # h5py >= 3 returns bytes
+        data = data.decode()
+    return json.loads(data)
+
+
+def _n_queue(fh, key):
+    '''
+    number of rows of data table key (without reading the native tables)
+    '''
+    if 'data' not in fh or key not in fh['data']:
+        return 0
+    obj = fh['data/' + key]
+    if isinstance(obj, h5py.Group): # native
+        return obj['queue_id'].shape[0] if 'queue_id' in obj else 0
+    else: # json (data_format_ver < 2)
+        return len(_json(obj[()]).get('queue_id', {}))
+
+
+def _raw_harms(fh, chn_name):
+    '''
+    raw layout and harmonics (int) with raw data of chn_name
+    '''
+    if 'raw' not in fh or chn_name not in fh['raw']:
+        return None, []
+    g_chn = fh['raw/' + chn_name]
+    layout = g_chn.attrs.get('layout', 'queue')
+    if layout == 'chunked':
+        harms = [key[len('index_'):] for key in g_chn.keys() if key.startswith('index_') and g_chn[key].shape[0]]
+    else: # one group for each queue
+        harms = set()
+        for g_queue in g_chn.values():
+            harms.update(g_queue.keys())
+    return layout, sorted(int(harm) for harm in harms)
+
+
+def read_meta(path):
+    '''
+    read the metadata of h5 file at path
+    return dict of the rows of each table of the catalog (see _schema)
+    files which are not rheoQCM data files are recorded with error
+    '''
+    stat = os.stat(path)
+    meta = {
+        'files': {
+            'path': path,
+            'folder': os.path.dirname(path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'ver': None,
+            'data_format_ver': None,
+            't0': None,
+            't0_shifted': None,
+            'sample_description': None,
+            'settings': None,
+            'error': None,
+        },
+        'channels': [],
+        'harmonics': [],
+        'mech_keys': [],
+    }
+    try:
+        with h5py.File(path, 'r') as fh:
+            if not {'data', 'exp_ref', 'raw', 'settings'}.issubset(fh.keys()) or 'ver' not in fh.attrs:
+                raise ValueError('not a rheoQCM data file')
+            settings = _json(fh['settings'][()])
+            if 'settings_init' in fh: # saved by version < 0.17.0
+                settings.update(_json(fh['settings_init'][()]))
+            exp_ref = _json(fh['exp_ref'][()])
+            meta['files'].update(
+                ver=str(fh.attrs['ver']),
+                data_format_ver=int(fh.attrs['data_format_ver']) if 'data_format_ver' in fh.attrs else None,
+                t0=exp_ref.get('t0'),
+                t0_shifted=exp_ref.get('t0_shifted'),
+                sample_description=settings.get('plainTextEdit_settings_sampledescription'),
+                settings=json.dumps(settings),
+            )
+            for chn_name in chn_keys:
+                layout, harms = _raw_harms(fh, chn_name)
+                meta['channels'].append((path, chn_name, _n_queue(fh, chn_name), layout))
+                meta['channels'].append((path, chn_name + '_ref', _n_queue(fh, chn_name + '_ref'), None))
+                meta['harmonics'].extend((path, chn_name, harm) for harm in harms)
+                if 'prop' in fh and chn_name in fh['prop']:
+                    meta['mech_keys'].extend((path, chn_name, mech_key) for mech_key in fh['prop/' + chn_name].keys())
+    except Exception as e:
+        logger.warning('%s: %s', path, e)
+        meta['files']['error'] = '{}: {}'.format(type(e).__name__, e)
+        meta['channels'], meta['harmonics'], meta['mech_keys'] = [], [], []
+    return meta
+
+
+def _read_metas(paths):
+    return [read_meta(path) for path in paths]
+
+
+class H5Catalog:
+    def __init__(self, db_path):
+        '''
+        open (or create) the catalog at db_path (SQLite file)
+        '''
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_schema)
+        self._conn.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        self._conn.close()
+
+
+    def _save_meta(self, meta):
+        path = meta['files']['path']
+        self._remove(path)
+        cols = list(meta['files'])
+        self._conn.execute('INSERT INTO files ({}) VALUES ({})'.format(', '.join(cols), ', '.join('?' * len(cols))), [meta['files'][col] for col in cols])
+        self._conn.executemany('INSERT INTO channels VALUES (?, ?, ?, ?)', meta['channels'])
+        self._conn.executemany('INSERT OR IGNORE INTO harmonics VALUES (?, ?, ?)', meta['harmonics'])
+        self._conn.executemany('INSERT OR IGNORE INTO mech_keys VALUES (?, ?, ?)', meta['mech_keys'])
+
+
+    def _remove(self, path):
+        for table in ['files', 'channels', 'harmonics', 'mech_keys']:
+            self._conn.execute('DELETE FROM {} WHERE path = ?'.format(table), (path,))
+
+
+    def refresh(self, paths, subfolder=False, processes=None, progress=None):
+        '''
+        update the catalog with h5 files in paths (files or folders)
+        only files added or changed (mtime, size) since last refresh are read
+        files in the catalog under the folders of paths which don't exist anymore are removed
+        subfolder: if True, include files in subfolders
+        processes: number of processes reading files (None for number of CPUs, 0 for reading in this process)
+        progress: function(n_done, n_total) called after each chunk of files is read
+        return (number of files read, number of files removed)
+        '''
+        files = H5Compact.find_files(paths, subfolder=subfolder)
+        saved = dict(((path, (mtime_ns, size)) for path, mtime_ns, size in self._conn.execute('SELECT path, mtime_ns, size FROM files')))
+        changed = []
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if saved.get(path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append(path)
+
+        # files removed from the folders
+        found = set(files)
+        removed = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                prefix = os.path.join(path, '')
+                removed.extend(p for p in saved if p.startswith(prefix) and p not in found and (subfolder or os.path.dirname(p) == path))
+            elif path in saved and path not in found:
+                removed.append(path)
+        for path in removed:
+            self._remove(path)
+
+        chunks = [changed[i:i+scan_chunk_files] for i in range(0, len(changed), scan_chunk_files)]
+        n_done = 0
+        if processes == 0 or len(chunks) <= 1:
+            results = map(_read_metas, chunks)
+            executor = None
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+            results = (future.result() for future in concurrent.futures.as_completed([executor.submit(_read_metas, chunk) for chunk in chunks]))
+        try:
+            for metas in results:
+                for meta in metas:
+                    self._save_meta(meta)
+                self._conn.commit()
+                n_done += len(metas)
+                if progress is not None:
+                    progress(n_done, len(changed))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            self._conn.commit()
+        logger.info('catalog %s: %s files read, %s removed', self.db_path, len(changed), len(removed))
+        return len(changed), len(removed)
+
+
+    def find(self, chn='samp', harms=None, min_queues=None, max_queues=None, sample_description=None, mech_key=None, ver=None, folder=None):
+        '''
+        paths of files matching all the given conditions
+        chn: channel of the conditions on queues, harmonics and mech_key ('samp' or 'ref')
+        harms: list of harmonics (int) which all have raw data
+        min_queues, max_queues: range of number of queues (rows of data table chn)
+        sample_description: text contained in sample description (case insensitive)
+        mech_key: mech_key in prop (e.g. '353_3')
+        ver: version of the program saved the file
+        folder: folder of the files (including subfolders)
+        '''
+        sql = ['SELECT files.path FROM files']
+        where = ['files.error IS NULL']
+        params = []
+        if min_queues is not None or max_queues is not None:
+            sql.append('JOIN channels ON channels.path = files.path AND channels.chn = ?')
+            params.append(chn)
+            if min_queues is not None:
+                where.append('channels.n_queue >= ?')
+                params.append(min_queues)
+            if max_queues is not None:
+                where.append('channels.n_queue <= ?')
+                params.append(max_queues)
+        for harm in (harms or []):
+            where.append('EXISTS (SELECT 1 FROM harmonics WHERE harmonics.path = files.path AND harmonics.chn = ? AND harmonics.harm = ?)')
+            params.extend([chn, int(harm)])
+        if mech_key is not None:
+            where.append('EXISTS (SELECT 1 FROM mech_keys WHERE mech_keys.path = files.path AND mech_keys.chn = ? AND mech_keys.mech_key = ?)')
+            params.extend([chn, mech_key])
+        if sample_description is not None:
+            where.append("files.sample_description LIKE ? ESCAPE '\\'")
+            params.append('%' + sample_description.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if ver is not None:
+            where.append('files.ver = ?')
+            params.append(ver)
+        if folder is not None:
+            folder = os.path.abspath(folder)
+            where.append("(files.folder = ? OR files.folder LIKE ? ESCAPE '\\')")
+            params.extend([folder, os.path.join(folder, '').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'])
+        sql.append('WHERE ' + ' AND '.join(where) + ' ORDER BY files.path')
+        return [row[0] for row in self._conn.execute(' '.join(sql), params)]
+
+
+    def info(self, path):
+        '''
+        metadata of path in the catalog (dict as read_meta). None if not in the catalog
+        '''
+        cur = self._conn.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        info = dict(zip([col[0] for col in cur.description], row))
+        info['settings'] = json.loads(info['settings']) if info['settings'] else None
+        info['channels'] = {chn: {'n_queue': n_queue, 'raw_layout': layout} for chn, n_queue, layout in self._conn.execute('SELECT chn, n_queue, raw_layout FROM channels WHERE path = ?', (info['path'],))}
+        for chn in info['channels']:
+            info['channels'][chn]['harms'] = [harm for harm, in self._conn.execute('SELECT harm FROM harmonics WHERE path = ? AND chn = ? ORDER BY harm', (info['path'], chn))]
+            info['channels'][chn]['mech_keys'] = [key for key, in self._conn.execute('SELECT mech_key FROM mech_keys WHERE path = ? AND chn = ? ORDER BY mech_key', (info['path'], chn))]
+        return info
+
+
+    def query(self, sql, params=()):
+        '''
+        run sql on the catalog and return the rows
+        '''
+        return self._conn.execute(sql, params).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the catalog (SQLite) of .h5 files and find files by metadata.')
+    parser.add_argument('path', metavar='path', type=str, nargs='*', help='path of a file or a folder to add to (refresh) the catalog. Multiple paths are available.')
+    parser.add_argument('-d', '--db', type=str, required=True, help='path of the catalog file')
+    parser.add_argument('-sf', '--subfolder', action='store_true', default=False, help='Include files in subfolders')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--chn', choices=chn_keys, default='samp', help='channel of the conditions (default: samp)')
+    parser.add_argument('--harm', type=int, nargs='+', default=None, help='harmonics with raw data')
+    parser.add_argument('--min-queues', type=int, default=None, help='minimum number of queues')
+    parser.add_argument('--max-queues', type=int, default=None, help='maximum number of queues')
+    parser.add_argument('--sample', type=str, default=None, help='text in sample description')
+    parser.add_argument('--mech-key', type=str, default=None, help='mech_key in prop (e.g. 353_3)')
+    args = parser.parse_args(argv)
+
+    with H5Catalog(args.db) as catalog:
+        if args.path:
+            n_read, n_removed = catalog.refresh(args.path, subfolder=args.subfolder, processes=args.processes)
+            print('{} files read, {} removed'.format(n_read, n_removed), file=sys.stderr)
+        for path in catalog.find(chn=args.chn, harms=args.harm, min_queues=args.min_queues, max_queues=args.max_queues, sample_description=args.sample, mech_key=args.mech_key):
+            print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
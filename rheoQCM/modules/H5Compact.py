@@ -0,0 +1,280 @@
+'''
+compaction (repacking) of h5 files with h5py
+HDF5 does not reclaim the space of deleted or rewritten objects (e.g. raw data of
+deleted points, rewritten data tables). The live objects (groups, datasets, links and
+attributes) are copied into a fresh file, which replaces the original one atomically
+(os.replace). The compression and chunks of datasets can be changed while copying.
+In raw data groups of 'chunked' layout (see DataSaver), only the rows of harm_<harm>
+referenced by index_<harm> are copied (the rows of deleted points are dropped) and
+the offsets in index_<harm> are updated.
+
+It can also be run from command line to repack files and folders in parallel:
+    python -m modules.H5Compact [-sf] [-c gzip] [--shuffle] [-j 4] path [path ...]
+'''
+
+import os
+import sys
+import argparse
+import concurrent.futures
+import numpy as np
+import h5py
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+ext = ('.h5',) # legal extensions of hdf5 file
+tmp_ext = '.compact.tmp' # extension of the file being written
+
+# max bytes of data copied at a time
+copy_block_bytes = 64 * 1024 * 1024
+
+# datasets smaller than this (bytes) keep their compression and chunks
+# (the chunk index of small datasets is larger than the saved space)
+min_filter_bytes = 16 * 1024
+
+
+def _filterable(dset):
+    '''
+    check if the filters (compression, shuffle) and chunks can be set to dset
+    (not scalar, not empty and without variable length data)
+    '''
+    if dset.shape is None or dset.ndim == 0 or dset.size == 0:
+        return False
+    dtype = dset.dtype
+    if dtype.names: # compound
+        return all(h5py.check_vlen_dtype(dtype.fields[name][0]) is None and dtype.fields[name][0].kind != 'O' for name in dtype.names)
+    return h5py.check_vlen_dtype(dtype) is None and dtype.kind != 'O'
+
+
+def _chunks(dset, chunks):
+    '''
+    chunk shape of the new dataset
+    chunks: None (the same as dset), True (auto) or int (rows of each chunk along the first axis)
+    '''
+    if chunks is None:
+        return dset.chunks
+    if chunks is True:
+        return True
+    return (max(1, min(int(chunks), dset.shape[0])),) + tuple(max(1, n) for n in dset.shape[1:])
+
+
+def _changed(src, compression, compression_opts, shuffle, chunks):
+    '''
+    check if the compression or chunks of dataset src are changed by copying
+    '''
+    if not _filterable(src) or src.size * src.dtype.itemsize < min_filter_bytes:
+        return False
+    if compression is not None and (compression or None, compression_opts) != (src.compression, src.compression_opts):
+        return True
+    if shuffle is not None and bool(shuffle and (compression or src.compression)) != src.shuffle:
+        return True
+    return _chunks(src, chunks) not in (src.chunks, True) or (chunks is True and src.chunks is None)
+
+
+def _create_dataset(src, dst_group, name, compression, compression_opts, shuffle, chunks, shape=None):
+    '''
+    create the dataset in dst_group with the same shape (or given shape) and dtype as src
+    compression: None (the same as src), False (no compression), 'gzip' or 'lzf'
+    shuffle: None (the same as src) or bool
+    chunks: see _chunks
+    datasets smaller than min_filter_bytes keep the compression and chunks of src
+    '''
+    if src.shape is None or src.ndim == 0: # null or scalar
+        return dst_group.create_dataset(name, data=src[()], dtype=src.dtype)
+    if shape is None:
+        shape = src.shape
+    if int(np.prod(shape)) * src.dtype.itemsize < min_filter_bytes: # small dataset
+        compression = shuffle = chunks = None
+
+    kwargs = {}
+    if src.maxshape != src.shape: # resizable (h5py chunks the dataset if maxshape is given)
+        kwargs['maxshape'] = src.maxshape
+    if _filterable(src):
+        if compression is None:
+            compression, compression_opts = src.compression, src.compression_opts
+        if shuffle is None:
+            shuffle = src.shuffle
+        if compression:
+            kwargs.update(compression=compression, compression_opts=compression_opts)
+        kwargs['shuffle'] = bool(shuffle and compression)
+        kwargs['chunks'] = _chunks(src, chunks)
+        if kwargs['chunks'] is None and (compression or 'maxshape' in kwargs):
+            kwargs['chunks'] = True # filters and resizing need chunks
+        kwargs['fillvalue'] = src.fillvalue
+    else:
+        kwargs['chunks'] = src.chunks
+    return dst_group.create_dataset(name, shape=shape, dtype=src.dtype, **kwargs)
+
+
+def _copy_dataset(src, dst_group, name, **kwargs):
+    '''
+    copy dataset src to dst_group[name] by blocks of rows
+    datasets kept as they are (see _changed) are copied by h5py (H5Ocopy)
+    '''
+    if not _changed(src, **kwargs):
+        src.file.copy(src, dst_group, name=name)
+        return dst_group[name]
+
+    dst = _create_dataset(src, dst_group, name, **kwargs)
+    if src.shape is not None and src.ndim > 0 and src.size > 0:
+        row_bytes = max(1, src.dtype.itemsize * int(np.prod(src.shape[1:])))
+        step = max(1, copy_block_bytes // row_bytes)
+        for start in range(0, src.shape[0], step):
+            dst[start:start+step] = src[start:start+step]
+    _copy_attrs(src, dst)
+    return dst
+
+
+def _copy_raw_chunked(src_raw, src_index, dst_group, harm, **kwargs):
+    '''
+    copy harm_<harm> and index_<harm> of raw data in 'chunked' layout
+    only the rows referenced by the index are copied, in the order of offsets
+    '''
+    index = src_index[()]
+    rows, offsets = np.unique(index['offset'], return_inverse=True)
+    if np.array_equal(rows, np.arange(src_raw.shape[0])): # no deleted rows
+        _copy_dataset(src_raw, dst_group, 'harm_' + harm, **kwargs)
+        _copy_dataset(src_index, dst_group, 'index_' + harm, **kwargs)
+        return
+    index['offset'] = offsets
+    dst = _create_dataset(src_raw, dst_group, 'harm_' + harm, shape=(len(rows),) + src_raw.shape[1:], **kwargs)
+    row_bytes = max(1, src_raw.dtype.itemsize * int(np.prod(src_raw.shape[1:])))
+    step = max(1, copy_block_bytes // row_bytes)
+    for start in range(0, len(rows), step):
+        block = rows[start:start+step]
+        if block[-1] - block[0] + 1 == len(block): # continuous rows
+            dst[start:start+len(block)] = src_raw[block[0]:block[-1]+1]
+        else:
+            dst[start:start+len(block)] = src_raw[block.tolist()]
+    _copy_attrs(src_raw, dst)
+
+    dst_index = _create_dataset(src_index, dst_group, 'index_' + harm, **kwargs)
+    if len(index):
+        dst_index[...] = index
+    _copy_attrs(src_index, dst_index)
+    if len(rows) < src_raw.shape[0]:
+        logger.info('%s: %s rows of deleted raw data dropped', src_raw.name, src_raw.shape[0] - len(rows))
+
+
+def _copy_attrs(src, dst):
+    for key in src.attrs.keys():
+        dst.attrs.create(key, src.attrs[key], dtype=src.attrs.get_id(key).dtype)
+
+
+def _copy_group(src, dst, **kwargs):
+    '''
+    copy the members of group src to group dst recursively
+    '''
+    _copy_attrs(src, dst)
+    raw_chunked = src.attrs.get('layout') == 'chunked' # group of raw data in 'chunked' layout
+    for name in src.keys():
+        if raw_chunked and name.startswith(('harm_', 'index_')):
+            harm = name.split('_', 1)[1]
+            if isinstance(src.get('harm_' + harm, getlink=True), h5py.HardLink) and isinstance(src.get('index_' + harm, getlink=True), h5py.HardLink):
+                if name.startswith('harm_'):
+                    _copy_raw_chunked(src[name], src['index_' + harm], dst, harm, **kwargs)
+                continue
+        link = src.get(name, getlink=True)
+        if isinstance(link, h5py.SoftLink):
+            dst[name] = h5py.SoftLink(link.path)
+        elif isinstance(link, h5py.ExternalLink):
+            dst[name] = h5py.ExternalLink(link.filename, link.path)
+        else:
+            obj = src[name]
+            if isinstance(obj, h5py.Group):
+                _copy_group(obj, dst.create_group(name), **kwargs)
+            elif isinstance(obj, h5py.Dataset):
+                _copy_dataset(obj, dst, name, **kwargs)
+            else: # named datatype
+                dst[name] = obj
+
+
+def compact_file(path, compression=None, compression_opts=None, shuffle=None, chunks=None, libver=None):
+    '''
+    copy the live objects of h5 file at path into a fresh file and replace path with it
+    compression: None (keep the compression of each dataset), False (no compression), 'gzip' or 'lzf'
+    compression_opts: level of gzip (0-9)
+    shuffle: None (keep), True or False. only used with compression
+    chunks: None (keep), True (auto) or int (rows of each chunk along the first axis)
+    libver: None (the same as the file) or libver of h5py.File (e.g. 'latest' for SWMR mode)
+    return (file size before, file size after)
+    '''
+    size0 = os.path.getsize(path)
+    tmp_path = path + tmp_ext
+    try:
+        with h5py.File(path, 'r') as src, h5py.File(tmp_path, 'w', libver=libver or src.libver) as dst:
+            _copy_group(src, dst, compression=compression, compression_opts=compression_opts, shuffle=shuffle, chunks=chunks)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): # failed
+            os.remove(tmp_path)
+    size1 = os.path.getsize(path)
+    logger.info('%s compacted: %s -> %s bytes', path, size0, size1)
+    return size0, size1
+
+
+def find_files(paths, subfolder=False):
+    '''
+    list the h5 files in paths (files or folders)
+    subfolder: if True, include files in subfolders
+    '''
+    files = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(ext))
+                if not subfolder:
+                    break
+        elif os.path.isfile(path) and path.endswith(ext):
+            files.append(path)
+    return list(dict.fromkeys(files)) # unique
+
+
+def compact_files(paths, subfolder=False, processes=None, **kwargs):
+    '''
+    compact all h5 files in paths in parallel processes
+    processes: number of processes (None for number of CPUs)
+    kwargs: see compact_file
+    yield (path, (size before, size after) or the error) in the order of finishing
+    '''
+    files = find_files(paths, subfolder=subfolder)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(compact_file, f, **kwargs): f for f in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Repack .h5 files to shrink the file size (reclaim the space of deleted data) and change compression.')
+    parser.add_argument('path', metavar='path', type=str, nargs='+', help='path of a file or a folder (repack all .h5 files in the folder). Multiple paths are available.')
+    parser.add_argument('-sf', '--subfolder', action='store_true', default=False, help='Include files in subfolders')
+    parser.add_argument('-c', '--compression', choices=['keep', 'none', 'gzip', 'lzf'], default='keep', help='compression of datasets (default: keep)')
+    parser.add_argument('-l', '--level', type=int, default=None, help='level of gzip (0-9)')
+    parser.add_argument('--shuffle', action=argparse.BooleanOptionalAction, default=None, help='use (--shuffle) or not use (--no-shuffle) shuffle filter with compression (default: keep)')
+    parser.add_argument('--chunks', type=int, default=None, help='rows of each chunk (default: keep). raw data in chunked layout are grouped by CHUNKS queues per chunk')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    compression = {'keep': None, 'none': False}.get(args.compression, args.compression)
+    total0 = total1 = 0
+    failed = 0
+    for path, result in compact_files(args.path, subfolder=args.subfolder, processes=args.processes,
+        compression=compression, compression_opts=args.level, shuffle=args.shuffle, chunks=args.chunks):
+        if isinstance(result, Exception):
+            failed += 1
+            print('{}: failed ({})'.format(path, result))
+        else:
+            total0 += result[0]
+            total1 += result[1]
+            print('{}: {} -> {} bytes'.format(path, *result))
+    print('Total: {} -> {} bytes'.format(total0, total1))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+'''
+array based functions for peak finding and fitting window
+All functions work on boolean masks and index ranges
+and can be used for a batch of spectra (2D array: spectra x points)
+'''
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def peak_mask(data, minpeakheight=-np.inf, threshold=0):
+    '''
+    mask of local maxima along the last axis
+    data: 1D array of a spectrum or 2D array of spectra (spectra x points)
+    minpeakheight: min height of peaks
+    threshold: min difference between the peak and its neighbours
+    return boolean array with the same shape of data
+    '''
+    data = np.asarray(data, dtype='float64')
+    mask = np.zeros(data.shape, dtype=bool)
+    if data.shape[-1] < 3:
+        return mask
+
+    diffs = np.diff(data, axis=-1)
+    mask[..., 1:-1] = (
+        (diffs[..., :-1] > 0) & (diffs[..., 1:] < 0) # rising then falling
+        & (np.abs(diffs[..., :-1]) >= threshold)
+        & (np.abs(diffs[..., 1:]) >= threshold)
+        & (data[..., 1:-1] >= minpeakheight)
+    )
+    return mask
+
+
+def sort_indices(indices, values, sortstr=None):
+    '''
+    sort indices by values
+    sortstr: 'ascend' or 'descend'. not sorted if None
+    return sorting order of indices
+    '''
+    if not sortstr:
+        return np.arange(len(indices))
+    if sortstr.lower() == 'descend':
+        return np.argsort(-values, kind='stable')
+    else: # ascend
+        return np.argsort(values, kind='stable')
+
+
+def findpeaks(array, output, sortstr=None, npeaks=np.inf, minpeakheight=-np.inf, threshold=0):
+    '''
+    find the local maxima of a 1D array
+    output: 'indices' or 'values'
+    sortstr: 'ascend' or 'descend'
+    npeaks: max number of peaks (the first npeaks peaks in order of position are kept)
+    '''
+    data = np.atleast_1d(array).astype('float64')
+    if data.size < 3:
+        return np.array([])
+
+    indices = np.flatnonzero(peak_mask(data, minpeakheight=minpeakheight, threshold=threshold))
+    if np.isfinite(npeaks):
+        indices = indices[:int(npeaks)]
+    values = data[indices]
+
+    order = sort_indices(indices, values, sortstr)
+    indices, values = indices[order], values[order]
+
+    if output.lower() == 'indices':
+        return indices
+    elif output.lower() == 'values':
+        return values
+
+
+def findpeaks_batch(data, minpeakheight=-np.inf, threshold=0):
+    '''
+    find the local maxima of a batch of spectra
+    data: 2D array (spectra x points)
+    return (spectrum indices, point indices) of the peaks
+    '''
+    return np.nonzero(peak_mask(data, minpeakheight=minpeakheight, threshold=threshold))
+
+
+def nearest_indices(x, vals):
+    '''
+    indices of the points in x nearest to vals
+    x: 1D array
+    vals: array of any shape
+    return int array in shape of vals
+    '''
+    vals = np.asarray(vals, dtype='float64')
+    return np.abs(x - vals[..., np.newaxis]).argmin(axis=-1)
+
+
+def ranges_mask(n, ind_min, ind_max):
+    '''
+    mask of the union of index ranges [ind_min, ind_max)
+    n: number of points
+    ind_min, ind_max: arrays of start and stop indices. The last axis is of ranges.
+        The leading axes (if any) are for spectra
+    return boolean array (..., n)
+    '''
+    ind_min = np.asarray(ind_min)[..., np.newaxis]
+    ind_max = np.asarray(ind_max)[..., np.newaxis]
+    idx = np.arange(n)
+    return ((idx >= ind_min) & (idx < ind_max)).any(axis=-2)
+
+
+def factor_ranges(x, cen, wid, factor):
+    '''
+    index ranges of peaks in cen +/- wid * factor
+    x: 1D array (frequency)
+    cen, wid: arrays of peak centers and half widths
+    return ind_min, ind_max
+    '''
+    cen = np.asarray(cen, dtype='float64')
+    wid = np.asarray(wid, dtype='float64')
+    ind_min = nearest_indices(x, cen - wid * factor)
+    ind_max = nearest_indices(x, cen + wid * factor)
+    return ind_min, ind_max
+
+
+def factor_window(x, cen, wid, factor):
+    '''
+    fitting window of peaks in cen +/- wid * factor
+    x: 1D array (frequency)
+    cen, wid: arrays of peak centers and half widths
+    return
+        mask of the points in window
+        span of the window [min, max]
+    '''
+    ind_min, ind_max = factor_ranges(x, cen, wid, factor)
+    mask = ranges_mask(len(x), ind_min, ind_max)
+    edges = x[np.concatenate((np.ravel(ind_min), np.ravel(ind_max)))]
+    return mask, [np.amin(edges), np.amax(edges)]
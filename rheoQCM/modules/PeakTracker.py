@@ -6,9 +6,11 @@ from lmfit import Model, Minimizer, minimize, Parameters, fit_report, printfuncs
 from lmfit.models import ConstantModel
 from scipy.signal import find_peaks, find_peaks_cwt, peak_widths, peak_prominences
 from random import randrange
+import time
 
 import UISettings
 from modules import UIModules
+from modules import PeakFinder
 
 # for debugging
 import traceback
@@ -183,6 +185,46 @@ def res_GB(params, f, G, B, **kwargs):
         return np.concatenate((residual_G * eps, residual_B * eps))
 
 
+def norm_chisqr(result, G, B):
+    '''
+    normalized chisqr of fitting result
+    chisqr / (sum of squares of G & B about their means)
+    it is not sensitive to the amplitude of the peak
+    return np.nan if result is not available
+    '''
+    if not result: # None or empty
+        return np.nan
+    ss = np.nansum((G - np.nanmean(G))**2) + np.nansum((B - np.nanmean(B))**2)
+    if ss == 0:
+        return np.nan
+    return result.chisqr / ss
+
+
+def decimate_idx(f, val=None, n=1, method='step', step=5, npts=200):
+    '''
+    indices of decimated data for coarse fitting
+    f: frequency array
+    val: dict of params values (params.valuesdict()). used for 'peak' method
+    n: number of peaks in val
+    method: 
+        'step': every step-th point
+        'peak': npts points with higher density around the peaks
+    return sorted array of indices (the first and last points are always included)
+    '''
+    if method == 'peak' and val is not None:
+        # weight: uniform floor + Lorentzian of each peak
+        w = np.ones(len(f))
+        for i in range(n):
+            cen_i, wid_i = val['p' + str(i) + '_cen'], val['p' + str(i) + '_wid']
+            w += 4 * wid_i**2 / ((f - cen_i)**2 + wid_i**2)
+        cdf = np.cumsum(w)
+        idx = np.searchsorted(cdf, np.linspace(cdf[0], cdf[-1], npts))
+    else:
+        idx = np.arange(0, len(f), max(int(step), 1))
+    
+    return np.unique(np.concatenate(([0], np.clip(idx, 0, len(f)-1), [len(f)-1])))
+
+
 def findpeaks(array, output, sortstr=None, npeaks=np.inf, minpeakheight=-np.inf, 
             threshold=0, minpeakdistance=0, widthreference=None, minpeakwidth=0, maxpeakwidth=np.inf):
     '''
@@ -190,42 +232,8 @@ def findpeaks(array, output, sortstr=None, npeaks=np.inf, minpeakheight=-np.inf,
     sortstr: 'ascend' or 'descend'
     '''
     # NOTUSING
-    indices = np.array([]).astype('int64')
-    values = np.array([]).astype('float64')
-    data = np.atleast_1d(array).astype('float64')
-    if data.size < 3:
-        return np.array([])
-
-    hnpeaks = 0
-    diffs = data[1:]-data[:-1]
-    for i in range(diffs.size-1):
-        if hnpeaks >= npeaks:
-            break
-        if diffs[i] > 0 and diffs[i+1] < 0:
-            lthreshold = np.absolute(diffs[i])
-            rthreshold = np.absolute(diffs[i+1])
-            if data[i+1] >= minpeakheight and lthreshold >= threshold and rthreshold >= threshold:
-                indices = np.append(indices, i+1)
-                values = np.append(values, data[i+1])
-                hnpeaks = hnpeaks + 1
-
-    indices_copy = np.copy(indices)
-    if sortstr:
-        if sortstr.lower() == 'ascend':
-            order = np.argsort(values)
-            values = np.sort(values)
-            for i in range(order.size):
-                indices[i] = indices_copy[order[i]]
-        elif sortstr.lower() == 'descend':
-            order = np.argsort(-values)
-            values = -np.sort(-values)
-            for i in range(order.size):
-                indices[i] = indices_copy[order[i]]
-
-    if output.lower() == 'indices':
-        return indices
-    elif output.lower() == 'values':
-        return values
+    # minpeakdistance, widthreference, minpeakwidth and maxpeakwidth are not used
+    return PeakFinder.findpeaks(array, output, sortstr=sortstr, npeaks=npeaks, minpeakheight=minpeakheight, threshold=threshold)
 
 
 def findpeaks_py(x, resonance, output=None, sortstr=None, threshold=None, prominence=None, distance=None, width=None):
@@ -238,9 +246,11 @@ def findpeaks_py(x, resonance, output=None, sortstr=None, threshold=None, promin
     sortstr: 'ascend' or 'descend' ordering data by peak height
     '''
     # logger.info(resonance) 
-    if x is None or len(x) == 1: # for debuging
+    if x is None or len(x) < 2: # no peak can be found
         logger.warning('findpeaks_py input x is not well assigned!\nx = {}'.format(x))
-        exit(0)
+        if output:
+            return np.array([], dtype=int)
+        return np.array([], dtype=int), np.array([]), np.array([]), np.array([])
 
     logger.info(threshold) 
     logger.info('f distance %s', distance / (x[1] - x[0])) 
@@ -263,24 +273,17 @@ def findpeaks_py(x, resonance, output=None, sortstr=None, threshold=None, promin
     prominences = np.array([])
     widths = np.array([])
     if sortstr:
-        if sortstr.lower() == 'ascend':
-            order = np.argsort(values)
-            # values = np.sort(values)
-        elif sortstr.lower() == 'descend':
-            order = np.argsort(-values)
-            values = -np.sort(-values)
-        else:
-            order = np.argsort(values)
+        order = PeakFinder.sort_indices(indices, values, sortstr)
         logger.info(values) 
         logger.info(peaks) 
         logger.info(order) 
         logger.info(props) 
 
-        for i in range(order.size):
-            indices[i] = indices[order[i]]
-            heights = np.append(heights, props['width_heights'][order[i]])
-            prominences = np.append(prominences, props['prominences'][order[i]])
-            widths = np.append(widths, props['widths'][order[i]] * (x[1] - x[0])) # in Hz
+        indices = indices[order]
+        values = values[order]
+        heights = props['width_heights'][order]
+        prominences = props['prominences'][order]
+        widths = props['widths'][order] * (x[1] - x[0]) # in Hz
     
     if output:
         if output.lower() == 'indices':
@@ -334,12 +337,106 @@ def guess_peak_factors(freq, resonance):
         return amp, cen, half_wid, half_max
 
 
+class PeakFilter:
+    '''
+    Kalman filter of peak state x = (cen, wid, dcen/dt, dwid/dt)
+    with constant velocity model for predictive tracking.
+    cen and wid are measured by each scan
+    '''
+    def __init__(self, q=None, r=None):
+        self.q = config_default['predictive_q'] if q is None else q # HWHM^2/s^3
+        self.r = config_default['predictive_r'] if r is None else r # HWHM
+        self.reset()
+
+
+    def reset(self):
+        self.x = None # state
+        self.P = None # covariance of state
+        self.t = None # time of last update (s)
+        self.dt = None # time between last two updates (s)
+        self.n = 0 # number of updates
+
+
+    def is_ready(self):
+        ''' the velocities are available after two updates '''
+        return self.n >= 2
+
+
+    def _F_Q(self, dt, wid):
+        ''' transition and process noise matrices for time step dt '''
+        F = np.eye(4)
+        F[0, 2] = dt
+        F[1, 3] = dt
+        q = self.q * wid**2
+        Q = np.zeros((4, 4))
+        Q[[0, 1], [0, 1]] = q * dt**3 / 3
+        Q[[0, 1], [2, 3]] = q * dt**2 / 2
+        Q[[2, 3], [0, 1]] = q * dt**2 / 2
+        Q[[2, 3], [2, 3]] = q * dt
+        return F, Q
+
+
+    def predict(self, t):
+        '''
+        predict state at time t w/o changing the filter
+        return x, P
+        '''
+        dt = max(t - self.t, 0)
+        F, Q = self._F_Q(dt, self.x[1])
+        return F @ self.x, F @ self.P @ F.T + Q
+
+
+    def update(self, t, cen, wid):
+        '''
+        update the filter with measured cen & wid at time t (s)
+        '''
+        if self.n > 0 and t <= self.t: # not a new scan
+            return
+        R = np.diag([(self.r * wid)**2] * 2)
+        if self.n == 0:
+            self.x = np.array([cen, wid, 0., 0.])
+            # the velocities are unknown. use a large variance
+            self.P = np.diag([R[0, 0], R[1, 1], wid**2, wid**2]) 
+        elif self.n == 1:
+            # use the finite difference as initial velocities
+            dt = t - self.t
+            self.x = np.array([cen, wid, (cen - self.x[0]) / dt, (wid - self.x[1]) / dt])
+            self.P = np.diag([R[0, 0], R[1, 1], 2 * R[0, 0] / dt**2, 2 * R[1, 1] / dt**2])
+        else:
+            x, P = self.predict(t)
+            H = np.eye(2, 4)
+            y = np.array([cen, wid]) - H @ x # innovation
+            S = H @ P @ H.T + R
+            if np.abs(y[0]) > config_default['predictive_gate'] * np.sqrt(S[0, 0]): # peak lost by the filter
+                logger.info('peak out of prediction gate. reset filter') 
+                self.reset()
+                return self.update(t, cen, wid)
+            K = P @ H.T @ np.linalg.inv(S)
+            self.x = x + K @ y
+            self.P = (np.eye(4) - K @ H) @ P
+
+        if self.t is not None:
+            self.dt = t - self.t
+        self.t = t
+        self.n += 1
+
+
+    def predict_next(self):
+        '''
+        predict the peak at the next scan, assuming the same time interval as the last one
+        return cen, wid, std of cen
+        '''
+        x, P = self.predict(self.t + self.dt)
+        return x[0], x[1], np.sqrt(P[0, 0])
+
+
 class PeakTracker:
 
     def __init__(self, max_harm):
         self.max_harm = max_harm
         self.harminput = self.init_harmdict()
         self.harmoutput = self.init_harmdict()
+        self.filters = {} # PeakFilter for predictive tracking by (chn_name, harm)
         for harm in range(1, self.max_harm+2, 2):
             harm = str(harm)
             self.update_input('samp', harm , harmdata={}, freq_span={}, fGB=[[], [], []])
@@ -365,14 +462,10 @@ class PeakTracker:
         '''
         create a dict with for saving input or output data
         '''
-        harm_dict = {}
-        for i in range(1, self.max_harm+2, 2):
-            harm_dict[str(i)] = {}
-        chn_dict = {
-            'samp': harm_dict,
-            'ref' : harm_dict,
-            'refit' : harm_dict,
-        }
+        # each channel needs its own harm dict. Otherwise, the values of the same harm in different channels will be overwritten by each other
+        chn_dict = {}
+        for chn_name in ['samp', 'ref', 'refit']:
+            chn_dict[chn_name] = {str(i): {} for i in range(1, self.max_harm+2, 2)}
         return chn_dict
 
 
@@ -389,6 +482,7 @@ class PeakTracker:
         if fGB is not None:
             f, G, B = fGB
             self.harminput[chn_name][harm]['isfitted'] = False # if the data has been fitted
+            self.harminput[chn_name][harm]['t'] = time.time() # time of the data (s)
             self.harminput[chn_name][harm]['f'] = f
             self.harminput[chn_name][harm]['G'] = G
             self.harminput[chn_name][harm]['B'] = B
@@ -449,6 +543,7 @@ class PeakTracker:
         else: # initialize
             self.harmoutput[chn_name][harm]['span'] = kwargs.get('span', [np.nan, np.nan])       # span for next scan
             self.harmoutput[chn_name][harm]['cen_trk'] = kwargs.get('cen_trk', np.nan)       # tracking peak center 
+            self.harmoutput[chn_name][harm]['wid_trk'] = kwargs.get('wid_trk', np.nan)       # tracking peak half width (HWHM) 
             self.harmoutput[chn_name][harm]['factor_span'] = kwargs.get('span', [np.nan, np.nan])       # span of freq used for fitting
             self.harmoutput[chn_name][harm]['method'] = kwargs.get('method', '')       # method for next scan
             self.harmoutput[chn_name][harm]['found_n'] = kwargs.get('found_n', np.nan)       # condition for next scan
@@ -459,6 +554,7 @@ class PeakTracker:
             self.harmoutput[chn_name][harm]['bmod'] = kwargs.get('bmod', np.nan) # parameters input for clculation
             self.harmoutput[chn_name][harm]['params'] = kwargs.get('params', np.nan) # parameters input for clculation
             self.harmoutput[chn_name][harm]['result'] = kwargs.get('result', {}) # clculation result
+            self.harmoutput[chn_name][harm]['nchisqr'] = kwargs.get('nchisqr', np.nan) # normalized chisqr of result
         
         # logger.info('update params', kwargs.get('params')) 
 
@@ -680,6 +776,25 @@ class PeakTracker:
                 new_xlim = [(current_xlim[0] + thresh2), (current_xlim[1] - thresh2)] # Hz
             elif thresh1 - LB_peak > -half_wid*5: # if the peak is too fat, zoom out of the peak
                 new_xlim = [(current_xlim[0] - thresh2), (current_xlim[1] + thresh2)] # Hz '''
+        elif track_condition == 'predictive':
+            peak_filter = self.filters.setdefault((chn_name, harm), PeakFilter())
+            peak_filter.update(self.harminput[chn_name][harm]['t'], cen, half_wid)
+            if peak_filter.is_ready():
+                pred_cen, pred_wid, pred_std = peak_filter.predict_next()
+                pred_wid = max(pred_wid, config_default['peak_min_width_Hz'] / 2)
+                new_cen = pred_cen
+                new_span = max(
+                    config_default['wid_ratio_range'][0] * pred_wid * 2 + 2 * config_default['predictive_nsigma'] * pred_std,
+                    config_default['peak_min_width_Hz'],
+                )
+                logger.info('predicted cen %s, wid %s, std %s', pred_cen, pred_wid, pred_std) 
+            else: # not enough data for prediction. use the same rules as 'auto'
+                new_cen = set_new_cen(freq, cen, current_span, current_xlim)
+                new_span = set_new_span(current_span, half_wid)
+            new_xlim = set_new_xlim(new_cen, new_span)
+
+            logger.info('new_cen %s', new_cen) 
+            logger.info('new_span %s', new_span) 
         elif track_condition == 'fixcntspn':
             logger.info('fixcntspn') 
             # both span and cent are fixed
@@ -691,12 +806,38 @@ class PeakTracker:
             ### CUSTOM, USER-DEFINED
             pass
 
+        if track_condition != 'predictive': # the filter of chn_name & harm is out of date
+            self.filters.pop((chn_name, harm), None)
+
         logger.info('new_cen: %s', new_cen)
         logger.info('new_xlim: %s', new_xlim)
 
         # set new start/end freq in Hz
         self.update_output(chn_name, harm, span=new_xlim)
         self.update_output(chn_name, harm, cen_trk=cen)
+        self.update_output(chn_name, harm, wid_trk=half_wid)
+
+
+    def recommend_steps(self, span, max_steps, chn_name=None, harm=None):
+        '''
+        recommend the minimum number of points of the next sweep
+        which gives config_default['adaptive_steps_pts_per_hwhm'] points in a HWHM of the tracked peak
+        span: width of the span of next sweep in Hz
+        max_steps: the max number of points (the steps in settings)
+        return int
+        '''
+        if (chn_name is None) & (harm is None):
+            chn_name = self.active_chn
+            harm = self.active_harm
+
+        half_wid = self.harmoutput[chn_name][harm].get('wid_trk', np.nan)
+        if (half_wid is None) or np.isnan(half_wid) or (half_wid <= 0) or np.isnan(span): # peak not tracked
+            return int(max_steps)
+
+        steps = int(np.ceil(config_default['adaptive_steps_pts_per_hwhm'] * span / half_wid)) + 1
+        steps = max(steps, config_default['adaptive_steps_min'])
+        logger.info('recommended steps %s', steps) 
+        return int(min(steps, max_steps))
 
 
     ########### peak finding functions ###########
@@ -965,24 +1106,108 @@ class PeakTracker:
 
 
     ########### fitting ##########################
+    def fit_stable(self, chn_name=None, harm=None):
+        '''
+        check if the fitting of chn_name & harm is stable 
+        enough to use the previous result as initial values
+        (skip the peak finding)
+        return True if
+            fastfit is on
+            the previous fitting succeeded with a low normalized chisqr
+            the tracked peak center is well inside current span
+        '''
+        if (chn_name is None) & (harm is None):
+            chn_name = self.active_chn
+            harm = self.active_harm
+
+        if not config_default.get('fastfit', False):
+            return False
+
+        result = self.harmoutput[chn_name][harm].get('result', None)
+        if not result or not result.success: # None, empty or failed
+            return False
+
+        found_n = self.harmoutput[chn_name][harm].get('found_n', np.nan)
+        if np.isnan(found_n) or found_n < 1:
+            return False
+
+        nchisqr = self.harmoutput[chn_name][harm].get('nchisqr', np.nan)
+        if np.isnan(nchisqr) or nchisqr > config_default['fastfit_chisqr_thresh']:
+            return False
+
+        cen_trk = self.harmoutput[chn_name][harm].get('cen_trk', np.nan)
+        if np.isnan(cen_trk):
+            return False
+
+        f = self.harminput[chn_name][harm]['f']
+        f_cen = (np.amax(f) + np.amin(f)) / 2
+        f_span = np.amax(f) - np.amin(f)
+        if np.abs(cen_trk - f_cen) > config_default['fastfit_cen_range'] * f_span:
+            return False
+
+        return True
+
+
+    def fit_good(self, result, chn_name=None, harm=None):
+        '''
+        check if the fitting result is good enough to skip
+        the full guess
+        '''
+        if (chn_name is None) & (harm is None):
+            chn_name = self.active_chn
+            harm = self.active_harm
+
+        if not result or not result.success:
+            return False
+        nchisqr = self.harmoutput[chn_name][harm].get('nchisqr', np.nan)
+        return (not np.isnan(nchisqr)) and (nchisqr <= config_default['fastfit_chisqr_thresh'])
+
+
     def minimize_GB(self):
         '''
         use leasesq to fit
+        if the previous fitting is stable (self.fit_stable), 
+        the previous result is used as initial values. 
+        The full guess (self.auto_guess) is used if fitting 
+        with previous values is not good.
         '''
         chn_name = self.active_chn
         harm = self.active_harm
-        factor =self.get_input(key='factor')
 
         logger.info('chn: %s, harm: %s', chn_name, harm) 
         logger.info(self.get_output()) 
-        logger.info('mm factor %s', factor) 
         logger.info('self n %s', self.found_n) 
-        # set params with data
-        self.auto_guess()
-        self.set_params()
 
-        logger.info('self n %s', self.found_n) 
+        result = {}
+        if self.fit_stable():
+            # fast path: use previous values as initial values
+            logger.info('fast path fitting with previous result') 
+            self.prev_guess()
+            self.set_params()
+            result = self.fit_GB()
+
+        if not self.fit_good(result): 
+            if result:
+                logger.info('fast path fitting degraded. use full guess') 
+            # set params with data
+            self.auto_guess()
+            self.set_params()
+            result = self.fit_GB()
+
+        self.update_output(chn_name, harm, result=result)
+
+
+    def fit_GB(self):
+        '''
+        fit the data with params in harmoutput
+        return fitting result
+        '''
+        chn_name = self.active_chn
+        harm = self.active_harm
+        factor =self.get_input(key='factor')
 
+        logger.info('mm factor %s', factor) 
+        logger.info('self n %s', self.found_n) 
         # set the models
         gmod, bmod = make_gbmodel(self.found_n)
         self.update_output(gmod=gmod)
@@ -1000,34 +1225,21 @@ class PeakTracker:
         # max_idx = max(max indices)
         # all the points between will be used for fitting
         
-        factor_idx_list = [] # for factor_span
-        factor_set_list = [] # for indexing the points for fitting
         if factor is not None:
-            for i in range(self.found_n): # for loop for each single peak from guessed val
-                # get peak cen and wid
-                cen_i, wid_i = val['p' + str(i) + '_cen'], val['p' + str(i) + '_wid']
-                logger.info('cen_i %s', cen_i) 
-                logger.info('wid_i %s', wid_i) 
-                ind_min = np.abs(self.harminput[chn_name][harm]['f'] - (cen_i - wid_i * factor)).argmin()
-                ind_max = np.abs(self.harminput[chn_name][harm]['f'] - (cen_i + wid_i * factor)).argmin()
-                # factor_idx_list.append(ind_min) # add min index 
-                # factor_idx_list.append(ind_max) # add max index 
-                # or use one line
-                factor_idx_list.extend([ind_min, ind_max])
-                # get indices for this peak in form of set
-                factor_set_list.append(set(np.arange(ind_min, ind_max)))
-                
-            # find the union of sets
-            idx_list = list(set().union(*factor_set_list))
-            # mask of if points used for fitting
-            factor_mask = [True if i in idx_list else False for i in np.arange(len(f))]
+            # get peaks cen and wid
+            cen = np.array([val['p' + str(i) + '_cen'] for i in range(self.found_n)])
+            wid = np.array([val['p' + str(i) + '_wid'] for i in range(self.found_n)])
+            logger.info('cen %s', cen) 
+            logger.info('wid %s', wid) 
+            # mask of if points used for fitting (union of cen +/- wid * factor of all peaks)
+            factor_mask, factor_span = PeakFinder.factor_window(f, cen, wid, factor)
 
-            # save min_idx and max_idx to 'factor_span'
-            self.update_output(chn_name=chn_name, harm=harm, factor_span=[min(f[factor_idx_list]), max(f[factor_idx_list])]) # span of f used for fitting
+            # save min and max of f in window to 'factor_span'
+            self.update_output(chn_name=chn_name, harm=harm, factor_span=factor_span) # span of f used for fitting
 
-            f = f[idx_list]
-            G = G[idx_list]
-            B = B[idx_list]
+            f = f[factor_mask]
+            G = G[factor_mask]
+            B = B[factor_mask]
 
             logger.info('data len after factor %s', len(f)) 
 
@@ -1044,10 +1256,35 @@ class PeakTracker:
         # logger.info(G) 
         # logger.info(B) 
         logger.info('mm params %s', self.harmoutput[chn_name][harm]['params']) 
+        params = self.get_output(key='params')
         try:
+            if config_default['coarsefit'] and (len(f) >= config_default['coarsefit_min_pts']):
+                # stage 1: fit the decimated data with lower tolerance
+                idx = decimate_idx(
+                    f, 
+                    val=params.valuesdict(), 
+                    n=self.found_n, 
+                    method=config_default['coarsefit_method'], 
+                    step=config_default['coarsefit_step'], 
+                    npts=config_default['coarsefit_pts'],
+                )
+                logger.info('data len for coarse fitting %s', len(idx)) 
+                result_coarse = minimize(
+                    res_GB, 
+                    params, 
+                    method='leastsq', 
+                    args=(f[idx], G[idx], B[idx]), 
+                    kws={'gmod': gmod, 'bmod': bmod, 'eps': eps}, 
+                    xtol=config_default['coarsefit_xtol'], ftol=config_default['coarsefit_ftol'],
+                    nan_policy='omit', # ('raise' default, 'propagate', 'omit')
+                    )
+                if result_coarse.success:
+                    # stage 2 starts from the result of stage 1
+                    params = result_coarse.params
+
             result = minimize(
                 res_GB, 
-                self.get_output(key='params'), 
+                params, 
                 method='leastsq', 
                 args=(f, G, B), 
                 kws={'gmod': gmod, 'bmod': bmod, 'eps': eps}, 
@@ -1063,7 +1300,9 @@ class PeakTracker:
             # traceback.print_tb(err.__traceback__)
             logger.exception('fitting error occurred.')
 
-        self.update_output(chn_name, harm, result=result)
+        self.update_output(chn_name, harm, nchisqr=norm_chisqr(result, G, B))
+
+        return result
 
 
     def get_fit_values(self, chn_name=None, harm=None):
@@ -0,0 +1,120 @@
+'''
+dict of mechanic results (prop) of a channel in DataSaver
+keys: mech_key (e.g. '353_3'), values: mech_df (pd.DataFrame)
+mech_dfs saved in file are only loaded when they are accessed the first time.
+The changes are tracked for saving:
+    mech_dfs assigned to the dict are rewritten in file
+    rows marked by mark_dirty are written by rows
+Rows of each mech_df are found by queue_id with a dict {queue_id: label of index} (see row_label).
+'''
+
+import collections.abc
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PropStore(collections.abc.MutableMapping):
+    def __init__(self, loader=None, file_keys=()):
+        '''
+        loader: function loads mech_df of mech_key from file. loader(mech_key) -> df
+        file_keys: mech_keys saved in file
+        '''
+        self._loader = loader
+        self._dfs = {} # loaded or assigned mech_dfs
+        self._unloaded = list(file_keys) # mech_keys in file not loaded yet
+        self.rewrite = set() # mech_keys to be rewritten in file
+        self.dirty = {} # {mech_key: set(queue_id)} of rows changed since last saving
+        self._row_index = {} # {mech_key: {queue_id: label}}
+
+
+    def __getitem__(self, mech_key):
+        if mech_key not in self._dfs:
+            if mech_key not in self._unloaded:
+                raise KeyError(mech_key)
+            logger.info('load prop %s', mech_key)
+            self._dfs[mech_key] = self._loader(mech_key)
+            self._unloaded.remove(mech_key)
+            self._row_index.pop(mech_key, None)
+        return self._dfs[mech_key]
+
+
+    def __setitem__(self, mech_key, mech_df):
+        if mech_key in self._unloaded:
+            self._unloaded.remove(mech_key)
+        self._dfs[mech_key] = mech_df
+        self.rewrite.add(mech_key)
+        self.dirty.pop(mech_key, None)
+        self._row_index.pop(mech_key, None)
+
+
+    def __delitem__(self, mech_key):
+        if mech_key in self._unloaded:
+            self._unloaded.remove(mech_key)
+        else:
+            del self._dfs[mech_key]
+        self.rewrite.discard(mech_key)
+        self.dirty.pop(mech_key, None)
+        self._row_index.pop(mech_key, None)
+
+
+    def __contains__(self, mech_key):
+        # without loading
+        return (mech_key in self._dfs) or (mech_key in self._unloaded)
+
+
+    def __iter__(self):
+        yield from list(self._dfs)
+        yield from list(self._unloaded)
+
+
+    def __len__(self):
+        return len(self._dfs) + len(self._unloaded)
+
+
+    def clear(self):
+        # without loading
+        self._dfs = {}
+        self._unloaded = []
+        self.rewrite = set()
+        self.dirty = {}
+        self._row_index = {}
+
+
+    def loaded_items(self):
+        '''
+        (mech_key, mech_df) of loaded or assigned mech_dfs
+        the others are the same as in file
+        '''
+        return list(self._dfs.items())
+
+
+    def row_label(self, mech_key, queue_id):
+        '''
+        label of index of the row with queue_id in mech_df of mech_key
+        (the first one if queue_id is repeated). None if queue_id doesn't exist
+        the found row is checked, and the index is rebuilt if mech_df is changed in place
+        '''
+        df = self[mech_key]
+        label = self._row_index.get(mech_key, {}).get(queue_id)
+        if label is None or label not in df.index or df.at[label, 'queue_id'] != queue_id:
+            # rebuild the index (reversed to keep the first label of repeated queue_id)
+            self._row_index[mech_key] = dict(zip(df['queue_id'].tolist()[::-1], df.index.tolist()[::-1]))
+            label = self._row_index[mech_key].get(queue_id)
+        return label
+
+
+    def mark_dirty(self, mech_key, queue_id):
+        '''
+        mark row of queue_id in mech_df of mech_key as changed
+        '''
+        if mech_key not in self.rewrite:
+            self.dirty.setdefault(mech_key, set()).add(queue_id)
+
+
+    def saved(self, mech_key):
+        '''
+        clear the changes of mech_key after saving
+        '''
+        self.rewrite.discard(mech_key)
+        self.dirty.pop(mech_key, None)
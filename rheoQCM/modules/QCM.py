@@ -77,6 +77,40 @@ def nhcalc2nh(nhcalc):
     return [int(s) for s in nhcalc] 
 
 
+def queue_val(qcm_queue, col):
+    '''
+    get value of col of a single queue
+    qcm_queue: QCMFrame (DataSaver.qcm_frame) or df (shape[0]=1) of a single queue
+    return list (or array) of harmonics or single value
+    '''
+    if isinstance(qcm_queue, pd.DataFrame):
+        return qcm_queue[col].iloc[0]
+    else: # QCMFrame
+        return getattr(qcm_queue, col)[0]
+
+
+def qcm_queue_by_idx(qcm_df, idx):
+    '''
+    get data of a single queue by index idx
+    qcm_df: QCMFrame (DataSaver.qcm_frame) or df
+    '''
+    if isinstance(qcm_df, pd.DataFrame):
+        return qcm_df.loc[[idx], :].copy() # as a dataframe
+    else: # QCMFrame
+        return qcm_df.rows([idx])
+
+
+def qcm_queue_by_pos(qcm_df, pos):
+    '''
+    get data of a single queue by position pos
+    qcm_df: QCMFrame (DataSaver.qcm_frame) or df
+    '''
+    if isinstance(qcm_df, pd.DataFrame):
+        return qcm_df.iloc[[pos], :].copy() # as a dataframe
+    else: # QCMFrame
+        return qcm_df.take([pos])
+
+
 
 
 class QCM:
@@ -690,7 +724,7 @@ class QCM:
         '''
         solve the property of a single test.
         nh: list of int
-        qcm_queue:  QCM data. df (shape[0]=1) 
+        qcm_queue:  QCM data. QCMFrame or df (shape[0]=1) 
         calctype: 'SLA' / 'LL'
         film: dict of the film layers information
         return grho_refh, phi, drho, dlam_ref, err
@@ -699,9 +733,9 @@ class QCM:
             self.calctype = calctype
 
         # get fstar
-        fstars = qcm_queue.fstars.iloc[0] # list
+        fstars = queue_val(qcm_queue, 'fstars') # list
         # get delfstar
-        delfstars = qcm_queue.delfstars.iloc[0] # list
+        delfstars = queue_val(qcm_queue, 'delfstars') # list
         # logger.info('fstars %s', fstars) 
         # logger.info(delfstars) 
         # convert list to dict to make it easier to do the calculation
@@ -710,9 +744,9 @@ class QCM:
         # logger.info(delfstar) 
 
         # set f1
-        f0s = qcm_queue.f0s.iloc[0]
+        f0s = queue_val(qcm_queue, 'f0s')
         f0s = {int(i*2+1): f0 for i, f0 in enumerate(f0s)}
-        g0s = qcm_queue.g0s.iloc[0]
+        g0s = queue_val(qcm_queue, 'g0s')
         g0s = {int(i*2+1): g0 for i, g0 in enumerate(g0s)}
 
         self.f0s = f0s
@@ -754,7 +788,7 @@ class QCM:
         '''
         solve the property of a single test.
         nh: list of int
-        qcm_queue:  QCM data. df (shape[0]=1) 
+        qcm_queue:  QCM data. QCMFrame or df (shape[0]=1) 
         mech_queue: initialized property data. df (shape[0]=1)
         calctype: 'SLA' / 'LL'
         film: dict of the film layers information
@@ -778,9 +812,9 @@ class QCM:
 
         # now back calculate delfstar, rh and rd from the solution
         # get the marks [1st, 3rd, 5th, ...]
-        marks = qcm_queue.marks.iloc[0]
+        marks = queue_val(qcm_queue, 'marks')
 
-        delfstars = qcm_queue.delfstars.iloc[0] # list
+        delfstars = queue_val(qcm_queue, 'delfstars') # list
         delfstar = {int(i*2+1): dfstar for i, dfstar in enumerate(delfstars)}
 
         rd_exp = self.rd_from_delfstar(nh[2], delfstar) # nh[2]
@@ -817,7 +851,7 @@ class QCM:
         # logger.info(type(delf_calcs)) 
 
 
-        delf_exps = qcm_queue.delfs.iloc[0]
+        delf_exps = list(queue_val(qcm_queue, 'delfs'))
         # logger.info('delfs %s', qcm_queue.delfs) 
         # logger.info('delf_exps %s', delf_exps) 
         for n in nhplot:
@@ -892,7 +926,7 @@ class QCM:
         mech_queue['delfn_exps'] = [delfn_exps]
         mech_queue['delf_calcs'] = [delf_calcs]
         mech_queue['delfn_calcs'] = [delfn_calcs]
-        mech_queue['delg_exps'] = qcm_queue['delgs']
+        mech_queue['delg_exps'] = [list(queue_val(qcm_queue, 'delgs'))]
         mech_queue['delg_calcs'] = [delg_calcs]
         mech_queue['delD_exps'] = [delD_exps]
         mech_queue['delD_calcs'] = [delD_calcs]
@@ -1087,14 +1121,15 @@ class QCM:
         '''
         check if all harmonics in nhcalc are not na
         nh: list of strings
-        qcm_queue: qcm data (df) of a single queue
+        qcm_queue: qcm data (QCMFrame or df) of a single queue
         return: True/False
         '''
         # logger.info(nh) 
         # logger.info(nh2i(nh[0])) 
         # logger.info(qcm_queue.delfstars.values) 
         # logger.info(qcm_queue.delfstars.iloc[0]) 
-        if np.isnan(qcm_queue.delfstars.iloc[0][nh2i(nh[0])].real) or np.isnan(qcm_queue.delfstars.iloc[0][nh2i(nh[1])].real) or np.isnan(qcm_queue.delfstars.iloc[0][nh2i(nh[2])].imag):
+        delfstars = queue_val(qcm_queue, 'delfstars')
+        if np.isnan(delfstars[nh2i(nh[0])].real) or np.isnan(delfstars[nh2i(nh[1])].real) or np.isnan(delfstars[nh2i(nh[2])].imag):
             return False
         else:
             return True
@@ -1109,16 +1144,22 @@ class QCM:
         # sample, parms
         '''
         calculate with qcm_df and save to mech_df
+        qcm_df: QCMFrame or df
         '''
         nh = nhcalc2nh(nhcalc) # list of harmonics (int) in nhcalc
+        # positions of queue_ids (the first row of each) found once for all ids
+        qids, first = np.unique(np.asarray(qcm_df.queue_id), return_index=True)
+        qid_pos = dict(zip(qids.tolist(), first.tolist()))
+        index = np.asarray(qcm_df.index)
         for queue_id in queue_ids: # iterate all ids
             # logger.info('queue_id %s', queue_id) 
             # logger.info('qcm_df %s', qcm_df) 
             # logger.info(type(qcm_df)) 
             # queue index
-            idx = qcm_df[qcm_df.queue_id == queue_id].index.astype(int)[0]
+            pos = qid_pos[int(queue_id)]
+            idx = int(index[pos])
             # qcm data of queue_id
-            qcm_queue = qcm_df.loc[[idx], :].copy() # as a dataframe
+            qcm_queue = qcm_queue_by_pos(qcm_df, pos)
             # mechanic data of queue_id
             mech_queue = mech_df.loc[[idx], :].copy()  # as a dataframe
 
@@ -0,0 +1,129 @@
+'''
+typed QCM data of a channel for mechanic calculation (QCM module)
+The values of each harmonic are saved in 2D arrays (rows x harmonics):
+    complex128 for fstars, delfstars and f0stars
+    float64 for marks and ps
+and the single values in 1D arrays (queue_id, t, temp).
+Columns of the old DataFrame (fs, gs, delfs, delgs, f0s, g0s) are views of the
+complex arrays.
+to_dataframe() makes the DataFrame with lists in cells for backwards compatibility.
+'''
+
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# columns of the DataFrame by to_dataframe
+df_cols = ['queue_id', 't', 'temp', 'marks', 'fstars', 'delfstars', 'f0stars', 'fs', 'gs', 'ps', 'delfs', 'delgs', 'f0s', 'g0s']
+
+
+class QCMFrame:
+    def __init__(self, index, queue_id, t, temp, marks, fstars, delfstars, f0stars, ps=None):
+        '''
+        index: row labels (the same as data table of the channel)
+        queue_id, t (s), temp (C): 1D arrays
+        marks, ps: 2D float arrays (rows x harmonics)
+        fstars, delfstars, f0stars: 2D complex arrays (rows x harmonics)
+        '''
+        self.index = np.asarray(index, dtype='int64')
+        self.queue_id = np.asarray(queue_id, dtype='int64')
+        self.t = np.asarray(t, dtype='float64')
+        self.temp = np.asarray(temp, dtype='float64')
+        self.marks = np.asarray(marks, dtype='float64')
+        self.fstars = np.asarray(fstars, dtype='complex128')
+        self.delfstars = np.asarray(delfstars, dtype='complex128')
+        self.f0stars = np.asarray(f0stars, dtype='complex128')
+        if ps is None:
+            ps = np.full(self.marks.shape, np.nan)
+        self.ps = np.asarray(ps, dtype='float64')
+        self._label_index = None # pd.Index of self.index for finding rows by labels (see self.positions)
+
+
+    def __len__(self):
+        return self.index.shape[0]
+
+
+    @property
+    def fs(self):
+        return self.fstars.real
+
+
+    @property
+    def gs(self):
+        return self.fstars.imag
+
+
+    @property
+    def delfs(self):
+        return self.delfstars.real
+
+
+    @property
+    def delgs(self):
+        return self.delfstars.imag
+
+
+    @property
+    def f0s(self):
+        return self.f0stars.real
+
+
+    @property
+    def g0s(self):
+        return self.f0stars.imag
+
+
+    def positions(self, labels):
+        '''
+        positions of rows by labels of index
+        raise KeyError if any label is not in index
+        the map of labels is built by the first call and reused
+        '''
+        if self._label_index is None:
+            self._label_index = pd.Index(self.index)
+        pos = self._label_index.get_indexer(np.atleast_1d(labels))
+        if (pos < 0).any():
+            raise KeyError(np.atleast_1d(labels)[pos < 0])
+        return pos
+
+
+    def rows(self, labels):
+        '''
+        return a new QCMFrame of rows with labels (the same as df.loc[labels, :])
+        '''
+        return self.take(self.positions(labels))
+
+
+    def take(self, positions):
+        '''
+        return a new QCMFrame of rows at positions
+        '''
+        return QCMFrame(
+            self.index[positions],
+            self.queue_id[positions],
+            self.t[positions],
+            self.temp[positions],
+            self.marks[positions],
+            self.fstars[positions],
+            self.delfstars[positions],
+            self.f0stars[positions],
+            ps=self.ps[positions],
+        )
+
+
+    def to_dataframe(self):
+        '''
+        return the DataFrame of data with lists in harmonic columns
+        (the same as returned by DataSaver.df_qcm before)
+        '''
+        data = {
+            'queue_id': self.queue_id,
+            't': self.t,
+            'temp': self.temp,
+        }
+        for col in df_cols[3:]:
+            data[col] = getattr(self, col).tolist()
+        return pd.DataFrame(data, index=self.index.copy(), columns=df_cols)
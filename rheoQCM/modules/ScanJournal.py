@@ -0,0 +1,225 @@
+'''
+write-ahead journal of scans of DataSaver
+Each scan (queue_id, t, temp, fs, gs, ps, marks and raw spectra) is appended to a side
+file (<data file>.journal) as a small sequential record before it is written to the h5 file.
+The records are discarded after the scans are written to the h5 file (compaction).
+If the program stops before that, the scans are recovered from the journal by
+DataSaver.load_file.
+
+File format:
+    magic (journal_magic)
+    records: header (struct '<II': length of payload, crc32 of payload) + payload
+    payload: length of meta (struct '<I') + meta (json, utf-8) + arrays
+    arrays: float64 arrays (C order) in the order of meta['arrays'] ([name, shape])
+A record cut by a crash (short or wrong crc) and everything after it are ignored.
+
+While a journal is open, an exclusive OS lock is held on a side file (<journal>.lock),
+so the journal of a running program is not replayed by another one (is_locked).
+The lock is released by the OS if the program stops.
+'''
+
+import os
+import json
+import struct
+import threading
+import zlib
+import numpy as np
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+journal_magic = b'QCMJOURNAL1\n'
+
+# struct of record header: length and crc32 of payload
+_header = struct.Struct('<II')
+# struct of length of meta
+_meta_len = struct.Struct('<I')
+
+# number of scans kept in journal before they are written to the h5 file
+compact_scans = 50
+
+# extension of the lock file of journal
+lock_ext = '.lock'
+
+
+def _lock(f):
+    '''
+    lock file f exclusively without waiting
+    raise OSError if it is locked by others
+    '''
+    if os.name == 'nt':
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(f):
+    if os.name == 'nt':
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def is_locked(path):
+    '''
+    True if the journal at path is open by a running ScanJournal (in this or another process)
+    '''
+    try:
+        f = open(path + lock_ext, 'a+b')
+    except FileNotFoundError:
+        return False
+    with f:
+        try:
+            _lock(f)
+        except OSError:
+            return True
+        _unlock(f)
+    return False
+
+
+def remove(path):
+    '''
+    remove the journal at path and its lock file
+    '''
+    for p in [path, path + lock_ext]:
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def pack_record(meta, arrays):
+    '''
+    make bytes of a record
+    meta: dict (json serializable)
+    arrays: dict of {name: ndarray}
+    '''
+    arrays = {name: np.ascontiguousarray(arr, dtype='float64') for name, arr in arrays.items()}
+    meta = dict(meta, arrays=[[name, list(arr.shape)] for name, arr in arrays.items()])
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    payload = b''.join([_meta_len.pack(len(meta_bytes)), meta_bytes] + [arr.tobytes() for arr in arrays.values()])
+    return _header.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def unpack_payload(payload):
+    '''
+    return (meta, arrays) of payload of a record
+    '''
+    n, = _meta_len.unpack_from(payload, 0)
+    offset = _meta_len.size
+    meta = json.loads(payload[offset:offset+n].decode('utf-8'))
+    offset += n
+    arrays = {}
+    for name, shape in meta.pop('arrays'):
+        size = int(np.prod(shape)) * 8
+        arrays[name] = np.frombuffer(payload, dtype='float64', count=size // 8, offset=offset).reshape(shape).copy()
+        offset += size
+    return meta, arrays
+
+
+def read_records(path):
+    '''
+    read records from journal file
+    return list of (meta, arrays) and the size of the valid part of file
+    '''
+    records = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(journal_magic):
+        logger.warning('%s is not a journal file', path)
+        return records, 0
+
+    offset = len(journal_magic)
+    while offset + _header.size <= len(data):
+        length, crc = _header.unpack_from(data, offset)
+        payload = data[offset+_header.size:offset+_header.size+length]
+        if len(payload) < length or zlib.crc32(payload) != crc: # cut by crash
+            logger.warning('broken record at %s of %s is ignored', offset, path)
+            break
+        records.append(unpack_payload(payload))
+        offset += _header.size + length
+    return records, offset
+
+
+class ScanJournal:
+    def __init__(self, path, compact_scans=compact_scans, fsync=True):
+        '''
+        start a new journal at path (the existing file is replaced)
+        raise OSError if the journal is open by another ScanJournal
+        compact_scans: number of scans kept in journal before they are written to the h5 file
+        fsync: if True, the records are synchronized to disk when appended
+        '''
+        self.path = path
+        self.compact_scans = compact_scans
+        self.fsync = fsync
+        self.seq = 0 # sequence number of last record
+        self._lock = threading.Lock() # records are appended and discarded from different threads
+        self._lock_f = open(self.path + lock_ext, 'a+b') # locked until closed
+        try:
+            _lock(self._lock_f)
+        except OSError:
+            self._lock_f.close()
+            raise OSError('journal {} is used by another program'.format(self.path))
+        self._f = open(self.path, 'wb')
+        self._f.write(journal_magic)
+        self._sync()
+
+
+    def _sync(self):
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+
+
+    def append(self, meta, arrays):
+        '''
+        append a record of meta (dict) and arrays (dict of ndarray)
+        return the sequence number of the record
+        '''
+        with self._lock:
+            self.seq += 1
+            self._f.write(pack_record(dict(meta, seq=self.seq), arrays))
+            self._sync()
+            return self.seq
+
+
+    def discard(self, seq):
+        '''
+        discard the records with sequence number <= seq (the scans are written to the h5 file)
+        '''
+        with self._lock:
+            self._f.close()
+            records, _ = read_records(self.path)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(journal_magic)
+                for meta, arrays in records:
+                    if meta['seq'] > seq:
+                        f.write(pack_record(meta, arrays))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._f = open(self.path, 'ab')
+            logger.info('journal discarded to %s', seq)
+
+
+    def close(self, remove=True):
+        '''
+        close the journal and release the lock
+        remove: if True, the file is removed
+        '''
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+            if remove and os.path.exists(self.path):
+                os.remove(self.path)
+            if not self._lock_f.closed:
+                _unlock(self._lock_f)
+                self._lock_f.close()
+                os.remove(self.path + lock_ext)
@@ -141,29 +141,31 @@ def sel_ind_dict(harms, sel_idx_dict, mode, marks):
     harms: list of harms for recalculating
     mode: 'all', 'marked', 'selpts', 'selidx', 'selharm'
     marks: df of marks in columns
+    indices are returned as sorted ndarray
     '''
+    index = marks.index.values
     data_idx_dict = {}
     for harm in harms:
         if 'mark'+ harm in marks.columns:
-            data_idx_dict[harm] = list(marks[marks['mark' + harm].notna()].index) # all the indices with data for each harm
+            data_idx_dict[harm] = np.sort(index[marks['mark' + harm].notna().values]) # all the indices with data for each harm
 
     if mode == 'all':
         sel_idx_dict = data_idx_dict  
     if mode == 'marked':
         for harm in harms:
             logger.info(harm) 
-            data_idx_dict[harm] = list(marks[marks['mark' + harm] == 1].index) # all the indices with data for each harm
+            data_idx_dict[harm] = np.sort(index[(marks['mark' + harm] == 1).values]) # all the indices with data for each harm
         sel_idx_dict = data_idx_dict  
         logger.info(sel_idx_dict) 
             
     if mode == 'selpts':
-        pass
+        for harm, idx in sel_idx_dict.items():
+            sel_idx_dict[harm] = np.unique(np.asarray(idx, dtype=int))
     elif mode == 'selidx':
-        idx_set = set()
-        for idx in sel_idx_dict.values():
-            idx_set |= set(idx)
+        # union of selected indices
+        idx_un = np.unique(np.concatenate([np.asarray(idx, dtype=int) for idx in sel_idx_dict.values()] + [np.array([], dtype=int)]))
         for harm in harms:
-            sel_idx_dict[harm] = list(idx_set & set(data_idx_dict[harm]))
+            sel_idx_dict[harm] = np.intersect1d(idx_un, data_idx_dict[harm])
     elif mode == 'selharm':
         for harm in sel_idx_dict.keys():
             sel_idx_dict[harm] = data_idx_dict[harm]
@@ -183,19 +185,24 @@ def idx_dict_to_harm_dict(sel_idx_dict):
         'index': [harm]
     }
     '''
-    # get union of indecies 
-    idx_set = set()
-    for idxs in sel_idx_dict.values():
-        idx_set |= set(idxs)
-    idx_un = list(idx_set)
+    harms = list(sel_idx_dict.keys())
+    idxs = [np.asarray(sel_idx_dict[harm], dtype=int) for harm in harms]
+    # get union of indecies (sorted)
+    idx_un = np.unique(np.concatenate(idxs + [np.array([], dtype=int)]))
     logger.info('idx_un %s', idx_un) 
 
+    # boolean array (indices x harms) of if the index is selected in harm
+    sel = np.zeros((len(idx_un), len(harms)), dtype=bool)
+    for j, idx in enumerate(idxs):
+        sel[np.searchsorted(idx_un, idx), j] = True
+
+    # code of the selected harms of each index (bit j for harms[j])
+    codes = sel.astype('int64') @ (1 << np.arange(len(harms), dtype='int64'))
+    code_harms = {code: [harms[j] for j in range(len(harms)) if code >> j & 1] for code in set(codes.tolist())}
+
     sel_harm_dict = {}
-    for idx in idx_un:
-        sel_harm_dict[idx] = []
-        for harm in sel_idx_dict.keys():
-            if idx in sel_idx_dict[harm]:
-                sel_harm_dict[idx].append(harm)
+    for idx, code in zip(idx_un.tolist(), codes.tolist()):
+        sel_harm_dict[idx] = list(code_harms[code])
         
     return sel_harm_dict
 
@@ -1569,6 +1569,21 @@ class QCMApp(QMainWindow):
 
             # test scheduler? start/end increasement
 
+            # write data to file by the background writer while recording
+            self.data_saver.start_writer()
+            swmr = config_default.get('swmr_mode', False)
+            if swmr:
+                # other processes can read the file while recording
+                # (the file written in SWMR mode is always readable, so no journal is needed)
+                try:
+                    self.data_saver.start_swmr()
+                except ValueError as e: # raw data in 'queue' layout
+                    logger.warning('SWMR mode is not available: %s', e)
+                    swmr = False
+            if not swmr:
+                # keep scans in journal until they are written to file
+                self.data_saver.start_journal()
+
             # start the timer
             self.timer.start(0)
 
@@ -1603,10 +1618,10 @@ class QCMApp(QMainWindow):
         '''
         process saving fitted data when test is stopped
         '''
-        # save data
-        self.data_saver.save_data()
-        # write UI information to file
+        # write data and UI information to file
         self.data_saver.save_data_settings(settings=self.settings) # TODO add exp_ref
+        # wait for the background writer and stop it. close the journal
+        self.data_saver.close()
 
         self.counter = 0 # reset counter
 
@@ -1946,7 +1961,7 @@ class QCMApp(QMainWindow):
         fileName = self.openFileNameDialog(title='Choose an existing file to append') # !! add path of last opened folder
         if fileName:
             # load UI settings
-            self.data_saver.load_file(fileName) # load factors from file to data_saver
+            self.data_saver.load_file(fileName, progress=self.set_progressbar_loading) # load factors from file to data_saver
             if not self.data_saver.settings: # failed to load file
                 process = self.process_messagebox(
                     text='Failed to load File',
@@ -2046,6 +2061,7 @@ class QCMApp(QMainWindow):
 
         if self.data_saver.path: # there is file
             self.data_saver.save_data_settings(settings=self.settings)
+            self.data_saver.flush()
             print('Data has been saved to file!')
         elif (not self.data_saver.path) & len(self.tempPath)>0: # name given but file not been created (no data)
             print('No data collected!')
@@ -2064,6 +2080,8 @@ class QCMApp(QMainWindow):
         # codes for data exporting
         if fileName:
             if self.data_saver.path: # there is file
+                # write the queued data before copying
+                self.data_saver.flush()
 
                 # copy file
                 try:
@@ -2616,6 +2634,8 @@ class QCMApp(QMainWindow):
         # get the vna reset flag
         freq_span = self.get_freq_span(harm=harm, chn_name=chn_name)
         steps = int(self.get_harmdata('lineEdit_scan_harmsteps', harm=harm, chn_name=chn_name))
+        if config_default['adaptive_steps']: # use the min steps for the tracked peak width with the new span
+            steps = self.peak_tracker.recommend_steps(freq_span[1] - freq_span[0], steps, chn_name=chn_name, harm=harm)
         setflg = self.vna_tracker.set_check(f=freq_span, steps=steps, chn=self.get_chn_by_name(chn_name))
         logger.info(setflg) 
         ret = self.vna.set_vna(setflg)
@@ -4497,11 +4517,11 @@ class QCMApp(QMainWindow):
         idx_joined = idx
         queue_ids = chn_queue_ids
 
-        # 2. get qcm data (columns=['queue_id', 't', 'temp', 'marks', 'fstars', 'fs', 'gs', 'delfstars', 'delfs', 'delgs', 'f0stars', 'f0s', 'g0s'])
+        # 2. get qcm data (QCMFrame with ['queue_id', 't', 'temp', 'marks', 'fstars', 'fs', 'gs', 'delfstars', 'delfs', 'delgs', 'f0stars', 'f0s', 'g0s'])
         # 'delf', 'delgs' may not necessary
-        qcm_df = self.data_saver.df_qcm(chn_name) 
+        qcm_df = self.data_saver.qcm_frame(chn_name) 
 
-        qcm_df_calc = qcm_df.loc[idx] # df of calc layer
+        qcm_df_calc = qcm_df.rows(idx) # data of calc layer
 
         # 3. layer calc's source and index
         if dic['source'] == 'ind': # dic is still where the loop break
@@ -4513,7 +4533,7 @@ class QCMApp(QMainWindow):
                 idx = calc_idx
                 idx_joined = calc_idx_joined
                 queue_ids = chn_queue_ids[idx_joined] # overwrite queue_id with queue_id calculated with given idx
-                qcm_df_calc = qcm_df.loc[idx_joined] # df of calc layer
+                qcm_df_calc = qcm_df.rows(idx_joined) # data of calc layer
             else: # idx_joined = []
                 # logger.info('idx_joined is empty') 
                 pass
@@ -4594,7 +4614,7 @@ class QCMApp(QMainWindow):
                     qcm_df_layer_chn = self.data_saver.df_qcm(layer_chn)
                     qcm_df_layer = qcm_df_layer_chn.loc[idx_layer_joined] # df of current layer
                     # create qcm_df by interpolation
-                    qcm_df_layer = self.data_saver.shape_qcmdf_b_to_a(qcm_df_calc, qcm_df_layer, idx, idx_layer)
+                    qcm_df_layer = self.data_saver.shape_qcmdf_b_to_a(qcm_df_calc.to_dataframe(), qcm_df_layer, idx, idx_layer)
                     # get values for each
                     # logger.info('qcm_df_layer', qcm_df_layer) 
 
@@ -4622,10 +4642,10 @@ class QCMApp(QMainWindow):
         
         # if live update is not needed, use QCM.analyze to replace. the codes should be the same
         nh = QCM.nhcalc2nh(nhcalc)
-        for ind in idx_joined: # iterate all ids
+        for ind, pos in zip(idx_joined, qcm_df.positions(idx_joined)): # iterate all ids
             # logger.info('ind', ind) 
             # qcm data of queue_id
-            qcm_queue = qcm_df.loc[[ind], :].copy() # as a dataframe
+            qcm_queue = qcm_df.take([pos]) # as a QCMFrame
             # mechanic data of queue_id
             mech_queue = mech_df.loc[[ind], :].copy()  # as a dataframe 
             # !! The copy here will not work, since mech_df contains object and the data change to mech_queue will be updated in mech_df 
@@ -4660,7 +4680,7 @@ class QCMApp(QMainWindow):
 
         if not self.settings['checkBox_settings_mech_liveupdate']: 
             # update table
-            self.update_spectra_mechanics_table(chn_name, qcm_queue, mech_queue)
+            self.update_spectra_mechanics_table(chn_name, qcm_queue.to_dataframe(), mech_queue)
 
 
     def backup_mech_solve_chn(self, chn_name, queue_ids):
@@ -4684,6 +4704,8 @@ class QCMApp(QMainWindow):
         # get qcm data (columns=['queue_id', 't', 'temp', 'marks', 'fstars', 'fs', 'gs', 'delfstars', 'delfs', 'delgs', 'f0stars', 'f0s', 'g0s'])
         # 'delf', 'delgs' may not necessary
         qcm_df = self.data_saver.df_qcm(chn_name)
+        # {queue_id: index} of qcm_df (the first one if queue_id is repeated)
+        qcm_idx = dict(zip(qcm_df.queue_id.tolist()[::-1], qcm_df.index.astype(int).tolist()[::-1]))
 
         # do calc with each nhcalc
         for nhcalc in nhcalc_list:
@@ -4698,7 +4720,7 @@ class QCMApp(QMainWindow):
                 # logger.info('qcm_df: %s', qcm_df) 
                 logger.info(type(qcm_df)) 
                 # queue index
-                idx = qcm_df[qcm_df.queue_id == queue_id].index.astype(int)[0]
+                idx = qcm_idx[queue_id]
                 # idx = qcm_df[qcm_df.queue_id == queue_id].index
                 logger.info('index: %s', qcm_df.index) 
                 logger.info('index: %s', mech_df.index) 
@@ -4833,7 +4855,7 @@ class QCMApp(QMainWindow):
         if not self.data_saver.path: # no data
             return
 
-        qcm_df = self.data_saver.df_qcm(chn_name)
+        qcm_df = self.data_saver.qcm_frame(chn_name)
         
         # check index range
         if ind not in qcm_df.index:
@@ -4863,10 +4885,10 @@ class QCMApp(QMainWindow):
 
             # get queue_id
             # logger.info(qcm_df.queue_id) 
-            queue_id = qcm_df.queue_id.loc[ind]
+            queue_id = qcm_df.queue_id[qcm_df.positions(ind)[0]]
 
             # qcm data of queue_id
-            qcm_queue = qcm_df.loc[[ind], :].copy() # as a dataframe
+            qcm_queue = qcm_df.rows([ind]).to_dataframe() # as a dataframe
             # mechanic data of queue_id
             mech_queue = mech_df.loc[[ind], :].copy()  # as a dataframe 
             # logger.info('qcm_queue: %s', qcm_queue) 
@@ -6655,6 +6677,15 @@ class QCMApp(QMainWindow):
         self.ui.progressBar_status_interval_time.setFormat(text)
 
 
+    def set_progressbar_loading(self, val=0, text=''):
+        '''
+        update progressBar_status_interval_time with the stage of loading file
+        and process the events to show it while loading
+        '''
+        self.set_progressbar(val=val, text='Loading {}'.format(text) if text else '')
+        QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+
     def data_collection(self):
         '''
         data collecting routine
@@ -6872,7 +6903,7 @@ class QCMApp(QMainWindow):
             # save raw
             self.data_saver.dynamic_save(chn_name_list, harm_list, t=curr_time, temp=curr_temp, f=f, G=G, B=B, fs=fs, gs=gs, ps=ps, marks=marks)
 
-            # save data (THIS MIGHT MAKE THE PROCESS SLOW)
+            # save data (only the rows changed since last saving are written)
             self.data_saver.save_data()
 
             # plot data
@@ -1,6 +1,7 @@
 '''
 This code uses h5repack from "HDF5 TOOlS". 
 Install it before running this code.'
+rheoQCM/modules/H5Compact.py does the same with h5py only (python -m modules.H5Compact in rheoQCM folder).
 '''
 
 import os